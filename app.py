@@ -1,22 +1,136 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from sqlalchemy import bindparam, create_engine, event
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, joinedload, object_session
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from bisect import bisect_left, insort
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
 import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
+import numpy as np
+
+try:
+    import zstandard  # Opcional: compresión zstd de los respaldos
+except ImportError:
+    zstandard = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'tu-clave-secreta-aqui'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sistema_ventas.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///sistema_ventas.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Perfil de almacenamiento SQLite (se puede ajustar con variables de entorno)
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),  # Lectores y escritores concurrentes
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),  # Seguro con WAL y más rápido que FULL
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms esperando un bloqueo
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),  # Negativo = KiB por conexión
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),  # Lectura por memoria mapeada
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': QueuePool,
+    'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('SQLITE_POOL_MAX_OVERFLOW', 10)),
+    'pool_timeout': int(os.environ.get('SQLITE_POOL_TIMEOUT', 30)),
+    'connect_args': {
+        'check_same_thread': False,  # Las conexiones del pool pasan entre hilos
+        'timeout': app.config['SQLITE_PRAGMAS']['busy_timeout'] / 1000
+    }
+}
+
+# Respaldos en línea: páginas copiadas por paso, pausa entre pasos (segundos) y compresión
+app.config['RESPALDO_PAGINAS_POR_PASO'] = int(os.environ.get('RESPALDO_PAGINAS_POR_PASO', 256))
+app.config['RESPALDO_PAUSA'] = float(os.environ.get('RESPALDO_PAUSA', 0.005))
+app.config['RESPALDO_COMPRESION'] = os.environ.get('RESPALDO_COMPRESION', 'gzip')  # gzip, zstd o ninguna
+app.config['RESPALDO_PAGINAS_POR_BLOQUE'] = int(os.environ.get('RESPALDO_PAGINAS_POR_BLOQUE', 16))  # Unidad de deduplicación
+
+# Respaldos programados: cada cuánto, cuántos conservar por hora/día/semana y límite de disco
+app.config['RESPALDO_PROGRAMADO'] = os.environ.get('RESPALDO_PROGRAMADO', '1') == '1'
+app.config['RESPALDO_INTERVALO_MINUTOS'] = int(os.environ.get('RESPALDO_INTERVALO_MINUTOS', 60))
+app.config['RESPALDO_RETENER_HORARIOS'] = int(os.environ.get('RESPALDO_RETENER_HORARIOS', 24))
+app.config['RESPALDO_RETENER_DIARIOS'] = int(os.environ.get('RESPALDO_RETENER_DIARIOS', 7))
+app.config['RESPALDO_RETENER_SEMANALES'] = int(os.environ.get('RESPALDO_RETENER_SEMANALES', 4))
+app.config['RESPALDO_LIMITE_BYTES_SEGUNDO'] = int(os.environ.get('RESPALDO_LIMITE_BYTES_SEGUNDO', 8 * 1024 * 1024))  # 0 = sin límite
+
+# Zona horaria del negocio: define a qué día local pertenece cada venta y ganancia
+app.config['ZONA_HORARIA'] = os.environ.get('ZONA_HORARIA', 'America/Lima')
+
+# Segundos que se conserva en memoria la identidad de un usuario autenticado
+app.config['USUARIO_CACHE_TTL'] = int(os.environ.get('USUARIO_CACHE_TTL', 300))
+
 db = SQLAlchemy(app)
+
+# Valores aceptados por cada PRAGMA del perfil: palabras clave o enteros
+VALORES_PRAGMAS_SQLITE = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'busy_timeout': int,
+    'cache_size': int,
+    'mmap_size': int,
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'}
+}
+
+def sentencia_pragma(pragma, valor):
+    """PRAGMA del perfil con su valor validado (los valores vienen de variables de entorno)"""
+    aceptados = VALORES_PRAGMAS_SQLITE.get(pragma)
+    if aceptados is None:
+        raise ValueError(f'PRAGMA no permitido en SQLITE_PRAGMAS: {pragma}')
+    if aceptados is int:
+        return f'PRAGMA {pragma}={int(valor)}'
+    if str(valor).upper() not in aceptados:
+        raise ValueError(f'Valor no válido para PRAGMA {pragma}: {valor}')
+    return f'PRAGMA {pragma}={str(valor).upper()}'
+
+def aplicar_pragmas_sqlite(conexion_dbapi, registro_conexion):
+    """Aplica el perfil de almacenamiento a cada conexión nueva del engine de la aplicación"""
+    cursor = conexion_dbapi.cursor()
+    for pragma, valor in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(sentencia_pragma(pragma, valor))
+    cursor.close()
+
+with app.app_context():
+    event.listen(db.engine, 'connect', aplicar_pragmas_sqlite)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+ZONA_HORARIA = ZoneInfo(app.config['ZONA_HORARIA'])
+
+def fecha_local(fecha_utc):
+    """Convierte una fecha UTC al día local del negocio"""
+    return fecha_utc.replace(tzinfo=timezone.utc).astimezone(ZONA_HORARIA).date()
+
+def hoy_local():
+    """Día local actual del negocio"""
+    return datetime.now(ZONA_HORARIA).date()
+
+def fecha_local_por_defecto(contexto):
+    """Valor de la columna fecha_local al insertar: el día local de la columna fecha"""
+    return fecha_local(contexto.get_current_parameters().get('fecha') or datetime.utcnow())
+
 # Modelo de Usuario
 class Usuario(UserMixin, db.Model):
     __tablename__ = 'usuario'
@@ -43,6 +157,7 @@ class Categoria(db.Model):
 # Modelo de Producto
 class Producto(db.Model):
     __tablename__ = 'producto'
+    __table_args__ = (db.Index('ix_producto_nombre', 'nombre'),)
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     descripcion = db.Column(db.Text)
@@ -65,6 +180,7 @@ class Producto(db.Model):
 # Modelo de Stock
 class Stock(db.Model):
     __tablename__ = 'stock'
+    __table_args__ = (db.Index('ix_stock_producto_id', 'producto_id'),)
     id = db.Column(db.Integer, primary_key=True)
     producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
     cantidad_disponible = db.Column(db.Integer, default=0)
@@ -74,6 +190,7 @@ class Stock(db.Model):
 # Modelo de Cliente
 class Cliente(db.Model):
     __tablename__ = 'cliente'
+    __table_args__ = (db.Index('ix_cliente_nombre', 'nombre'),)
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     telefono = db.Column(db.String(20))
@@ -105,14 +222,22 @@ venta_producto = db.Table('venta_producto',
     db.Column('venta_id', db.Integer, db.ForeignKey('venta.id'), primary_key=True),
     db.Column('producto_id', db.Integer, db.ForeignKey('producto.id'), primary_key=True),
     db.Column('cantidad', db.Integer, nullable=False),
-    db.Column('precio_unitario', db.Float, nullable=False)
+    db.Column('precio_unitario', db.Float, nullable=False),
+    db.Index('ix_venta_producto_producto_id', 'producto_id')
 )
 
 # Modelo de Venta (entidad central)
 class Venta(db.Model):
     __tablename__ = 'venta'
+    __table_args__ = (
+        db.Index('ix_venta_fecha_id', 'fecha', 'id'),  # Paginación por cursor
+        db.Index('ix_venta_vendedor_fecha', 'vendedor_id', 'fecha'),
+        db.Index('ix_venta_cliente_fecha', 'cliente_id', 'fecha'),
+        db.Index('ix_venta_fecha_local', 'fecha_local')
+    )
     id = db.Column(db.Integer, primary_key=True)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_local = db.Column(db.Date, default=fecha_local_por_defecto)  # Día del negocio (ZONA_HORARIA)
     total = db.Column(db.Float, nullable=False)
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
     lugar_entrega_id = db.Column(db.Integer, db.ForeignKey('lugar_entrega.id'), nullable=False)
@@ -136,6 +261,14 @@ class Venta(db.Model):
 # Modelo de Ganancias (para tracking histórico)
 class Ganancias(db.Model):
     __tablename__ = 'ganancias'
+    __table_args__ = (
+        db.Index('ix_ganancias_fecha', 'fecha'),
+        db.Index('ix_ganancias_venta_id', 'venta_id'),
+        # Cubre el historial (ordenado por fecha e id) y los totales por producto sin leer la tabla
+        db.Index('ix_ganancias_producto_fecha', 'producto_id', 'fecha', 'id', 'cantidad_vendida', 'ganancia_total'),
+        # Cubre los totales del día y los resúmenes diarios
+        db.Index('ix_ganancias_fecha_local', 'fecha_local', 'cantidad_vendida', 'ganancia_total')
+    )
     id = db.Column(db.Integer, primary_key=True)
     producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
     venta_id = db.Column(db.Integer, db.ForeignKey('venta.id'), nullable=False)
@@ -145,13 +278,735 @@ class Ganancias(db.Model):
     ganancia_unitaria = db.Column(db.Float, nullable=False)
     ganancia_total = db.Column(db.Float, nullable=False)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_local = db.Column(db.Date, default=fecha_local_por_defecto)  # Día del negocio (ZONA_HORARIA)
     
     producto = db.relationship('Producto', backref='ganancias')
     venta = db.relationship('Venta', backref='ganancias')
 
+# Resumen de ganancias por producto (mantenido junto con cada registro de Ganancias)
+class GananciasPorProducto(db.Model):
+    __tablename__ = 'ganancias_por_producto'
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), primary_key=True)
+    ganancia_total = db.Column(db.Float, nullable=False, default=0)
+    cantidad_vendida = db.Column(db.Integer, nullable=False, default=0)
+    suma_ganancia_unitaria = db.Column(db.Float, nullable=False, default=0)  # Para calcular el promedio
+    registros = db.Column(db.Integer, nullable=False, default=0)
+
+# Resumen de ganancias por día local (ZONA_HORARIA)
+class GananciasDiarias(db.Model):
+    __tablename__ = 'ganancias_diarias'
+    fecha = db.Column(db.Date, primary_key=True)
+    ganancia_diaria = db.Column(db.Float, nullable=False, default=0)
+    cantidad_vendida = db.Column(db.Integer, nullable=False, default=0)
+    registros = db.Column(db.Integer, nullable=False, default=0)
+
+# Series de ganancias por periodo local, en total y por producto, vendedor y categoría.
+# El periodo es texto ordenable: '2026-10-16T20' (hora), '2026-10-16' (día),
+# el lunes de la semana ('2026-10-12') o '2026-10' (mes)
+class GananciasSerie(db.Model):
+    __tablename__ = 'ganancias_serie'
+    __table_args__ = (
+        db.Index('ix_ganancias_serie_periodo', 'granularidad', 'dimension', 'periodo'),
+    )
+    granularidad = db.Column(db.String(10), primary_key=True)  # hora, dia, semana, mes
+    dimension = db.Column(db.String(20), primary_key=True)  # total, producto, vendedor, categoria
+    clave = db.Column(db.Integer, primary_key=True)  # ID del producto, vendedor o categoría (0 en total)
+    periodo = db.Column(db.String(13), primary_key=True)
+    ganancia_total = db.Column(db.Float, nullable=False, default=0)
+    cantidad_vendida = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(db.Float, nullable=False, default=0)
+    registros = db.Column(db.Integer, nullable=False, default=0)
+
+# Versiones de los datos (aumentan con cada escritura para detectar cambios)
+class VersionDatos(db.Model):
+    __tablename__ = 'version_datos'
+    nombre = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Contadores de filas, mantenidos por triggers de SQLite (migración 2 en MIGRACIONES)
+# para que también cuenten las inserciones masivas que no pasan por el ORM
+TABLAS_CONTADAS = ['producto', 'cliente', 'venta', 'lugar_entrega']
+
+class Contador(db.Model):
+    __tablename__ = 'contador'
+    nombre = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+
+def obtener_contadores():
+    """Filas de cada tabla contada, leídas de la tabla de contadores"""
+    contadores = dict.fromkeys(TABLAS_CONTADAS, 0)
+    contadores.update(db.session.query(Contador.nombre, Contador.valor).filter(Contador.nombre.in_(TABLAS_CONTADAS)).all())
+    return contadores
+
+def incrementar_version(*nombres, conexion=None):
+    """Aumenta las versiones indicadas dentro de la transacción actual"""
+    conexion = conexion or db.session
+    tabla = VersionDatos.__table__
+    for nombre in nombres:
+        stmt = sqlite_insert(tabla).values(nombre=nombre, version=1)
+        conexion.execute(stmt.on_conflict_do_update(
+            index_elements=['nombre'],
+            set_={'version': tabla.c.version + 1}
+        ))
+
+def obtener_version(nombre):
+    """Versión actual de un conjunto de datos (0 si nunca ha cambiado)"""
+    return db.session.query(VersionDatos.version).filter_by(nombre=nombre).scalar() or 0
+
+# Modelo de Trabajo (importaciones, exportaciones y respaldos en segundo plano)
+class Trabajo(db.Model):
+    __tablename__ = 'trabajo'
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, en_proceso, completado, error
+    progreso = db.Column(db.Integer, default=0)
+    mensaje = db.Column(db.Text)
+    errores = db.Column(db.Text)  # Lista JSON
+    archivo = db.Column(db.String(255))  # Archivo resultante, si lo hay
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_fin = db.Column(db.DateTime)
+
+def registrar_en_resumenes(registros):
+    """Suma filas (id, producto_id, fecha, cantidad, ganancia_unitaria, ganancia_total) ya
+    insertadas en ganancias a las tablas de resumen.
+    
+    Devuelve (id, producto_id, fecha, ganancia_total) de cada registro contabilizado.
+    """
+    por_producto = {}
+    por_dia = {}
+    registrados = []
+    incrementar_version('ganancias')
+    
+    for ganancia_id, producto_id, fecha, cantidad, ganancia_unitaria, ganancia_total in registros:
+        if not cantidad or cantidad <= 0:
+            continue
+        registrados.append((ganancia_id, producto_id, fecha, ganancia_total))
+        
+        resumen = por_producto.setdefault(producto_id, [0.0, 0, 0.0, 0])
+        resumen[0] += ganancia_total
+        resumen[1] += cantidad
+        resumen[2] += ganancia_unitaria
+        resumen[3] += 1
+        
+        resumen = por_dia.setdefault(fecha_local(fecha), [0.0, 0, 0])
+        resumen[0] += ganancia_total
+        resumen[1] += cantidad
+        resumen[2] += 1
+    
+    tabla = GananciasPorProducto.__table__
+    for producto_id, (ganancia_total, cantidad, suma_unitaria, registros) in por_producto.items():
+        stmt = sqlite_insert(tabla).values(
+            producto_id=producto_id,
+            ganancia_total=ganancia_total,
+            cantidad_vendida=cantidad,
+            suma_ganancia_unitaria=suma_unitaria,
+            registros=registros
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['producto_id'],
+            set_={
+                'ganancia_total': tabla.c.ganancia_total + stmt.excluded.ganancia_total,
+                'cantidad_vendida': tabla.c.cantidad_vendida + stmt.excluded.cantidad_vendida,
+                'suma_ganancia_unitaria': tabla.c.suma_ganancia_unitaria + stmt.excluded.suma_ganancia_unitaria,
+                'registros': tabla.c.registros + stmt.excluded.registros
+            }
+        ))
+    
+    tabla = GananciasDiarias.__table__
+    for dia, (ganancia_total, cantidad, registros) in por_dia.items():
+        stmt = sqlite_insert(tabla).values(
+            fecha=dia,
+            ganancia_diaria=ganancia_total,
+            cantidad_vendida=cantidad,
+            registros=registros
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['fecha'],
+            set_={
+                'ganancia_diaria': tabla.c.ganancia_diaria + stmt.excluded.ganancia_diaria,
+                'cantidad_vendida': tabla.c.cantidad_vendida + stmt.excluded.cantidad_vendida,
+                'registros': tabla.c.registros + stmt.excluded.registros
+            }
+        ))
+    
+    if registrados:
+        ids = [registrado[0] for registrado in registrados]
+        filas = []
+        for i in range(0, len(ids), 500):
+            filas.extend(db.session.execute(consulta_series().where(Ganancias.id.in_(ids[i:i + 500]))))
+        acumular_series(filas)
+    
+    return registrados
+
+def insertar_devolviendo_ids(tabla, filas):
+    """Inserta las filas por lotes y devuelve los IDs que les asignó la base, en el mismo orden"""
+    resultado = db.session.execute(tabla.insert().returning(tabla.c.id, sort_by_parameter_order=True), filas)
+    return resultado.scalars().all()
+
+def descontar_resumenes_producto(producto_id):
+    """Quita de los resúmenes las ganancias de un producto antes de eliminarlo"""
+    acumular_series(db.session.execute(
+        consulta_series().where(Ganancias.producto_id == producto_id)
+    ), signo=-1)
+    por_dia = db.session.query(
+        Ganancias.fecha_local.label('fecha'),
+        db.func.sum(Ganancias.ganancia_total).label('ganancia_diaria'),
+        db.func.sum(Ganancias.cantidad_vendida).label('cantidad_vendida'),
+        db.func.count(Ganancias.id).label('registros')
+    ).filter(
+        Ganancias.producto_id == producto_id,
+        Ganancias.cantidad_vendida > 0
+    ).group_by(Ganancias.fecha_local).all()
+    
+    for row in por_dia:
+        GananciasDiarias.query.filter_by(fecha=row.fecha).update({
+            GananciasDiarias.ganancia_diaria: GananciasDiarias.ganancia_diaria - row.ganancia_diaria,
+            GananciasDiarias.cantidad_vendida: GananciasDiarias.cantidad_vendida - row.cantidad_vendida,
+            GananciasDiarias.registros: GananciasDiarias.registros - row.registros
+        }, synchronize_session=False)
+    GananciasDiarias.query.filter(GananciasDiarias.registros <= 0).delete(synchronize_session=False)
+    GananciasPorProducto.query.filter_by(producto_id=producto_id).delete(synchronize_session=False)
+    incrementar_version('ganancias', 'ganancias_reinicio')
+
+def reconstruir_resumenes_ganancias(conexion=None):
+    """Recalcula desde cero las tablas de resumen a partir de Ganancias.
+    
+    Sin conexion usa la sesión y confirma; con conexion (otra base, como la que se
+    prepara al restaurar) queda dentro de la transacción de quien llama.
+    """
+    ejecutar = conexion or db.session
+    ejecutar.execute(GananciasPorProducto.__table__.delete())
+    ejecutar.execute(GananciasDiarias.__table__.delete())
+    
+    ejecutar.execute(GananciasPorProducto.__table__.insert().from_select(
+        ['producto_id', 'ganancia_total', 'cantidad_vendida', 'suma_ganancia_unitaria', 'registros'],
+        db.select(
+            Ganancias.producto_id,
+            db.func.sum(Ganancias.ganancia_total),
+            db.func.sum(Ganancias.cantidad_vendida),
+            db.func.sum(Ganancias.ganancia_unitaria),
+            db.func.count(Ganancias.id)
+        ).filter(Ganancias.cantidad_vendida > 0).group_by(Ganancias.producto_id)
+    ))
+    
+    ejecutar.execute(GananciasDiarias.__table__.insert().from_select(
+        ['fecha', 'ganancia_diaria', 'cantidad_vendida', 'registros'],
+        db.select(
+            Ganancias.fecha_local,
+            db.func.sum(Ganancias.ganancia_total),
+            db.func.sum(Ganancias.cantidad_vendida),
+            db.func.count(Ganancias.id)
+        ).filter(Ganancias.cantidad_vendida > 0).group_by(Ganancias.fecha_local)
+    ))
+    reconstruir_series(conexion or db.session.connection())
+    incrementar_version('ganancias', 'ganancias_reinicio', conexion=conexion)
+    if conexion is None:
+        db.session.commit()
+
+def obtener_ganancias_por_producto(producto_ids=None):
+    """Ganancias por producto leídas desde la tabla de resumen"""
+    consulta = db.session.query(
+        Producto.id,
+        Producto.nombre,
+        Producto.precio,
+        Producto.precio_compra,
+        GananciasPorProducto.ganancia_total,
+        GananciasPorProducto.cantidad_vendida,
+        GananciasPorProducto.suma_ganancia_unitaria,
+        GananciasPorProducto.registros
+    ).join(GananciasPorProducto, GananciasPorProducto.producto_id == Producto.id).filter(
+        GananciasPorProducto.registros > 0
+    )
+    if producto_ids is not None:
+        consulta = consulta.filter(GananciasPorProducto.producto_id.in_(producto_ids))
+    filas = consulta.order_by(Producto.id).all()
+    
+    ganancias_por_producto = []
+    for row in filas:
+        ganancias_por_producto.append({
+            'id': row.id,
+            'nombre': row.nombre,
+            'precio': float(row.precio),
+            'precio_compra': float(row.precio_compra),
+            'ganancia_total': float(row.ganancia_total or 0),
+            'cantidad_vendida': int(row.cantidad_vendida or 0),
+            'ganancia_promedio': float(row.suma_ganancia_unitaria / row.registros),
+            'diferencia_precio': float(row.precio - row.precio_compra)
+        })
+    return ganancias_por_producto
+
+def obtener_ganancias_diarias(fechas=None):
+    """Ganancias por día local leídas desde la tabla de resumen"""
+    consulta = GananciasDiarias.query.filter(GananciasDiarias.registros > 0)
+    if fechas is not None:
+        consulta = consulta.filter(GananciasDiarias.fecha.in_(fechas))
+    filas = consulta.order_by(GananciasDiarias.fecha).all()
+    
+    return [{
+        'fecha': str(row.fecha),
+        'ganancia_diaria': float(row.ganancia_diaria or 0)
+    } for row in filas]
+
+# Series por periodo: las ventas se suman en horas y cada granularidad más amplia se
+# obtiene de la anterior (día de las horas, semana y mes de los días)
+GRANULARIDADES = ['hora', 'dia', 'semana', 'mes']
+DIMENSIONES_SERIE = {
+    'producto': (Producto, Producto.nombre),
+    'vendedor': (Usuario, Usuario.username),
+    'categoria': (Categoria, Categoria.nombre)
+}
+
+def lunes_de(dia):
+    """Lunes de la semana de un día 'YYYY-MM-DD'"""
+    fecha = datetime.strptime(dia, '%Y-%m-%d').date()
+    return (fecha - timedelta(days=fecha.weekday())).isoformat()
+
+# granularidad: (granularidad de origen, periodo a partir del de origen, lo mismo en SQL)
+PERIODOS_DERIVADOS = {
+    'dia': ('hora', lambda periodo: periodo[:10], "substr(periodo, 1, 10)"),
+    'semana': ('dia', lunes_de, "date(periodo, 'weekday 0', '-6 days')"),
+    'mes': ('dia', lambda periodo: periodo[:7], "substr(periodo, 1, 7)")
+}
+
+def periodo_hora(fecha_utc):
+    """Hora local 'YYYY-MM-DDTHH' de una fecha UTC"""
+    return fecha_utc.replace(tzinfo=timezone.utc).astimezone(ZONA_HORARIA).strftime('%Y-%m-%dT%H')
+
+def periodo_de(granularidad, dia):
+    """Periodo de la granularidad indicada que contiene un día local"""
+    periodo = dia.isoformat()
+    if granularidad == 'hora':
+        return periodo + 'T00'
+    if granularidad == 'dia':
+        return periodo
+    return PERIODOS_DERIVADOS[granularidad][1](periodo)
+
+def consulta_series():
+    """Filas de ganancias con los datos que necesitan las series"""
+    return db.select(
+        Ganancias.fecha,
+        Ganancias.producto_id,
+        Venta.vendedor_id,
+        Producto.categoria_id,
+        Ganancias.cantidad_vendida,
+        Ganancias.ganancia_total,
+        Ganancias.precio_venta * Ganancias.cantidad_vendida
+    ).join(Venta, Venta.id == Ganancias.venta_id).join(
+        Producto, Producto.id == Ganancias.producto_id
+    ).where(Ganancias.cantidad_vendida > 0)
+
+def series_por_hora(filas, dimensiones=None):
+    """Agrupa filas de consulta_series en periodos de una hora (opcionalmente solo algunas dimensiones)"""
+    periodos = {}
+    for fecha, producto_id, vendedor_id, categoria_id, cantidad, ganancia_total, ingresos in filas:
+        hora = periodo_hora(fecha)
+        for dimension, clave in [('total', 0), ('producto', producto_id),
+                                 ('vendedor', vendedor_id), ('categoria', categoria_id)]:
+            if dimensiones and dimension not in dimensiones:
+                continue
+            acumulado = periodos.setdefault(('hora', dimension, clave, hora), [0.0, 0, 0.0, 0])
+            acumulado[0] += ganancia_total
+            acumulado[1] += cantidad
+            acumulado[2] += ingresos
+            acumulado[3] += 1
+    return periodos
+
+def guardar_series(periodos, signo=1, conexion=None):
+    """Suma (o resta, con signo=-1) los periodos a la tabla de series"""
+    if not periodos:
+        return
+    conexion = conexion or db.session
+    tabla = GananciasSerie.__table__
+    stmt = sqlite_insert(tabla)
+    conexion.execute(stmt.on_conflict_do_update(
+        index_elements=['granularidad', 'dimension', 'clave', 'periodo'],
+        set_={
+            'ganancia_total': tabla.c.ganancia_total + stmt.excluded.ganancia_total,
+            'cantidad_vendida': tabla.c.cantidad_vendida + stmt.excluded.cantidad_vendida,
+            'ingresos': tabla.c.ingresos + stmt.excluded.ingresos,
+            'registros': tabla.c.registros + stmt.excluded.registros
+        }
+    ), [{
+        'granularidad': granularidad,
+        'dimension': dimension,
+        'clave': clave,
+        'periodo': periodo,
+        'ganancia_total': signo * ganancia_total,
+        'cantidad_vendida': signo * cantidad,
+        'ingresos': signo * ingresos,
+        'registros': signo * registros
+    } for (granularidad, dimension, clave, periodo), (ganancia_total, cantidad, ingresos, registros) in periodos.items()])
+    if signo < 0:
+        conexion.execute(tabla.delete().where(tabla.c.registros <= 0))
+
+def acumular_series(filas, signo=1, dimensiones=None):
+    """Suma a las series las filas de consulta_series, en horas y en los periodos derivados"""
+    periodos = series_por_hora(filas, dimensiones)
+    for granularidad, (origen, derivar, _) in PERIODOS_DERIVADOS.items():
+        for (granularidad_fila, dimension, clave, periodo), valores in list(periodos.items()):
+            if granularidad_fila != origen:
+                continue
+            acumulado = periodos.setdefault((granularidad, dimension, clave, derivar(periodo)), [0.0, 0, 0.0, 0])
+            for i, valor in enumerate(valores):
+                acumulado[i] += valor
+    guardar_series(periodos, signo)
+
+def mover_series_categoria(producto_id, categoria_id):
+    """Pasa las ventas ya registradas de un producto a las series de su nueva categoría.
+    
+    Debe llamarse antes de cambiar producto.categoria_id: la consulta aún ve la categoría anterior.
+    """
+    filas = db.session.execute(consulta_series().where(Ganancias.producto_id == producto_id)).all()
+    acumular_series(filas, signo=-1, dimensiones=('categoria',))
+    acumular_series([fila[:3] + (categoria_id,) + fila[4:] for fila in filas], dimensiones=('categoria',))
+
+def reconstruir_series(conexion, tamaño_lote=5000):
+    """Recalcula las series: las horas desde Ganancias por lotes y el resto con GROUP BY"""
+    conexion.execute(GananciasSerie.__table__.delete())
+    ultimo_id = 0
+    while True:
+        filas = conexion.execute(
+            consulta_series().add_columns(Ganancias.id).where(Ganancias.id > ultimo_id)
+            .order_by(Ganancias.id).limit(tamaño_lote)
+        ).all()
+        if not filas:
+            break
+        guardar_series(series_por_hora(fila[:-1] for fila in filas), conexion=conexion)
+        ultimo_id = filas[-1][-1]
+    
+    for granularidad, (origen, _, periodo_sql) in PERIODOS_DERIVADOS.items():
+        conexion.exec_driver_sql(
+            'INSERT INTO ganancias_serie (granularidad, dimension, clave, periodo, '
+            'ganancia_total, cantidad_vendida, ingresos, registros) '
+            f'SELECT ?, dimension, clave, {periodo_sql}, sum(ganancia_total), sum(cantidad_vendida), '
+            f'sum(ingresos), sum(registros) FROM ganancias_serie WHERE granularidad = ? '
+            f'GROUP BY dimension, clave, {periodo_sql}',
+            (granularidad, origen))
+
+# Canal de eventos en memoria para notificar nuevas ganancias (Server-Sent Events)
+class CanalGanancias:
+    def __init__(self, capacidad=200):
+        self.condicion = threading.Condition()
+        self.eventos = deque(maxlen=capacidad)
+        self.ultimo_id = 0
+        self.minimo_id = 0  # Los clientes anteriores a este evento deben recargar todo
+    
+    def publicar(self, datos):
+        """Guarda un evento y despierta a los clientes conectados"""
+        with self.condicion:
+            self.ultimo_id += 1
+            self.eventos.append((self.ultimo_id, json.dumps(datos)))
+            self.condicion.notify_all()
+    
+    def esperar(self, desde_id, timeout):
+        """Eventos posteriores a desde_id, o None si ya no están en memoria"""
+        with self.condicion:
+            if self.ultimo_id <= desde_id:
+                self.condicion.wait(timeout)
+            if desde_id > self.ultimo_id or desde_id < self.minimo_id:
+                return None  # El servidor se reinició o se restauró la base
+            if self.eventos and self.eventos[0][0] > desde_id + 1:
+                return None  # El cliente se perdió eventos antiguos
+            return [evento for evento in self.eventos if evento[0] > desde_id]
+    
+    def reiniciar(self):
+        """Descarta los eventos y obliga a todos los clientes a recargar sus datos"""
+        with self.condicion:
+            self.ultimo_id += 1
+            self.minimo_id = self.ultimo_id
+            self.eventos.clear()
+            self.condicion.notify_all()
+
+canal_ganancias = CanalGanancias()
+
+def obtener_ganancias_hoy():
+    """Suma y número de registros de ganancias del día actual"""
+    total_hoy, ventas_hoy = db.session.query(
+        db.func.coalesce(db.func.sum(Ganancias.ganancia_total), 0),
+        db.func.count(Ganancias.id)
+    ).filter(
+        Ganancias.fecha_local == hoy_local(),
+        Ganancias.cantidad_vendida > 0
+    ).one()
+    return float(total_hoy), int(ventas_hoy)
+
+def obtener_cursor_ganancias():
+    """Cursor 'reinicio-ultimo_id-día-productos' que identifica hasta dónde tiene datos un cliente"""
+    ultimo_id = db.session.query(db.func.max(Ganancias.id)).scalar() or 0
+    return (f"{obtener_version('ganancias_reinicio')}-{ultimo_id}-{hoy_local().strftime('%Y%m%d')}"
+            f"-{obtener_version('ref_producto')}")
+
+def leer_cursor_ganancias(cursor):
+    """Último ID de ganancias del cursor (None si el cliente necesita todos los datos) y si
+    los nombres y precios de productos del cliente siguen vigentes"""
+    try:
+        reinicio, ultimo_id, dia, productos = cursor.split('-')
+        if int(reinicio) != obtener_version('ganancias_reinicio'):
+            return None, False
+        if dia != hoy_local().strftime('%Y%m%d'):
+            return None, False
+        return int(ultimo_id), int(productos) == obtener_version('ref_producto')
+    except (AttributeError, ValueError):
+        return None, False
+
+def notificar_ganancias(registrados, productos=()):
+    """Publica las ganancias recién confirmadas (de registrar_en_resumenes) y los totales.
+    
+    productos son IDs de productos editados cuyo nombre o precios se deben reenviar.
+    """
+    try:
+        if not registrados and not productos:
+            return
+        
+        total_ganancias = db.session.query(db.func.sum(GananciasPorProducto.ganancia_total)).scalar() or 0
+        total_ventas = obtener_contadores()['venta']
+        total_hoy, ventas_hoy = obtener_ganancias_hoy()
+        
+        # Reconstruir el acumulado del día para las filas nuevas
+        hoy = hoy_local()
+        nuevas = sorted((r for r in registrados if fecha_local(r[2]) == hoy), key=lambda r: r[2])
+        ganancia_acumulada = total_hoy - sum(r[3] for r in nuevas)
+        ganancias_tiempo_real = []
+        for ganancia_id, producto_id, fecha, ganancia_total in nuevas:
+            ganancia_acumulada += ganancia_total
+            ganancias_tiempo_real.append({
+                'id': ganancia_id,
+                'fecha_venta': fecha.isoformat(),
+                'ganancia_venta': float(ganancia_total),
+                'ganancia_acumulada': ganancia_acumulada
+            })
+        
+        canal_ganancias.publicar({
+            'cursor': obtener_cursor_ganancias(),
+            'total_ganancias': float(total_ganancias),
+            'total_ventas': int(total_ventas),
+            'ganancia_promedio': float(total_ganancias / total_ventas if total_ventas > 0 else 0),
+            'ganancias_por_producto': obtener_ganancias_por_producto({r[1] for r in registrados} | set(productos)),
+            'ganancias_diarias': obtener_ganancias_diarias({fecha_local(r[2]) for r in registrados}),
+            'ganancias_tiempo_real': ganancias_tiempo_real,
+            'total_hoy': total_hoy,
+            'ventas_hoy': ventas_hoy
+        })
+    except Exception:
+        # Sin este evento los clientes quedarían desfasados: que recarguen por el cursor/ETag
+        app.logger.exception('Error al notificar ganancias')
+        canal_ganancias.reiniciar()
+
+# Identidades en caché: cargar el usuario en cada petición (incluido el polling de
+# ganancias) no requiere ir a la base mientras la entrada no caduque ni cambie el usuario
+class IdentidadUsuario(UserMixin):
+    """Copia inmutable de los datos del usuario, sin ligarla a ninguna sesión de la base"""
+    
+    def __init__(self, usuario):
+        self.id = usuario.id
+        self.username = usuario.username
+        self.email = usuario.email
+
+class CacheUsuarios:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.bloqueo = threading.Lock()
+        self.entradas = {}
+        self.generacion = 0  # Cambia con cada invalidación
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self, usuario_id):
+        ahora = time.monotonic()
+        with self.bloqueo:
+            entrada = self.entradas.get(usuario_id)
+            if entrada and entrada[1] > ahora:
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+            generacion = self.generacion
+        
+        usuario = db.session.get(Usuario, usuario_id)
+        identidad = IdentidadUsuario(usuario) if usuario else None
+        with self.bloqueo:
+            # No guardar lo leído si el usuario cambió mientras tanto
+            if identidad and generacion == self.generacion:
+                self.entradas[usuario_id] = (identidad, ahora + self.ttl)
+        return identidad
+    
+    def invalidar(self, *usuario_ids):
+        with self.bloqueo:
+            self.generacion += 1
+            for usuario_id in usuario_ids:
+                self.entradas.pop(usuario_id, None)
+    
+    def limpiar(self):
+        with self.bloqueo:
+            self.generacion += 1
+            self.entradas.clear()
+    
+    def estadisticas(self):
+        with self.bloqueo:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self.entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0,
+                'ttl': self.ttl
+            }
+
+cache_usuarios = CacheUsuarios(app.config['USUARIO_CACHE_TTL'])
+
+@event.listens_for(Usuario, 'after_update')
+@event.listens_for(Usuario, 'after_delete')
+def marcar_usuario_modificado(mapper, conexion, usuario):
+    """Anota el usuario modificado para invalidarlo al confirmar la transacción"""
+    cache_usuarios.invalidar(usuario.id)
+    object_session(usuario).info.setdefault('usuarios_modificados', set()).add(usuario.id)
+
+@event.listens_for(Session, 'after_commit')
+def invalidar_usuarios_modificados(sesion):
+    modificados = sesion.info.pop('usuarios_modificados', None)
+    if modificados:
+        cache_usuarios.invalidar(*modificados)
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_usuarios_modificados(sesion):
+    sesion.info.pop('usuarios_modificados', None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
+    return cache_usuarios.obtener(int(user_id))
+
+class PuertaEscrituras:
+    """Coordina las escrituras con la restauración de respaldos, que cierra la puerta
+    mientras reemplaza el archivo de la base.
+    
+    Solo coordina los hilos de este proceso: con varios procesos (p. ej. varios workers
+    de gunicorn) cada uno tiene su propia puerta y los demás no esperan a la restauración,
+    así que solo se debe restaurar con un único proceso sirviendo la aplicación.
+    """
+    
+    def __init__(self):
+        self.condicion = threading.Condition()
+        self.en_curso = 0
+        self.cerrada = False
+        self.copias = 0  # Respaldos en línea con su conexión abierta
+        self.hilo = threading.local()  # Nivel de anidamiento en cada hilo
+        self.restaurador = None  # Hilo que cerró la puerta
+    
+    def entrar(self):
+        nivel = getattr(self.hilo, 'nivel', 0)
+        if nivel:
+            # El hilo ya está dentro (p. ej. el avance de un trabajo durante su lote)
+            self.hilo.nivel = nivel + 1
+            return
+        with self.condicion:
+            while self.cerrada:
+                self.condicion.wait()
+            self.en_curso += 1
+        self.hilo.nivel = 1
+    
+    def salir(self):
+        self.hilo.nivel -= 1
+        if self.hilo.nivel:
+            return
+        with self.condicion:
+            self.en_curso -= 1
+            self.condicion.notify_all()
+    
+    @contextmanager
+    def escritura(self):
+        """Marca un bloque de código que escribe en la base de datos"""
+        self.entrar()
+        try:
+            yield
+        finally:
+            self.salir()
+    
+    @contextmanager
+    def lote(self):
+        """Un lote o transacción de un trabajo largo. Al salir se cierra la transacción de
+        la sesión, así entre lotes el trabajo no retiene ninguna conexión a la base"""
+        with self.escritura():
+            try:
+                yield
+            finally:
+                db.session.rollback()
+    
+    @contextmanager
+    def copia(self):
+        """Marca un respaldo en línea mientras tiene abierta su conexión. No cuenta como
+        escritura: la copia comprueba la puerta en cada lote y, si se cierra, termina y
+        cierra su conexión, que es lo único a lo que espera la restauración"""
+        with self.condicion:
+            while self.cerrada:
+                self.condicion.wait()
+            self.copias += 1
+        try:
+            yield
+        finally:
+            with self.condicion:
+                self.copias -= 1
+                self.condicion.notify_all()
+    
+    def esperar_cierre(self, segundos):
+        """Espera hasta segundos; devuelve True en cuanto la puerta se cierra"""
+        with self.condicion:
+            return self.condicion.wait_for(lambda: self.cerrada, segundos)
+    
+    def esperar_conexion(self):
+        """Al pedir una conexión fuera de la puerta (lecturas) se espera a que la
+        restauración termine, así nadie abre el archivo mientras se reemplaza"""
+        if getattr(self.hilo, 'nivel', 0) or self.restaurador == threading.get_ident():
+            return
+        with self.condicion:
+            while self.cerrada:
+                self.condicion.wait()
+    
+    @contextmanager
+    def pausa(self, timeout):
+        """Cierra la puerta y espera (hasta timeout segundos) a que no haya escrituras ni copias en curso"""
+        with self.condicion:
+            while self.cerrada:
+                self.condicion.wait()
+            self.cerrada = True
+            self.restaurador = threading.get_ident()
+            self.condicion.notify_all()
+            if not self.condicion.wait_for(lambda: self.en_curso == 0 and self.copias == 0, timeout):
+                self.cerrada = False
+                self.restaurador = None
+                self.condicion.notify_all()
+                raise RuntimeError('Hay escrituras en curso; inténtalo de nuevo en unos segundos')
+        try:
+            yield
+        finally:
+            with self.condicion:
+                self.cerrada = False
+                self.restaurador = None
+                self.condicion.notify_all()
+
+puerta_escrituras = PuertaEscrituras()
+
+with app.app_context():
+    event.listen(db.engine, 'checkout', lambda *args: puerta_escrituras.esperar_conexion())
+
+def con_puerta_escrituras(vista):
+    """Las vistas que escriben en la base lo hacen dentro de la puerta: esperan si hay una
+    restauración en curso y la restauración espera a que terminen"""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        with puerta_escrituras.escritura():
+            return vista(*args, **kwargs)
+    return envoltura
+
+@app.route('/api/cache')
+@login_required
+def estado_caches():
+    """Aciertos y fallos de las cachés en memoria"""
+    return jsonify({
+        'usuarios': cache_usuarios.estadisticas(),
+        'referencias': cache_referencias.estadisticas(),
+        'cubo': cubo_ganancias.estadisticas(),
+        'rankings': rankings_ventas.estadisticas()
+    })
 
 # Rutas
 @app.route('/')
@@ -177,6 +1032,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@con_puerta_escrituras
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -207,17 +1063,28 @@ def register():
 @login_required
 def dashboard():
     # Estadísticas básicas
-    total_productos = Producto.query.count()
-    total_clientes = Cliente.query.count()
-    total_ventas = Venta.query.count()
-    total_lugares = LugarEntrega.query.count()
+    contadores = obtener_contadores()
+    total_productos = contadores['producto']
+    total_clientes = contadores['cliente']
+    total_ventas = contadores['venta']
+    total_lugares = contadores['lugar_entrega']
+    
+    # Top 10 por ganancia de la ventana elegida, desde los rankings en memoria
+    ventana = request.args.get('ventana', 'mes')
+    if ventana not in VENTANAS_RANKING:
+        ventana = 'mes'
+    rankings_ventas.sincronizar()
+    rankings = {dimension: rankings_ventas.primeros(dimension, ventana, 'ganancia')
+                for dimension in DIMENSIONES_RANKING}
     
     return render_template('dashboard.html', 
                          user=current_user,
                          total_productos=total_productos,
                          total_clientes=total_clientes,
                          total_ventas=total_ventas,
-                         total_lugares=total_lugares)
+                         total_lugares=total_lugares,
+                         rankings=rankings,
+                         ventana=ventana)
 
 # Rutas para Productos
 @app.route('/productos')
@@ -228,6 +1095,7 @@ def productos():
 
 @app.route('/productos/nuevo', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def nuevo_producto():
     if request.method == 'POST':
         nombre = request.form['nombre']
@@ -256,6 +1124,7 @@ def nuevo_producto():
 
 @app.route('/productos/editar/<int:producto_id>', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def editar_producto(producto_id):
     producto = Producto.query.get_or_404(producto_id)
     
@@ -264,9 +1133,17 @@ def editar_producto(producto_id):
         producto.descripcion = request.form['descripcion']
         producto.precio = float(request.form['precio'])
         producto.precio_compra = float(request.form['precio_compra'])
-        producto.categoria_id = int(request.form['categoria_id'])
+        categoria_id = int(request.form['categoria_id'])
+        if categoria_id != producto.categoria_id:
+            # Cambia filas ya agregadas (series por categoría, cubo): los clientes recargan todo
+            mover_series_categoria(producto_id, categoria_id)
+            incrementar_version('ganancias_reinicio')
+        producto.categoria_id = categoria_id
         
+        # Nombre y precios aparecen en los datos de ganancias ya enviados
+        incrementar_version('ganancias')
         db.session.commit()
+        notificar_ganancias([], productos={producto_id})
         flash('Producto actualizado exitosamente', 'success')
         return redirect(url_for('productos'))
     
@@ -275,6 +1152,7 @@ def editar_producto(producto_id):
 
 @app.route('/productos/eliminar/<int:producto_id>')
 @login_required
+@con_puerta_escrituras
 def eliminar_producto(producto_id):
     producto = Producto.query.get_or_404(producto_id)
     
@@ -282,7 +1160,8 @@ def eliminar_producto(producto_id):
     if producto.stock:
         db.session.delete(producto.stock)
     
-    # Eliminar ganancias asociadas
+    # Eliminar ganancias asociadas (y descontarlas de los resúmenes)
+    descontar_resumenes_producto(producto_id)
     Ganancias.query.filter_by(producto_id=producto_id).delete()
     
     # Eliminar de ventas (tabla intermedia)
@@ -290,6 +1169,8 @@ def eliminar_producto(producto_id):
     
     db.session.delete(producto)
     db.session.commit()
+    # Sus ganancias ya no están: los clientes en tiempo real deben recargar todo
+    canal_ganancias.reiniciar()
     
     flash('Producto eliminado exitosamente', 'success')
     return redirect(url_for('productos'))
@@ -303,6 +1184,7 @@ def categorias():
 
 @app.route('/categorias/nueva', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def nueva_categoria():
     if request.method == 'POST':
         nombre = request.form['nombre']
@@ -319,6 +1201,7 @@ def nueva_categoria():
 
 @app.route('/categorias/editar/<int:categoria_id>', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def editar_categoria(categoria_id):
     categoria = Categoria.query.get_or_404(categoria_id)
     
@@ -334,6 +1217,7 @@ def editar_categoria(categoria_id):
 
 @app.route('/categorias/eliminar/<int:categoria_id>')
 @login_required
+@con_puerta_escrituras
 def eliminar_categoria(categoria_id):
     categoria = Categoria.query.get_or_404(categoria_id)
     
@@ -357,6 +1241,7 @@ def clientes():
 
 @app.route('/clientes/nuevo', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def nuevo_cliente():
     if request.method == 'POST':
         try:
@@ -378,6 +1263,7 @@ def nuevo_cliente():
 
 @app.route('/clientes/editar/<int:cliente_id>', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def editar_cliente(cliente_id):
     cliente = Cliente.query.get_or_404(cliente_id)
     
@@ -398,6 +1284,7 @@ def editar_cliente(cliente_id):
 
 @app.route('/clientes/eliminar/<int:cliente_id>')
 @login_required
+@con_puerta_escrituras
 def eliminar_cliente(cliente_id):
     cliente = Cliente.query.get_or_404(cliente_id)
     
@@ -421,6 +1308,7 @@ def lugares_entrega():
 
 @app.route('/lugares-entrega/nuevo', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def nuevo_lugar_entrega():
     if request.method == 'POST':
         nombre = request.form['nombre']
@@ -439,6 +1327,7 @@ def nuevo_lugar_entrega():
 
 @app.route('/lugares-entrega/editar/<int:lugar_id>', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def editar_lugar_entrega(lugar_id):
     lugar = LugarEntrega.query.get_or_404(lugar_id)
     
@@ -456,6 +1345,7 @@ def editar_lugar_entrega(lugar_id):
 
 @app.route('/lugares-entrega/eliminar/<int:lugar_id>')
 @login_required
+@con_puerta_escrituras
 def eliminar_lugar_entrega(lugar_id):
     lugar = LugarEntrega.query.get_or_404(lugar_id)
     
@@ -470,20 +1360,141 @@ def eliminar_lugar_entrega(lugar_id):
     flash('Lugar de entrega eliminado exitosamente', 'success')
     return redirect(url_for('lugares_entrega'))
 
+# Filtros comunes para listados y exportaciones de ventas
+def leer_rango_fechas(args):
+    """Días locales [desde, hasta] (ambos incluidos) de los parámetros desde/hasta (YYYY-MM-DD)"""
+    desde = hasta = None
+    try:
+        if args.get('desde'):
+            desde = datetime.strptime(args['desde'], '%Y-%m-%d').date()
+        if args.get('hasta'):
+            hasta = datetime.strptime(args['hasta'], '%Y-%m-%d').date()
+    except ValueError:
+        pass  # Fechas mal formadas se ignoran
+    return desde, hasta
+
+def filtrar_ventas(consulta, args):
+    """Aplica los filtros de fecha, estado, vendedor y cliente (parámetros de la petición)"""
+    desde, hasta = leer_rango_fechas(args)
+    if desde:
+        consulta = consulta.filter(Venta.fecha_local >= desde)
+    if hasta:
+        consulta = consulta.filter(Venta.fecha_local <= hasta)
+    if args.get('estado'):
+        consulta = consulta.filter(Venta.estado == args['estado'])
+    vendedor_id = args.get('vendedor_id', type=int)
+    if vendedor_id:
+        consulta = consulta.filter(Venta.vendedor_id == vendedor_id)
+    cliente_id = args.get('cliente_id', type=int)
+    if cliente_id:
+        consulta = consulta.filter(Venta.cliente_id == cliente_id)
+    return consulta
+
 # Rutas para Ventas
 @app.route('/ventas')
 @login_required
 def ventas():
-    ventas = Venta.query.join(Cliente).join(LugarEntrega).join(Usuario).all()
-    return render_template('ventas.html', ventas=ventas)
+    por_pagina = min(max(request.args.get('por_pagina', 50, type=int), 1), 200)
+    
+    # Paginación por cursor: las ventas anteriores a la última de la página previa
+    consulta = filtrar_ventas(Venta.query, request.args).options(
+        joinedload(Venta.cliente),
+        joinedload(Venta.lugar_entrega),
+        joinedload(Venta.vendedor),
+        joinedload(Venta.descuento)
+    )
+    despues_de = request.args.get('despues_de', type=int)
+    if despues_de:
+        fecha_cursor = db.session.query(Venta.fecha).filter_by(id=despues_de).scalar()
+        if fecha_cursor:
+            consulta = consulta.filter(db.tuple_(Venta.fecha, Venta.id) < (fecha_cursor, despues_de))
+    
+    ventas = consulta.order_by(Venta.fecha.desc(), Venta.id.desc()).limit(por_pagina + 1).all()
+    hay_mas = len(ventas) > por_pagina
+    ventas = ventas[:por_pagina]
+    
+    # Número de productos de todas las ventas de la página en una sola consulta
+    productos_por_venta = {}
+    if ventas:
+        productos_por_venta = dict(db.session.query(
+            venta_producto.c.venta_id, db.func.count()
+        ).filter(
+            venta_producto.c.venta_id.in_([venta.id for venta in ventas])
+        ).group_by(venta_producto.c.venta_id).all())
+    
+    filtros = {clave: valor for clave, valor in request.args.items() if clave != 'despues_de' and valor}
+    siguiente = url_for('ventas', despues_de=ventas[-1].id, **filtros) if hay_mas else None
+    
+    # Vendedores desde la caché de referencias; del cliente solo el seleccionado (el resto se busca)
+    vendedores = sorted(cache_referencias.obtener()['usuario'], key=lambda vendedor: vendedor.username)
+    cliente_id = request.args.get('cliente_id', type=int)
+    cliente = db.session.get(Cliente, cliente_id) if cliente_id else None
+    return render_template('ventas.html', ventas=ventas, productos_por_venta=productos_por_venta,
+                         siguiente=siguiente, filtros=filtros,
+                         vendedores=vendedores, cliente=cliente)
+
+# Datos de referencia del formulario de venta. Cada lista se guarda como tupla de
+# namedtuples inmutables junto con la versión de su tabla (version_datos 'ref_<tabla>',
+# que aumentan los triggers de la migración 3), así el formulario sale de memoria.
+LugarEntregaRef = namedtuple('LugarEntregaRef', 'id nombre tipo')
+VendedorRef = namedtuple('VendedorRef', 'id username')
+DescuentoRef = namedtuple('DescuentoRef', 'id nombre porcentaje')
+
+CONSULTAS_REFERENCIA = {
+    'lugar_entrega': lambda: [LugarEntregaRef(*fila) for fila in db.session.query(
+        LugarEntrega.id, LugarEntrega.nombre, LugarEntrega.tipo)],
+    'usuario': lambda: [VendedorRef(*fila) for fila in db.session.query(Usuario.id, Usuario.username)],
+    'descuento': lambda: [DescuentoRef(*fila) for fila in db.session.query(
+        Descuento.id, Descuento.nombre, Descuento.porcentaje).filter(Descuento.activo == True)]
+}
+
+class CacheReferencias:
+    def __init__(self):
+        self.bloqueo = threading.Lock()
+        self.listas = {}  # tabla -> (versión, tupla)
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self):
+        """Listas vigentes de todas las tablas de referencia (una consulta para las versiones)"""
+        versiones = dict(db.session.query(VersionDatos.nombre, VersionDatos.version).filter(
+            VersionDatos.nombre.in_([f'ref_{tabla}' for tabla in CONSULTAS_REFERENCIA])).all())
+        listas = {}
+        for tabla, consulta in CONSULTAS_REFERENCIA.items():
+            version = versiones.get(f'ref_{tabla}', 0)
+            with self.bloqueo:
+                guardada = self.listas.get(tabla)
+                if guardada and guardada[0] == version:
+                    self.aciertos += 1
+                    listas[tabla] = guardada[1]
+                    continue
+                self.fallos += 1
+            lista = tuple(consulta())
+            with self.bloqueo:
+                self.listas[tabla] = (version, lista)
+            listas[tabla] = lista
+        return listas
+    
+    def limpiar(self):
+        with self.bloqueo:
+            self.listas.clear()
+    
+    def estadisticas(self):
+        with self.bloqueo:
+            consultas = self.aciertos + self.fallos
+            return {
+                'tablas': {tabla: version for tabla, (version, _) in self.listas.items()},
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0
+            }
+
+cache_referencias = CacheReferencias()
 
 @app.route('/ventas/nueva', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def nueva_venta():
-    # Validar que solo se puedan crear ventas en el día actual
-    from datetime import date
-    hoy = date.today()
-    
     if request.method == 'POST':
         cliente_id = int(request.form['cliente_id'])
         lugar_entrega_id = int(request.form['lugar_entrega_id'])
@@ -491,47 +1502,77 @@ def nueva_venta():
         estado = request.form['estado']
         descuento_id = request.form.get('descuento_id') or None
         
+        # Productos del carrito (se ignoran las cantidades en 0)
+        carrito = {}
+        for key, value in request.form.items():
+            if key.startswith('producto_') and value:
+                cantidad = int(value)
+                if cantidad > 0:
+                    carrito[int(key.split('_')[1])] = cantidad
+        
+        # Cargar todos los productos del carrito en una sola consulta
+        productos = Producto.query.filter(Producto.id.in_(carrito.keys())).all() if carrito else []
+        
+        # Reservar el stock de todas las líneas con un solo UPDATE condicional: si a
+        # alguna le falta stock (por ejemplo, otra venta se adelantó) no se vende nada
+        if productos:
+            tabla_stock = Stock.__table__
+            resultado = db.session.execute(
+                tabla_stock.update().where(
+                    tabla_stock.c.producto_id == bindparam('b_producto_id'),
+                    tabla_stock.c.cantidad_disponible >= bindparam('b_cantidad')
+                ).values(cantidad_disponible=tabla_stock.c.cantidad_disponible - bindparam('b_cantidad')),
+                [{'b_producto_id': producto.id, 'b_cantidad': carrito[producto.id]} for producto in productos]
+            )
+            if resultado.rowcount != len(productos):
+                db.session.rollback()
+                disponibles = dict(db.session.query(Stock.producto_id, Stock.cantidad_disponible).filter(
+                    Stock.producto_id.in_(carrito.keys())
+                ).all())
+                sin_stock = [producto.nombre for producto in productos
+                             if (disponibles.get(producto.id) or 0) < carrito[producto.id]]
+                flash('Stock insuficiente para: ' + ', '.join(sin_stock), 'error')
+                return redirect(url_for('nueva_venta'))
+        
         # Crear venta
         venta = Venta(cliente_id=cliente_id, lugar_entrega_id=lugar_entrega_id, 
                      vendedor_id=vendedor_id, estado=estado, descuento_id=descuento_id, total=0)
         db.session.add(venta)
         db.session.flush()
         
-        # Procesar productos
+        # Agregar los productos y registrar las ganancias por lotes
         total = 0
-        for key, value in request.form.items():
-            if key.startswith('producto_') and value:
-                producto_id = int(key.split('_')[1])
-                cantidad = int(value)
-                producto = Producto.query.get(producto_id)
-                
-                if producto and producto.stock.cantidad_disponible >= cantidad:
-                    # Agregar producto a la venta
-                    db.session.execute(venta_producto.insert().values(
-                        venta_id=venta.id,
-                        producto_id=producto_id,
-                        cantidad=cantidad,
-                        precio_unitario=producto.precio
-                    ))
-                    
-                    # Registrar ganancia
-                    ganancia_unitaria = producto.ganancia_unitaria()
-                    ganancia_total = ganancia_unitaria * cantidad
-                    
-                    ganancia = Ganancias(
-                        producto_id=producto_id,
-                        venta_id=venta.id,
-                        cantidad_vendida=cantidad,
-                        precio_venta=producto.precio,
-                        precio_compra=producto.precio_compra,
-                        ganancia_unitaria=ganancia_unitaria,
-                        ganancia_total=ganancia_total
-                    )
-                    db.session.add(ganancia)
-                    
-                    # Actualizar stock
-                    producto.stock.cantidad_disponible -= cantidad
-                    total += producto.precio * cantidad
+        detalle, ganancias = [], []
+        ahora = datetime.utcnow()
+        for producto in productos:
+            cantidad = carrito[producto.id]
+            ganancia_unitaria = producto.ganancia_unitaria()
+            ganancia_total = ganancia_unitaria * cantidad
+            detalle.append({
+                'venta_id': venta.id,
+                'producto_id': producto.id,
+                'cantidad': cantidad,
+                'precio_unitario': producto.precio
+            })
+            ganancias.append({
+                'producto_id': producto.id,
+                'venta_id': venta.id,
+                'cantidad_vendida': cantidad,
+                'precio_venta': producto.precio,
+                'precio_compra': producto.precio_compra,
+                'ganancia_unitaria': ganancia_unitaria,
+                'ganancia_total': ganancia_total,
+                'fecha': ahora
+            })
+            total += producto.precio * cantidad
+        
+        registros = []
+        if detalle:
+            db.session.execute(venta_producto.insert(), detalle)
+            ganancia_ids = insertar_devolviendo_ids(Ganancias.__table__, ganancias)
+            registros = [(ganancia_id, fila['producto_id'], fila['fecha'], fila['cantidad_vendida'],
+                          fila['ganancia_unitaria'], fila['ganancia_total'])
+                         for ganancia_id, fila in zip(ganancia_ids, ganancias)]
         
         # Aplicar descuento si existe
         if descuento_id:
@@ -540,80 +1581,448 @@ def nueva_venta():
                 total = total * (1 - descuento.porcentaje / 100)
         
         venta.total = total
+        registrados = registrar_en_resumenes(registros)
         db.session.commit()
+        notificar_ganancias(registrados)
         
         flash('Venta realizada exitosamente', 'success')
         return redirect(url_for('ventas'))
     
-    clientes = Cliente.query.all()
-    lugares_entrega = LugarEntrega.query.all()
-    vendedores = Usuario.query.all()
-    productos = Producto.query.join(Stock).filter(Stock.cantidad_disponible > 0).all()
-    descuentos = Descuento.query.filter_by(activo=True).all()
+    # Clientes y productos se buscan desde el formulario (/api/.../buscar), así la
+    # página no crece con el catálogo
+    referencias = cache_referencias.obtener()
     
     return render_template('nueva_venta.html', 
-                         clientes=clientes, lugares_entrega=lugares_entrega, 
-                         vendedores=vendedores, productos=productos, descuentos=descuentos)
+                         lugares_entrega=referencias['lugar_entrega'], 
+                         vendedores=referencias['usuario'], descuentos=referencias['descuento'])
+
+# Búsqueda incremental de clientes y productos con índices FTS5 (migración 4 en MIGRACIONES)
+LIMITE_BUSQUEDA = 50
+
+def expresion_fts(texto):
+    """Convierte lo que escribe el usuario en una búsqueda FTS5 por prefijo de cada palabra"""
+    return ' '.join(f'"{palabra}"*' for palabra in re.findall(r'\w+', texto or ''))
+
+def leer_limite_busqueda():
+    return max(1, min(request.args.get('limite', 20, type=int), LIMITE_BUSQUEDA))
+
+@app.route('/api/clientes/buscar')
+@login_required
+def buscar_clientes():
+    """Clientes cuyo nombre o teléfono empieza por las palabras buscadas, los más relevantes primero"""
+    expresion = expresion_fts(request.args.get('q'))
+    if not expresion:
+        return jsonify([])
+    filas = db.session.execute(db.text(
+        'SELECT cliente.id, cliente.nombre, cliente.telefono FROM cliente_fts '
+        'JOIN cliente ON cliente.id = cliente_fts.rowid '
+        'WHERE cliente_fts MATCH :expresion ORDER BY cliente_fts.rank LIMIT :limite'
+    ), {'expresion': expresion, 'limite': leer_limite_busqueda()})
+    return jsonify([{'id': id, 'nombre': nombre, 'telefono': telefono} for id, nombre, telefono in filas])
 
-# Ruta para exportar ventas a Excel
+@app.route('/api/productos/buscar')
+@login_required
+def buscar_productos():
+    """Productos con stock cuyo nombre o descripción coincide, los más relevantes primero"""
+    expresion = expresion_fts(request.args.get('q'))
+    if not expresion:
+        return jsonify([])
+    filas = db.session.execute(db.text(
+        'SELECT producto.id, producto.nombre, producto.descripcion, producto.precio, stock.cantidad_disponible '
+        'FROM producto_fts JOIN producto ON producto.id = producto_fts.rowid '
+        'JOIN stock ON stock.producto_id = producto.id '
+        'WHERE producto_fts MATCH :expresion AND stock.cantidad_disponible > 0 '
+        'ORDER BY producto_fts.rank LIMIT :limite'
+    ), {'expresion': expresion, 'limite': leer_limite_busqueda()})
+    return jsonify([
+        {'id': id, 'nombre': nombre, 'descripcion': descripcion, 'precio': precio, 'stock': stock}
+        for id, nombre, descripcion, precio, stock in filas
+    ])
+
+def consulta_ventas_con_ganancia(args):
+    """Ventas filtradas con nombres y la ganancia de cada venta ya calculada"""
+    ganancia_venta = db.func.coalesce(db.func.sum(
+        venta_producto.c.cantidad * (Producto.precio - Producto.precio_compra)
+    ), 0)
+    return filtrar_ventas(db.session.query(
+        Venta.id,
+        Venta.fecha,
+        Cliente.nombre.label('cliente_nombre'),
+        LugarEntrega.nombre.label('lugar_nombre'),
+        Usuario.username.label('vendedor_nombre'),
+        Venta.estado,
+        Venta.total,
+        ganancia_venta.label('ganancia_total')
+    ).join(Cliente, Venta.cliente_id == Cliente.id).join(
+        LugarEntrega, Venta.lugar_entrega_id == LugarEntrega.id
+    ).join(Usuario, Venta.vendedor_id == Usuario.id).outerjoin(
+        venta_producto, venta_producto.c.venta_id == Venta.id
+    ).outerjoin(
+        Producto, Producto.id == venta_producto.c.producto_id
+    ), args).group_by(Venta.id)
+
+# Ruta para exportar ventas a Excel (se genera en segundo plano)
 @app.route('/ventas/exportar')
 @login_required
+@con_puerta_escrituras
 def exportar_ventas():
-    ventas = Venta.query.join(Cliente).join(LugarEntrega).join(Usuario).all()
+    trabajo_id = encolar_trabajo('exportar_ventas', generar_excel_ventas, request.args.copy())
+    return redirect(url_for('ver_trabajo', trabajo_id=trabajo_id))
+
+def generar_excel_ventas(args, progreso):
+    """Escribe el reporte de ventas en un archivo Excel dentro de la carpeta de trabajos"""
+    # Una consulta con la ganancia de cada venta ya calculada, leída por lotes de
+    # (fecha, id): cada lote toma la puerta de escrituras y libera su conexión
+    consulta = consulta_ventas_con_ganancia(args).order_by(Venta.fecha, Venta.id)
     
-    # Crear libro de Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Reporte de Ventas"
+    # Libro de Excel en modo solo escritura: las filas van directo a disco
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Reporte de Ventas")
+    
+    # El modo solo escritura necesita los anchos antes de la primera fila:
+    # se acotan con las longitudes máximas de las tablas de referencia
+    def ancho_maximo(columna):
+        return db.session.query(db.func.max(db.func.length(columna))).scalar() or 0
     
-    # Encabezados
     headers = ['ID Venta', 'Fecha', 'Cliente', 'Lugar de Entrega', 'Vendedor', 'Estado', 'Total', 'Ganancia Total']
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
+    with puerta_escrituras.lote():
+        total_filas = filtrar_ventas(Venta.query, args).count()
+        contenidos = [
+            len(str(db.session.query(db.func.max(Venta.id)).scalar() or 0)),
+            len('dd/mm/aaaa hh:mm'),
+            ancho_maximo(Cliente.nombre),
+            ancho_maximo(LugarEntrega.nombre),
+            ancho_maximo(Usuario.username),
+            len('Contraentrega'),
+            12,
+            12
+        ]
+    for col, (header, contenido) in enumerate(zip(headers, contenidos), 1):
+        ws.column_dimensions[get_column_letter(col)].width = max(len(header), contenido) + 2
+    
+    # Encabezados
+    fila_encabezados = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = Font(bold=True)
         cell.alignment = Alignment(horizontal='center')
+        fila_encabezados.append(cell)
+    ws.append(fila_encabezados)
     
     # Datos
-    for row, venta in enumerate(ventas, 2):
-        ws.cell(row=row, column=1, value=venta.id)
-        ws.cell(row=row, column=2, value=venta.fecha.strftime('%d/%m/%Y %H:%M'))
-        ws.cell(row=row, column=3, value=venta.cliente.nombre)
-        ws.cell(row=row, column=4, value=venta.lugar_entrega.nombre)
-        ws.cell(row=row, column=5, value=venta.vendedor.username)
-        ws.cell(row=row, column=6, value=venta.estado.title())
-        ws.cell(row=row, column=7, value=venta.total)
-        ws.cell(row=row, column=8, value=venta.ganancia_total())
-    
-    # Ajustar ancho de columnas
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column_letter].width = adjusted_width
+    numero, ultimo = 0, None
+    while True:
+        with puerta_escrituras.lote():
+            pagina = consulta
+            if ultimo:
+                pagina = pagina.filter(db.tuple_(Venta.fecha, Venta.id) > ultimo)
+            lote = pagina.limit(1000).all()
+        if not lote:
+            break
+        for row in lote:
+            ws.append([
+                row.id,
+                row.fecha.strftime('%d/%m/%Y %H:%M'),
+                row.cliente_nombre,
+                row.lugar_nombre,
+                row.vendedor_nombre,
+                row.estado.title(),
+                row.total,
+                row.ganancia_total
+            ])
+        numero += len(lote)
+        ultimo = (lote[-1].fecha, lote[-1].id)
+        progreso(90 * numero // max(total_filas, 1), f'{numero} de {total_filas} ventas')
+    
+    progreso(95, 'Guardando archivo')
+    os.makedirs(DIRECTORIO_TRABAJOS, exist_ok=True)
+    ruta = os.path.join(DIRECTORIO_TRABAJOS, f"reporte_ventas_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.xlsx")
+    wb.save(ruta)
+    return {'mensaje': f'Se exportaron {total_filas} ventas', 'archivo': ruta}
+
+# Exportaciones de datos crudos (CSV / NDJSON) para procesos externos
+FORMATOS_EXPORTACION = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson'
+}
+
+def exportar_por_lotes(consulta, columna_id, campos, formato, nombre, tamaño_lote=5000):
+    """Envía las filas de la consulta por lotes ordenados por ID.
+    
+    Cada lote se pide con id > último enviado, así la memoria no depende del total
+    y una descarga interrumpida se puede retomar con ?despues_de=<último id>.
+    """
+    despues_de = request.args.get('despues_de', 0, type=int)
+    
+    def formatear(valor):
+        if isinstance(valor, datetime):
+            return valor.isoformat()
+        return valor
+    
+    def generar():
+        ultimo_id = despues_de
+        salida = io.StringIO()
+        escritor = csv.writer(salida)
+        if formato == 'csv':
+            escritor.writerow(campos)
+        while True:
+            with puerta_escrituras.lote():
+                lote = consulta.filter(columna_id > ultimo_id).order_by(columna_id).limit(tamaño_lote).all()
+            if not lote:
+                break
+            for fila in lote:
+                valores = [formatear(valor) for valor in fila]
+                if formato == 'csv':
+                    escritor.writerow(valores)
+                else:
+                    salida.write(json.dumps(dict(zip(campos, valores)), ensure_ascii=False))
+                    salida.write('\n')
+            ultimo_id = lote[-1][0]
+            yield salida.getvalue()
+            salida.seek(0)
+            salida.truncate()
+        if salida.tell():
+            yield salida.getvalue()
+    
+    # La descarga puede durar mucho: no retiene la conexión usada para preparar la consulta
+    db.session.rollback()
+    
+    response = app.response_class(stream_with_context(generar()), mimetype=FORMATOS_EXPORTACION[formato])
+    response.headers['Content-Disposition'] = f'attachment; filename={nombre}.{formato}'
+    return response
+
+@app.route('/ventas/exportar.<formato>')
+@login_required
+def exportar_ventas_datos(formato):
+    """Ventas en CSV o NDJSON (filtros: desde, hasta, estado, vendedor_id, cliente_id, despues_de)"""
+    if formato not in FORMATOS_EXPORTACION:
+        abort(404)
+    campos = ['id', 'fecha', 'cliente', 'lugar_entrega', 'vendedor', 'estado', 'total', 'ganancia_total']
+    return exportar_por_lotes(consulta_ventas_con_ganancia(request.args), Venta.id, campos, formato, 'ventas')
+
+@app.route('/ganancias/exportar.<formato>')
+@login_required
+def exportar_ganancias_datos(formato):
+    """Registros de ganancias en CSV o NDJSON (filtros: desde, hasta, despues_de)"""
+    if formato not in FORMATOS_EXPORTACION:
+        abort(404)
+    consulta = db.session.query(
+        Ganancias.id,
+        Ganancias.fecha,
+        Ganancias.venta_id,
+        Ganancias.producto_id,
+        Producto.nombre,
+        Ganancias.cantidad_vendida,
+        Ganancias.precio_venta,
+        Ganancias.precio_compra,
+        Ganancias.ganancia_unitaria,
+        Ganancias.ganancia_total
+    ).join(Producto, Ganancias.producto_id == Producto.id)
+    desde, hasta = leer_rango_fechas(request.args)
+    if desde:
+        consulta = consulta.filter(Ganancias.fecha_local >= desde)
+    if hasta:
+        consulta = consulta.filter(Ganancias.fecha_local <= hasta)
+    campos = ['id', 'fecha', 'venta_id', 'producto_id', 'producto', 'cantidad_vendida',
+              'precio_venta', 'precio_compra', 'ganancia_unitaria', 'ganancia_total']
+    return exportar_por_lotes(consulta, Ganancias.id, campos, formato, 'ganancias')
+
+# Importación masiva de ventas desde Excel
+def buscar_en_lotes(consulta, columna, valores, tamaño_lote=500):
+    """Filas de la consulta cuya columna está en valores, buscando por lotes de IN (...)"""
+    valores = list(valores)
+    for i in range(0, len(valores), tamaño_lote):
+        yield from consulta.filter(columna.in_(valores[i:i + tamaño_lote]))
+
+def importar_ventas_desde_excel(archivo, progreso=None):
+    """Importa ventas desde un Excel (Fecha, Cliente, Producto, Cantidad, Precio, Vendedor).
+    
+    Lee la hoja en modo streaming, resuelve los nombres con pocas consultas en bloque y
+    escribe ventas, detalle y ganancias con inserciones por lotes en una sola transacción.
+    Devuelve (ventas_importadas, errores).
+    """
+    errores = []
+    if progreso is None:
+        progreso = lambda porcentaje, mensaje=None: None
+    
+    # Leer la hoja sin cargarla entera en memoria (se saltan los encabezados)
+    wb = load_workbook(archivo, read_only=True, data_only=True)
+    total_filas = wb.active.max_row or 0
+    filas = []
+    for numero_fila, valores in enumerate(wb.active.iter_rows(min_row=2, max_col=6, values_only=True), 2):
+        valores = tuple(valores) + (None,) * (6 - len(valores))
+        if all(valores):
+            filas.append((numero_fila,) + valores)
+        if numero_fila % 5000 == 0:
+            progreso(40 * numero_fila // max(total_filas, numero_fila), f'Leyendo fila {numero_fila}')
+    wb.close()
+    
+    # Todo el trabajo con la base es una transacción: la puerta se toma solo para ella
+    with puerta_escrituras.lote():
+        return guardar_filas_importadas(filas, errores, progreso)
+
+def guardar_filas_importadas(filas, errores, progreso):
+    """Valida las filas leídas del Excel y guarda las ventas en una sola transacción"""
+    progreso(40, 'Buscando clientes, productos y vendedores')
+    
+    # Resolver clientes, productos (con su stock) y vendedores en bloque
+    clientes = {}
+    for nombre, cliente_id in buscar_en_lotes(
+        db.session.query(Cliente.nombre, Cliente.id).order_by(Cliente.id),
+        Cliente.nombre, {fila[2] for fila in filas}
+    ):
+        clientes.setdefault(nombre, cliente_id)
+    
+    productos = {}
+    for nombre, producto_id, precio_compra, stock in buscar_en_lotes(
+        db.session.query(Producto.nombre, Producto.id, Producto.precio_compra, Stock.cantidad_disponible).outerjoin(
+            Stock, Stock.producto_id == Producto.id
+        ).order_by(Producto.id),
+        Producto.nombre, {fila[3] for fila in filas}
+    ):
+        productos.setdefault(nombre, (producto_id, precio_compra, stock))
+    
+    vendedores = dict(buscar_en_lotes(
+        db.session.query(Usuario.username, Usuario.id),
+        Usuario.username, {fila[6] for fila in filas}
+    ))
+    
+    # Validar fila por fila contra el stock que va quedando
+    progreso(50, 'Validando filas')
+    stock_restante = {}
+    validas = []
+    for numero_fila, fecha_str, cliente_nombre, producto_nombre, cantidad, precio, vendedor_nombre in filas:
+        try:
+            if producto_nombre not in productos:
+                errores.append(f"Producto '{producto_nombre}' no encontrado en fila {numero_fila}")
+                continue
+            producto_id, precio_compra, stock = productos[producto_nombre]
+            
+            disponible = stock_restante.get(producto_id, stock or 0)
+            if disponible < cantidad:
+                errores.append(f"Stock insuficiente para '{producto_nombre}' en fila {numero_fila}")
+                continue
+            
+            if vendedor_nombre not in vendedores:
+                errores.append(f"Vendedor '{vendedor_nombre}' no encontrado en fila {numero_fila}")
+                continue
+            
+            fecha = datetime.strptime(fecha_str, '%Y-%m-%d') if isinstance(fecha_str, str) else fecha_str
+            if not isinstance(fecha, datetime):
+                raise ValueError(f"fecha no válida '{fecha_str}'")
+            ganancia_unitaria = precio - precio_compra
+            
+            stock_restante[producto_id] = disponible - cantidad
+            validas.append((fecha, cliente_nombre, producto_id, vendedores[vendedor_nombre],
+                            cantidad, precio, precio_compra, ganancia_unitaria))
+        except Exception as e:
+            errores.append(f"Error en fila {numero_fila}: {str(e)}")
+    
+    if not validas:
+        return 0, errores
+    
+    progreso(60, f'Guardando {len(validas)} ventas')
+    # Descontar el stock por producto de una vez; la condición evita dejarlo negativo
+    # si otra venta lo cambió mientras tanto.
+    cantidades = {}
+    for venta in validas:
+        cantidades[venta[2]] = cantidades.get(venta[2], 0) + venta[4]
+    tabla_stock = Stock.__table__
+    resultado = db.session.execute(
+        tabla_stock.update().where(
+            tabla_stock.c.producto_id == bindparam('b_producto_id'),
+            tabla_stock.c.cantidad_disponible >= bindparam('b_cantidad')
+        ).values(cantidad_disponible=tabla_stock.c.cantidad_disponible - bindparam('b_cantidad')),
+        [{'b_producto_id': producto_id, 'b_cantidad': cantidad} for producto_id, cantidad in cantidades.items()]
+    )
+    if resultado.rowcount != len(cantidades):
+        raise ValueError('El stock cambió durante la importación, vuelva a intentarlo')
+    
+    # Crear los clientes que faltan en bloque
+    nuevos = {venta[1] for venta in validas} - clientes.keys()
+    if nuevos:
+        db.session.execute(Cliente.__table__.insert(), [{'nombre': nombre, 'telefono': ''} for nombre in nuevos])
+        for nombre, cliente_id in buscar_en_lotes(
+            db.session.query(Cliente.nombre, Cliente.id).order_by(Cliente.id), Cliente.nombre, nuevos
+        ):
+            clientes.setdefault(nombre, cliente_id)
+    
+    # Lugar de entrega por defecto
+    lugar_entrega = LugarEntrega.query.filter_by(nombre='Importado').first()
+    if not lugar_entrega:
+        lugar_entrega = LugarEntrega(
+            nombre='Importado',
+            direccion='Importado desde Excel',
+            telefono='',
+            tipo='importado'
+        )
+        db.session.add(lugar_entrega)
+        db.session.flush()
     
-    # Crear respuesta
-    response = make_response()
-    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    response.headers['Content-Disposition'] = 'attachment; filename=reporte_ventas.xlsx'
+    # Insertar las ventas y luego su detalle y ganancias con los IDs que asignó la base.
+    # Las fechas del Excel son hora local del negocio; fecha se guarda en UTC y la
+    # ganancia lleva la misma fecha que su venta, así ambas caen en el mismo día local.
+    nuevas_ventas = []
+    for fecha, cliente_nombre, producto_id, vendedor_id, cantidad, precio, _, _ in validas:
+        nuevas_ventas.append({
+            'fecha': fecha.replace(tzinfo=ZONA_HORARIA).astimezone(timezone.utc).replace(tzinfo=None),
+            'fecha_local': fecha.date(),
+            'total': precio * cantidad,
+            'cliente_id': clientes[cliente_nombre],
+            'lugar_entrega_id': lugar_entrega.id,
+            'vendedor_id': vendedor_id,
+            'estado': 'contraentrega',
+            'descuento_id': None
+        })
+    venta_ids = insertar_devolviendo_ids(Venta.__table__, nuevas_ventas)
+    
+    detalle, ganancias = [], []
+    for venta_id, venta, (_, _, producto_id, _, cantidad, precio, precio_compra, ganancia_unitaria) in zip(
+            venta_ids, nuevas_ventas, validas):
+        detalle.append({
+            'venta_id': venta_id,
+            'producto_id': producto_id,
+            'cantidad': cantidad,
+            'precio_unitario': precio
+        })
+        ganancias.append({
+            'producto_id': producto_id,
+            'venta_id': venta_id,
+            'cantidad_vendida': cantidad,
+            'precio_venta': precio,
+            'precio_compra': precio_compra,
+            'ganancia_unitaria': ganancia_unitaria,
+            'ganancia_total': ganancia_unitaria * cantidad,
+            'fecha': venta['fecha'],
+            'fecha_local': venta['fecha_local']
+        })
     
-    # Guardar en memoria
-    from io import BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    response.data = output.getvalue()
+    db.session.execute(venta_producto.insert(), detalle)
+    ganancia_ids = insertar_devolviendo_ids(Ganancias.__table__, ganancias)
+    registros = [(ganancia_id, fila['producto_id'], fila['fecha'], fila['cantidad_vendida'],
+                  fila['ganancia_unitaria'], fila['ganancia_total'])
+                 for ganancia_id, fila in zip(ganancia_ids, ganancias)]
+    registrados = registrar_en_resumenes(registros)
+    db.session.commit()
+    notificar_ganancias(registrados)
     
-    return response
+    return len(validas), errores
+
+def trabajo_importar_ventas(ruta, progreso):
+    """Importa el archivo subido y lo elimina al terminar"""
+    try:
+        ventas_importadas, errores = importar_ventas_desde_excel(ruta, progreso)
+    finally:
+        os.remove(ruta)
+    return {
+        'mensaje': f'Se importaron {ventas_importadas} ventas',
+        'errores': errores
+    }
 
 # Ruta para importar ventas desde Excel
 @app.route('/ventas/importar', methods=['GET', 'POST'])
 @login_required
+@con_puerta_escrituras
 def importar_ventas():
     if request.method == 'POST':
         if 'archivo_excel' not in request.files:
@@ -627,116 +2036,12 @@ def importar_ventas():
         
         if archivo and archivo.filename.endswith(('.xlsx', '.xls')):
             try:
-                # Cargar el archivo Excel
-                wb = load_workbook(archivo)
-                ws = wb.active
-                
-                ventas_importadas = 0
-                errores = []
-                
-                # Leer datos del Excel (asumiendo formato: Fecha, Cliente, Producto, Cantidad, Precio, Vendedor)
-                for row in range(2, ws.max_row + 1):  # Saltar encabezados
-                    try:
-                        fecha_str = ws.cell(row=row, column=1).value
-                        cliente_nombre = ws.cell(row=row, column=2).value
-                        producto_nombre = ws.cell(row=row, column=3).value
-                        cantidad = ws.cell(row=row, column=4).value
-                        precio = ws.cell(row=row, column=5).value
-                        vendedor_nombre = ws.cell(row=row, column=6).value
-                        
-                        if not all([fecha_str, cliente_nombre, producto_nombre, cantidad, precio, vendedor_nombre]):
-                            continue
-                        
-                        # Buscar o crear cliente
-                        cliente = Cliente.query.filter_by(nombre=cliente_nombre).first()
-                        if not cliente:
-                            cliente = Cliente(nombre=cliente_nombre, telefono='')
-                            db.session.add(cliente)
-                            db.session.flush()
-                        
-                        # Buscar producto
-                        producto = Producto.query.filter_by(nombre=producto_nombre).first()
-                        if not producto:
-                            errores.append(f"Producto '{producto_nombre}' no encontrado en fila {row}")
-                            continue
-                        
-                        # Verificar stock
-                        if producto.stock.cantidad_disponible < cantidad:
-                            errores.append(f"Stock insuficiente para '{producto_nombre}' en fila {row}")
-                            continue
-                        
-                        # Buscar vendedor
-                        vendedor = Usuario.query.filter_by(username=vendedor_nombre).first()
-                        if not vendedor:
-                            errores.append(f"Vendedor '{vendedor_nombre}' no encontrado en fila {row}")
-                            continue
-                        
-                        # Crear lugar de entrega por defecto
-                        lugar_entrega = LugarEntrega.query.filter_by(nombre='Importado').first()
-                        if not lugar_entrega:
-                            lugar_entrega = LugarEntrega(
-                                nombre='Importado',
-                                direccion='Importado desde Excel',
-                                telefono='',
-                                tipo='importado'
-                            )
-                            db.session.add(lugar_entrega)
-                            db.session.flush()
-                        
-                        # Crear venta
-                        venta = Venta(
-                            fecha=datetime.strptime(fecha_str, '%Y-%m-%d') if isinstance(fecha_str, str) else fecha_str,
-                            cliente_id=cliente.id,
-                            lugar_entrega_id=lugar_entrega.id,
-                            vendedor_id=vendedor.id,
-                            estado='contraentrega',
-                            total=precio * cantidad
-                        )
-                        db.session.add(venta)
-                        db.session.flush()
-                        
-                        # Agregar producto a la venta
-                        db.session.execute(venta_producto.insert().values(
-                            venta_id=venta.id,
-                            producto_id=producto.id,
-                            cantidad=cantidad,
-                            precio_unitario=precio
-                        ))
-                        
-                        # Registrar ganancia
-                        ganancia_unitaria = precio - producto.precio_compra
-                        ganancia_total = ganancia_unitaria * cantidad
-                        
-                        ganancia = Ganancias(
-                            producto_id=producto.id,
-                            venta_id=venta.id,
-                            cantidad_vendida=cantidad,
-                            precio_venta=precio,
-                            precio_compra=producto.precio_compra,
-                            ganancia_unitaria=ganancia_unitaria,
-                            ganancia_total=ganancia_total
-                        )
-                        db.session.add(ganancia)
-                        
-                        # Actualizar stock
-                        producto.stock.cantidad_disponible -= cantidad
-                        
-                        ventas_importadas += 1
-                        
-                    except Exception as e:
-                        errores.append(f"Error en fila {row}: {str(e)}")
-                        continue
-                
-                db.session.commit()
-                
-                if ventas_importadas > 0:
-                    flash(f'Se importaron {ventas_importadas} ventas exitosamente', 'success')
-                if errores:
-                    flash(f'Errores encontrados: {len(errores)}', 'warning')
-                    for error in errores[:5]:  # Mostrar solo los primeros 5 errores
-                        flash(error, 'error')
-                
-                return redirect(url_for('ventas'))
+                # Guardar el archivo y procesarlo en segundo plano
+                os.makedirs(DIRECTORIO_TRABAJOS, exist_ok=True)
+                ruta = os.path.join(DIRECTORIO_TRABAJOS, f"importacion_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.xlsx")
+                archivo.save(ruta)
+                trabajo_id = encolar_trabajo('importar_ventas', trabajo_importar_ventas, ruta)
+                return redirect(url_for('ver_trabajo', trabajo_id=trabajo_id))
                 
             except Exception as e:
                 flash(f'Error al procesar el archivo: {str(e)}', 'error')
@@ -809,8 +2114,8 @@ def descargar_plantilla():
 @login_required
 def ganancias():
     # Estadísticas generales
-    total_ganancias = db.session.query(db.func.sum(Ganancias.ganancia_total)).scalar() or 0
-    total_ventas = Venta.query.count()
+    total_ganancias = db.session.query(db.func.sum(GananciasPorProducto.ganancia_total)).scalar() or 0
+    total_ventas = obtener_contadores()['venta']
     ganancia_promedio = total_ganancias / total_ventas if total_ventas > 0 else 0
     
     # Todas las ventas individuales con información del vendedor (excluyendo cantidad 0)
@@ -831,55 +2136,12 @@ def ganancias():
         Ganancias.cantidad_vendida > 0
     ).order_by(Ganancias.fecha.desc()).all()
     
-    # Ganancias por producto (sin duplicados) - para estadísticas (excluyendo cantidad 0)
-    ganancias_por_producto_raw = db.session.query(
-        Producto.id,
-        Producto.nombre,
-        Producto.precio,
-        Producto.precio_compra,
-        db.func.sum(Ganancias.ganancia_total).label('ganancia_total'),
-        db.func.sum(Ganancias.cantidad_vendida).label('cantidad_vendida'),
-        db.func.avg(Ganancias.ganancia_unitaria).label('ganancia_promedio'),
-        (Producto.precio - Producto.precio_compra).label('diferencia_precio')
-    ).join(Ganancias).filter(
-        Ganancias.cantidad_vendida > 0
-    ).group_by(Producto.id, Producto.nombre, Producto.precio, Producto.precio_compra).all()
-    
-    # Convertir a diccionarios para JSON
-    ganancias_por_producto = []
-    for row in ganancias_por_producto_raw:
-        ganancias_por_producto.append({
-            'id': row.id,
-            'nombre': row.nombre,
-            'precio': float(row.precio),
-            'precio_compra': float(row.precio_compra),
-            'ganancia_total': float(row.ganancia_total or 0),
-            'cantidad_vendida': int(row.cantidad_vendida or 0),
-            'ganancia_promedio': float(row.ganancia_promedio or 0),
-            'diferencia_precio': float(row.diferencia_precio or 0)
-        })
-    
-    # Calcular ganancias diarias para la gráfica lineal
-    ganancias_diarias_raw = db.session.query(
-        db.func.date(db.func.datetime(Ganancias.fecha, '-5 hours')).label('fecha'),
-        db.func.sum(Ganancias.ganancia_total).label('ganancia_diaria')
-    ).filter(
-        Ganancias.cantidad_vendida > 0
-    ).group_by(db.func.date(db.func.datetime(Ganancias.fecha, '-5 hours'))).order_by(
-        db.func.date(db.func.datetime(Ganancias.fecha, '-5 hours'))
-    ).all()
-    
-    # Convertir a diccionarios para JSON
-    ganancias_diarias = []
-    for row in ganancias_diarias_raw:
-        ganancias_diarias.append({
-            'fecha': str(row.fecha),
-            'ganancia_diaria': float(row.ganancia_diaria or 0)
-        })
+    # Ganancias por producto y diarias desde las tablas de resumen
+    ganancias_por_producto = obtener_ganancias_por_producto()
+    ganancias_diarias = obtener_ganancias_diarias()
     
     # Consulta para ganancias en tiempo real del día actual (por venta individual)
-    from datetime import datetime, date
-    hoy = date.today()
+    hoy = hoy_local()
     ganancias_tiempo_real_raw = db.session.query(
         Ganancias.fecha.label('fecha_venta'),
         Ganancias.ganancia_total.label('ganancia_venta'),
@@ -887,7 +2149,7 @@ def ganancias():
         Cliente.nombre.label('cliente_nombre'),
         Usuario.username.label('vendedor_nombre')
     ).join(Producto).join(Venta).join(Cliente).join(Usuario).filter(
-        db.func.date(Ganancias.fecha) == hoy,
+        Ganancias.fecha_local == hoy,
         Ganancias.cantidad_vendida > 0
     ).order_by(Ganancias.fecha).all()
     
@@ -939,82 +2201,77 @@ def ganancias():
 @app.route('/ganancias/data')
 @login_required
 def ganancias_data():
-    """Datos JSON en tiempo real para actualizar las gráficas de ganancias"""
+    """Datos JSON en tiempo real para actualizar las gráficas de ganancias.
+    
+    Con ?since=<cursor> solo devuelve lo ocurrido después del cursor; si los datos
+    no cambiaron desde el ETag del cliente responde 304 sin consultarlos.
+    """
+    hoy = hoy_local()
+    etag = f"ganancias-{obtener_version('ganancias_reinicio')}-{obtener_version('ganancias')}-{hoy.strftime('%Y%m%d')}"
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    cursor = obtener_cursor_ganancias()
+    desde_id, productos_vigentes = leer_cursor_ganancias(request.args.get('since'))
+    
     # Estadísticas generales
-    total_ganancias = db.session.query(db.func.sum(Ganancias.ganancia_total)).scalar() or 0
-    total_ventas = Venta.query.count()
+    total_ganancias = db.session.query(db.func.sum(GananciasPorProducto.ganancia_total)).scalar() or 0
+    total_ventas = obtener_contadores()['venta']
     ganancia_promedio = total_ganancias / total_ventas if total_ventas > 0 else 0
 
-    # Ganancias por producto (excluyendo cantidad 0)
-    ganancias_por_producto_raw = db.session.query(
-        Producto.id,
-        Producto.nombre,
-        Producto.precio,
-        Producto.precio_compra,
-        db.func.sum(Ganancias.ganancia_total).label('ganancia_total'),
-        db.func.sum(Ganancias.cantidad_vendida).label('cantidad_vendida'),
-        db.func.avg(Ganancias.ganancia_unitaria).label('ganancia_promedio'),
-        (Producto.precio - Producto.precio_compra).label('diferencia_precio')
-    ).join(Ganancias).filter(
-        Ganancias.cantidad_vendida > 0
-    ).group_by(Producto.id, Producto.nombre, Producto.precio, Producto.precio_compra).all()
-
-    ganancias_por_producto = []
-    for row in ganancias_por_producto_raw:
-        ganancias_por_producto.append({
-            'id': row.id,
-            'nombre': row.nombre,
-            'precio': float(row.precio),
-            'precio_compra': float(row.precio_compra),
-            'ganancia_total': float(row.ganancia_total or 0),
-            'cantidad_vendida': int(row.cantidad_vendida or 0),
-            'ganancia_promedio': float(row.ganancia_promedio or 0),
-            'diferencia_precio': float(row.diferencia_precio or 0)
-        })
-
-    # Ganancias diarias (histórico por día) en hora de Perú (UTC-5)
-    ganancias_diarias_raw = db.session.query(
-        db.func.date(db.func.datetime(Ganancias.fecha, '-5 hours')).label('fecha'),
-        db.func.sum(Ganancias.ganancia_total).label('ganancia_diaria')
-    ).filter(
-        Ganancias.cantidad_vendida > 0
-    ).group_by(db.func.date(db.func.datetime(Ganancias.fecha, '-5 hours'))).order_by(
-        db.func.date(db.func.datetime(Ganancias.fecha, '-5 hours'))
-    ).all()
-
-    ganancias_diarias = []
-    for row in ganancias_diarias_raw:
-        ganancias_diarias.append({
-            'fecha': str(row.fecha),
-            'ganancia_diaria': float(row.ganancia_diaria or 0)
-        })
-
-    # Ganancias en tiempo real (por venta de hoy)
-    from datetime import date
-    hoy = date.today()
+    # Ganancias en tiempo real (por venta de hoy), solo las nuevas si hay cursor
     ganancias_tiempo_real_raw = db.session.query(
+        Ganancias.id,
+        Ganancias.producto_id,
         Ganancias.fecha.label('fecha_venta'),
         Ganancias.ganancia_total.label('ganancia_venta')
     ).filter(
-        db.func.date(Ganancias.fecha) == hoy,
+        Ganancias.fecha_local == hoy,
         Ganancias.cantidad_vendida > 0
-    ).order_by(Ganancias.fecha).all()
+    )
+    if desde_id is not None:
+        ganancias_tiempo_real_raw = ganancias_tiempo_real_raw.filter(Ganancias.id > desde_id)
+    ganancias_tiempo_real_raw = ganancias_tiempo_real_raw.order_by(Ganancias.fecha).all()
+
+    if desde_id is None:
+        total_hoy = sum(float(row.ganancia_venta or 0) for row in ganancias_tiempo_real_raw)
+        ventas_hoy = len(ganancias_tiempo_real_raw)
+    else:
+        total_hoy, ventas_hoy = obtener_ganancias_hoy()
 
     ganancias_tiempo_real = []
-    ganancia_acumulada = 0
+    ganancia_acumulada = total_hoy - sum(float(row.ganancia_venta or 0) for row in ganancias_tiempo_real_raw)
     for row in ganancias_tiempo_real_raw:
         ganancia_venta = float(row.ganancia_venta or 0)
         ganancia_acumulada += ganancia_venta
         ganancias_tiempo_real.append({
+            'id': row.id,
             'fecha_venta': row.fecha_venta.isoformat() if row.fecha_venta else None,
             'ganancia_venta': ganancia_venta,
             'ganancia_acumulada': ganancia_acumulada
         })
 
-    total_hoy = ganancia_acumulada
-    ventas_hoy = len(ganancias_tiempo_real)
+    # Ganancias por producto y diarias (días locales de ZONA_HORARIA) desde las tablas de resumen
+    if desde_id is None:
+        ganancias_por_producto = obtener_ganancias_por_producto()
+        ganancias_diarias = obtener_ganancias_diarias()
+    else:
+        # Solo los productos y días que cambiaron después del cursor
+        cambios = db.session.query(Ganancias.producto_id, Ganancias.fecha_local).filter(
+            Ganancias.id > desde_id,
+            Ganancias.cantidad_vendida > 0
+        ).all()
+        if not productos_vigentes:
+            ganancias_por_producto = obtener_ganancias_por_producto()  # Un producto cambió de nombre o precio
+        else:
+            ganancias_por_producto = obtener_ganancias_por_producto({row.producto_id for row in cambios}) if cambios else []
+        ganancias_diarias = obtener_ganancias_diarias({row.fecha_local for row in cambios}) if cambios else []
 
-    return jsonify({
+    response = jsonify({
+        'cursor': cursor,
+        'completo': desde_id is None,
         'total_ganancias': float(total_ganancias),
         'total_ventas': int(total_ventas),
         'ganancia_promedio': float(ganancia_promedio),
@@ -1025,22 +2282,553 @@ def ganancias_data():
         'ventas_hoy': int(ventas_hoy),
         'currency_symbol': 'S/.'
     })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/ganancias/stream')
+@login_required
+def ganancias_stream():
+    """Server-Sent Events con las ganancias nuevas a medida que se confirman las ventas"""
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    if ultimo_id is None:
+        ultimo_id = canal_ganancias.ultimo_id
+    
+    def generar(ultimo_id):
+        yield 'retry: 3000\n\n'
+        while True:
+            eventos = canal_ganancias.esperar(ultimo_id, timeout=15)
+            if eventos is None:
+                # El cliente debe volver a pedir todos los datos
+                ultimo_id = canal_ganancias.ultimo_id
+                yield f'id: {ultimo_id}\nevent: reset\ndata: {{}}\n\n'
+                continue
+            if not eventos:
+                yield ': ping\n\n'  # Mantener viva la conexión
+                continue
+            for evento_id, datos in eventos:
+                ultimo_id = evento_id
+                yield f'id: {evento_id}\nevent: ganancias\ndata: {datos}\n\n'
+    
+    response = app.response_class(generar(ultimo_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Cubo de análisis en memoria: una fila por registro de ganancias, con las dimensiones
+# codificadas como enteros en arreglos de NumPy. Se pone al día de forma incremental
+# (solo lee los registros con ID mayor al último cargado) y los pivotes se calculan
+# con operaciones vectorizadas, sin consultar SQLite.
+DIMENSIONES_CUBO = ['producto', 'categoria', 'vendedor', 'cliente', 'lugar_entrega', 'estado', 'dia', 'semana', 'mes']
+MEDIDAS_CUBO = ['ganancia', 'cantidad', 'ingresos', 'registros']
+LIMITE_GRUPOS_DENSOS = 1 << 22  # Hasta aquí los grupos se acumulan en un arreglo denso
+
+# Dimensiones que se muestran con el nombre de otra tabla (su versión es 'ref_<tabla>')
+NOMBRES_CUBO = {
+    'producto': ('producto', lambda: db.session.query(Producto.id, Producto.nombre)),
+    'categoria': ('categoria', lambda: db.session.query(Categoria.id, Categoria.nombre)),
+    'vendedor': ('usuario', lambda: db.session.query(Usuario.id, Usuario.username)),
+    'cliente': ('cliente', lambda: db.session.query(Cliente.id, Cliente.nombre)),
+    'lugar_entrega': ('lugar_entrega', lambda: db.session.query(LugarEntrega.id, LugarEntrega.nombre))
+}
+
+# Columnas del origen de cada dimensión y cómo se obtiene su valor
+ORIGEN_DIMENSIONES_CUBO = {
+    'producto': ('producto_id', None),
+    'categoria': ('categoria_id', None),
+    'vendedor': ('vendedor_id', None),
+    'cliente': ('cliente_id', None),
+    'lugar_entrega': ('lugar_entrega_id', None),
+    'estado': ('estado', None),
+    'dia': ('dia', None),
+    'semana': ('dia', lunes_de),
+    'mes': ('dia', lambda dia: dia[:7])
+}
+
+CONSULTA_CUBO = (
+    'SELECT g.id, g.producto_id, p.categoria_id, v.vendedor_id, v.cliente_id, v.lugar_entrega_id, '
+    "coalesce(v.estado, ''), coalesce(g.fecha_local, date(g.fecha)), g.ganancia_total, g.cantidad_vendida, "
+    'g.precio_venta * g.cantidad_vendida '
+    'FROM ganancias g JOIN venta v ON v.id = g.venta_id JOIN producto p ON p.id = g.producto_id '
+    'WHERE g.id > ? AND g.cantidad_vendida > 0 ORDER BY g.id LIMIT ?'
+)
+COLUMNAS_CONSULTA_CUBO = ['id', 'producto_id', 'categoria_id', 'vendedor_id', 'cliente_id', 'lugar_entrega_id',
+                          'estado', 'dia', 'ganancia', 'cantidad', 'ingresos']
+
+class CuboGanancias:
+    def __init__(self, tamaño_lote=50000):
+        self.bloqueo = threading.Lock()
+        self.tamaño_lote = tamaño_lote
+        self._vaciar()
+    
+    def _vaciar(self):
+        self.filas = 0
+        self.ultimo_id = 0
+        self.reinicio = None  # Versión 'ganancias_reinicio' de los datos cargados
+        self.columnas = {}
+        self.codigos = {dimension: {} for dimension in DIMENSIONES_CUBO}  # valor -> código
+        self.valores = {dimension: [] for dimension in DIMENSIONES_CUBO}  # código -> valor
+        self.nombres = {}  # dimensión -> (versión, {id: nombre})
+    
+    def reiniciar(self):
+        """Descarta los datos cargados; se vuelven a leer en la siguiente consulta"""
+        with self.bloqueo:
+            self._vaciar()
+    
+    def _codificar(self, dimension, valores):
+        """Códigos de una lista de valores distintos, asignando códigos nuevos si hace falta"""
+        codigos = self.codigos[dimension]
+        for valor in valores:
+            if valor not in codigos:
+                codigos[valor] = len(self.valores[dimension])
+                self.valores[dimension].append(valor)
+        return np.array([codigos[valor] for valor in valores], dtype=np.int32)
+    
+    def _agregar(self, filas):
+        """Añade un lote de filas de CONSULTA_CUBO al final de los arreglos"""
+        origen = dict(zip(COLUMNAS_CONSULTA_CUBO, zip(*filas)))
+        nuevas = {
+            'ganancia': np.array(origen['ganancia'], dtype=np.float64),
+            'cantidad': np.array(origen['cantidad'], dtype=np.int64),
+            'ingresos': np.array(origen['ingresos'], dtype=np.float64)
+        }
+        for dimension in DIMENSIONES_CUBO:
+            columna, derivar = ORIGEN_DIMENSIONES_CUBO[dimension]
+            unicos, inversa = np.unique(np.array(origen[columna]), return_inverse=True)
+            unicos = unicos.tolist()
+            if derivar:
+                unicos = [derivar(valor) for valor in unicos]
+            nuevas[dimension] = self._codificar(dimension, unicos)[inversa]
+        
+        total = self.filas + len(filas)
+        for nombre, datos in nuevas.items():
+            columna = self.columnas.get(nombre)
+            if columna is None or len(columna) < total:
+                # Crecer al doble para que añadir filas cueste O(1) amortizado
+                ampliada = np.empty(max(total, 2 * self.filas, 1024), dtype=datos.dtype)
+                if columna is not None:
+                    ampliada[:self.filas] = columna[:self.filas]
+                self.columnas[nombre] = columna = ampliada
+            columna[self.filas:total] = datos
+        self.filas = total
+        self.ultimo_id = filas[-1][0]
+    
+    def sincronizar(self):
+        """Carga los registros nuevos (todo de nuevo si se eliminaron ganancias) y los nombres cambiados"""
+        versiones = dict(db.session.query(VersionDatos.nombre, VersionDatos.version).filter(
+            VersionDatos.nombre.in_(['ganancias_reinicio'] + [f'ref_{tabla}' for tabla, _ in NOMBRES_CUBO.values()])
+        ).all())
+        with self.bloqueo:
+            if self.reinicio != versiones.get('ganancias_reinicio', 0):
+                self._vaciar()
+                self.reinicio = versiones.get('ganancias_reinicio', 0)
+            
+            conexion = db.session.connection()
+            while True:
+                filas = conexion.exec_driver_sql(CONSULTA_CUBO, (self.ultimo_id, self.tamaño_lote)).fetchall()
+                if not filas:
+                    break
+                self._agregar(filas)
+            
+            for dimension, (tabla, consulta) in NOMBRES_CUBO.items():
+                version = versiones.get(f'ref_{tabla}', 0)
+                if self.nombres.get(dimension, (None,))[0] != version:
+                    self.nombres[dimension] = (version, dict(consulta().all()))
+            
+            # Vistas de los datos actuales: las filas que se añadan después no las alteran
+            return (self.filas, {nombre: columna[:self.filas] for nombre, columna in self.columnas.items()},
+                    {dimension: list(valores) for dimension, valores in self.valores.items()},
+                    {dimension: nombres for dimension, (_, nombres) in self.nombres.items()})
+    
+    def pivotar(self, por, medidas, filtros, desde=None, hasta=None, limite=None):
+        """Agrupa por las dimensiones indicadas y suma las medidas de las filas que pasan los filtros
+        
+        filtros es {dimensión: valores aceptados}; desde y hasta limitan el día local ('YYYY-MM-DD').
+        Con limite solo se devuelven los grupos con mayor valor de la primera medida.
+        """
+        filas, columnas, valores, nombres = self.sincronizar()
+        if not filas:
+            return []
+        
+        # Los filtros se evalúan una vez por valor distinto y se aplican a las filas por código
+        seleccion = np.ones(filas, dtype=bool)
+        for dimension, aceptados in filtros.items():
+            aceptados = set(aceptados)
+            permitidos = np.array([valor in aceptados for valor in valores[dimension]])
+            seleccion &= permitidos[columnas[dimension]]
+        if desde or hasta:
+            permitidos = np.array([(not desde or dia >= desde) and (not hasta or dia <= hasta)
+                                   for dia in valores['dia']])
+            seleccion &= permitidos[columnas['dia']]
+        
+        combinaciones = 1
+        for dimension in por:
+            combinaciones *= len(valores[dimension])
+        if combinaciones > np.iinfo(np.int64).max:
+            # La clave combinada no cabe en int64: agrupar por las filas de códigos
+            codigos = np.column_stack([columnas[dimension][seleccion] for dimension in por])
+            grupos, inversa = np.unique(codigos, axis=0, return_inverse=True)
+            inversa = inversa.reshape(-1)
+        else:
+            # Clave combinada de los grupos: código de cada dimensión en base mixta
+            clave = np.zeros(filas, dtype=np.int64)
+            for dimension in por:
+                clave = clave * len(valores[dimension]) + columnas[dimension]
+            clave = clave[seleccion]
+            if combinaciones <= LIMITE_GRUPOS_DENSOS:
+                # Pocas combinaciones posibles: contar directamente por clave, sin ordenar
+                conteo = np.bincount(clave, minlength=combinaciones)
+                grupos = np.flatnonzero(conteo)
+                inversa = None
+            else:
+                grupos, inversa = np.unique(clave, return_inverse=True)
+        
+        totales = {}
+        for medida in medidas:
+            pesos = None if medida == 'registros' else columnas[medida][seleccion]
+            if inversa is None:
+                totales[medida] = (conteo if pesos is None else np.bincount(clave, weights=pesos, minlength=combinaciones))[grupos]
+            else:
+                totales[medida] = np.bincount(inversa, weights=pesos, minlength=len(grupos))
+        
+        orden = np.arange(len(grupos))
+        if limite is not None:
+            orden = np.argsort(-totales[medidas[0]], kind='stable')[:limite]
+        
+        resultado = []
+        for i, grupo in zip(orden.tolist(), grupos[orden].tolist()):
+            if isinstance(grupo, list):
+                codigos_grupo = dict(zip(por, grupo))
+            else:
+                codigos_grupo = {}
+                for dimension in reversed(por):
+                    grupo, codigos_grupo[dimension] = divmod(grupo, len(valores[dimension]))
+            fila = {}
+            for dimension in por:
+                codigo = codigos_grupo[dimension]
+                valor = valores[dimension][codigo]
+                fila[dimension] = {'id': valor, 'nombre': nombres[dimension].get(valor)} if dimension in nombres else valor
+            for medida in medidas:
+                total = totales[medida][i]
+                fila[medida] = int(total) if medida in ('cantidad', 'registros') else float(total)
+            resultado.append(fila)
+        return resultado
+    
+    def estadisticas(self):
+        with self.bloqueo:
+            return {
+                'filas': self.filas,
+                'ultimo_id': self.ultimo_id,
+                'bytes': sum(columna.nbytes for columna in self.columnas.values()),
+                'cardinalidades': {dimension: len(valores) for dimension, valores in self.valores.items()}
+            }
+
+cubo_ganancias = CuboGanancias()
+
+@app.route('/api/pivot')
+@login_required
+def pivot_ganancias():
+    """Pivote de ganancias desde el cubo en memoria.
+    
+    por: dimensiones a agrupar separadas por comas (ninguna = total general);
+    medidas: ganancia, cantidad, ingresos y/o registros; desde/hasta: días locales;
+    limite: solo los N grupos con mayor valor de la primera medida;
+    cualquier dimensión como parámetro filtra por sus valores (IDs, estados, días 'YYYY-MM-DD',
+    lunes de la semana o meses 'YYYY-MM'), varios separados por comas.
+    """
+    por = [dimension for dimension in (request.args.get('por') or '').split(',') if dimension]
+    medidas = [medida for medida in (request.args.get('medidas') or 'ganancia').split(',') if medida]
+    if (len(set(por)) != len(por) or any(dimension not in DIMENSIONES_CUBO for dimension in por)
+            or any(medida not in MEDIDAS_CUBO for medida in medidas)):
+        abort(400)
+    
+    filtros = {}
+    for dimension in DIMENSIONES_CUBO:
+        if request.args.get(dimension):
+            valores = request.args[dimension].split(',')
+            if dimension in NOMBRES_CUBO:
+                try:
+                    valores = [int(valor) for valor in valores]
+                except ValueError:
+                    abort(400)
+            filtros[dimension] = valores
+    desde, hasta = leer_rango_fechas(request.args)
+    limite = request.args.get('limite', type=int)
+    
+    inicio = time.perf_counter()
+    resultado = cubo_ganancias.pivotar(por, medidas, filtros,
+                                       desde.isoformat() if desde else None, hasta.isoformat() if hasta else None,
+                                       max(limite, 0) if limite is not None else None)
+    return jsonify({
+        'por': por,
+        'medidas': medidas,
+        'grupos': resultado,
+        'milisegundos': round((time.perf_counter() - inicio) * 1000, 2)
+    })
+
+# Rankings de productos, vendedores y clientes por ganancia, unidades e ingresos, en el
+# histórico, el mes y el día actuales. Cada tabla guarda los totales por miembro y una
+# lista ordenada por métrica, así el top-K es un corte de la lista. Se cargan con una
+# agregación al iniciar, después suman solo los registros nuevos y las ventanas del mes
+# y del día se vacían al cambiar de periodo.
+METRICAS_RANKING = ['ganancia', 'cantidad', 'ingresos']
+VENTANAS_RANKING = ['historico', 'mes', 'hoy']
+DIMENSIONES_RANKING = {
+    'producto': ('g.producto_id', lambda ids: db.session.query(Producto.id, Producto.nombre).filter(Producto.id.in_(ids))),
+    'vendedor': ('v.vendedor_id', lambda ids: db.session.query(Usuario.id, Usuario.username).filter(Usuario.id.in_(ids))),
+    'cliente': ('v.cliente_id', lambda ids: db.session.query(Cliente.id, Cliente.nombre).filter(Cliente.id.in_(ids)))
+}
+LIMITE_RANKING = 100
+
+def rango_ventana_ranking(ventana, hoy):
+    """Días locales [desde, hasta) que abarca la ventana 'mes' u 'hoy' en el día hoy ('YYYY-MM-DD')"""
+    dia = datetime.fromisoformat(hoy).date()
+    if ventana == 'hoy':
+        return hoy, (dia + timedelta(days=1)).isoformat()
+    inicio = dia.replace(day=1)
+    return inicio.isoformat(), (inicio + timedelta(days=32)).replace(day=1).isoformat()
+
+class TablaPosiciones:
+    """Totales por miembro con una lista (-valor, clave) ordenada por cada métrica"""
+    
+    def __init__(self):
+        self.totales = {}
+        self.ordenadas = {metrica: [] for metrica in METRICAS_RANKING}
+    
+    def sumar(self, clave, valores):
+        anteriores = self.totales.get(clave)
+        nuevos = [a + b for a, b in zip(anteriores, valores)] if anteriores else list(valores)
+        for i, metrica in enumerate(METRICAS_RANKING):
+            lista = self.ordenadas[metrica]
+            if anteriores:
+                del lista[bisect_left(lista, (-anteriores[i], clave))]
+            insort(lista, (-nuevos[i], clave))
+        self.totales[clave] = nuevos
+    
+    def primeros(self, metrica, limite):
+        """Los miembros con mayor valor de la métrica, con todos sus totales"""
+        return [(clave, self.totales[clave]) for _, clave in self.ordenadas[metrica][:limite]]
+
+CONSULTA_RANKINGS = (
+    'SELECT g.id, coalesce(g.fecha_local, date(g.fecha)), g.producto_id, v.vendedor_id, v.cliente_id, '
+    'g.ganancia_total, g.cantidad_vendida, g.precio_venta * g.cantidad_vendida '
+    'FROM ganancias g JOIN venta v ON v.id = g.venta_id '
+    'WHERE g.id > ? AND g.cantidad_vendida > 0 ORDER BY g.id LIMIT ?'
+)
+
+class RankingsVentas:
+    def __init__(self, tamaño_lote=5000):
+        self.bloqueo = threading.Lock()
+        self.tamaño_lote = tamaño_lote
+        self._vaciar()
+    
+    def _vaciar(self):
+        self.cargado = False
+        self.ultimo_id = 0
+        self.reinicio = None  # Versión 'ganancias_reinicio' de los datos cargados
+        self.periodos = {'mes': None, 'hoy': None}  # Rango [desde, hasta) de cada ventana
+        self.tablas = {(dimension, ventana): TablaPosiciones()
+                       for dimension in DIMENSIONES_RANKING for ventana in VENTANAS_RANKING}
+    
+    def reiniciar(self):
+        """Descarta los rankings; se vuelven a cargar en la siguiente consulta"""
+        with self.bloqueo:
+            self._vaciar()
+    
+    def _expirar(self, hoy):
+        """Vacía las ventanas cuyo periodo ya pasó"""
+        for ventana in ['mes', 'hoy']:
+            periodo = rango_ventana_ranking(ventana, hoy)
+            if self.periodos[ventana] != periodo:
+                for dimension in DIMENSIONES_RANKING:
+                    self.tablas[(dimension, ventana)] = TablaPosiciones()
+                self.periodos[ventana] = periodo
+    
+    def _cargar(self, conexion):
+        """Carga inicial con una agregación por dimensión hasta el último registro actual"""
+        self.ultimo_id = conexion.exec_driver_sql('SELECT coalesce(max(id), 0) FROM ganancias').scalar()
+        dia = 'coalesce(g.fecha_local, date(g.fecha))'
+        medidas = ['g.ganancia_total', 'g.cantidad_vendida', 'g.precio_venta * g.cantidad_vendida']
+        sumas = ', '.join(
+            [f'sum({medida})' for medida in medidas]
+            + [f"sum(CASE WHEN {dia} >= ? AND {dia} < ? THEN {medida} ELSE 0 END)"
+               for _ in ['mes', 'hoy'] for medida in medidas])
+        for dimension, (columna, _) in DIMENSIONES_RANKING.items():
+            filas = conexion.exec_driver_sql(
+                f'SELECT {columna}, {sumas} FROM ganancias g JOIN venta v ON v.id = g.venta_id '
+                f'WHERE g.id <= ? AND g.cantidad_vendida > 0 GROUP BY {columna}',
+                self.periodos['mes'] * 3 + self.periodos['hoy'] * 3 + (self.ultimo_id,))
+            for clave, *valores in filas:
+                for i, ventana in enumerate(VENTANAS_RANKING):
+                    totales = valores[3 * i:3 * i + 3]
+                    if totales[1]:
+                        self.tablas[(dimension, ventana)].sumar(clave, totales)
+        self.cargado = True
+    
+    def sincronizar(self):
+        """Suma los registros nuevos (todo de nuevo si se eliminaron ganancias) y vence las ventanas"""
+        reinicio = obtener_version('ganancias_reinicio')
+        with self.bloqueo:
+            if self.reinicio != reinicio:
+                self._vaciar()
+                self.reinicio = reinicio
+            self._expirar(hoy_local().isoformat())
+            
+            conexion = db.session.connection()
+            if not self.cargado:
+                self._cargar(conexion)
+            while True:
+                filas = conexion.exec_driver_sql(CONSULTA_RANKINGS, (self.ultimo_id, self.tamaño_lote)).fetchall()
+                if not filas:
+                    break
+                for _, dia, producto_id, vendedor_id, cliente_id, *totales in filas:
+                    ventanas = ['historico'] + [ventana for ventana in ['mes', 'hoy']
+                                                if self.periodos[ventana][0] <= dia < self.periodos[ventana][1]]
+                    for dimension, clave in [('producto', producto_id), ('vendedor', vendedor_id), ('cliente', cliente_id)]:
+                        for ventana in ventanas:
+                            self.tablas[(dimension, ventana)].sumar(clave, totales)
+                self.ultimo_id = filas[-1][0]
+    
+    def primeros(self, dimension, ventana, metrica, limite=10):
+        """Top de una dimensión y ventana, con el nombre de cada miembro (llamar antes a sincronizar)"""
+        with self.bloqueo:
+            primeros = self.tablas[(dimension, ventana)].primeros(metrica, limite)
+        nombres = dict(DIMENSIONES_RANKING[dimension][1]([clave for clave, _ in primeros]).all()) if primeros else {}
+        return [{
+            'id': clave,
+            'nombre': nombres.get(clave),
+            'ganancia': float(ganancia),
+            'cantidad': int(cantidad),
+            'ingresos': float(ingresos)
+        } for clave, (ganancia, cantidad, ingresos) in primeros]
+    
+    def estadisticas(self):
+        with self.bloqueo:
+            return {
+                'ultimo_id': self.ultimo_id,
+                'periodos': dict(self.periodos),
+                'miembros': {f'{dimension}/{ventana}': len(tabla.totales)
+                             for (dimension, ventana), tabla in self.tablas.items()}
+            }
+
+rankings_ventas = RankingsVentas()
+
+@app.route('/api/rankings')
+@login_required
+def rankings():
+    """Top de productos, vendedores y clientes por ganancia, cantidad o ingresos
+    
+    dimension y ventana (historico, mes, hoy) limitan qué rankings se devuelven; por defecto todos.
+    """
+    metrica = request.args.get('metrica', 'ganancia')
+    dimensiones = [request.args['dimension']] if request.args.get('dimension') else list(DIMENSIONES_RANKING)
+    ventanas = [request.args['ventana']] if request.args.get('ventana') else VENTANAS_RANKING
+    if (metrica not in METRICAS_RANKING or any(dimension not in DIMENSIONES_RANKING for dimension in dimensiones)
+            or any(ventana not in VENTANAS_RANKING for ventana in ventanas)):
+        abort(400)
+    limite = max(1, min(request.args.get('limite', 10, type=int), LIMITE_RANKING))
+    
+    rankings_ventas.sincronizar()
+    return jsonify({
+        'metrica': metrica,
+        'rankings': {dimension: {ventana: rankings_ventas.primeros(dimension, ventana, metrica, limite)
+                                 for ventana in ventanas} for dimension in dimensiones}
+    })
+
+@app.route('/api/ganancias/serie')
+@login_required
+def serie_ganancias():
+    """Ganancias por hora, día, semana o mes en un rango de días locales, en total
+    o agrupadas por producto, vendedor o categoría"""
+    granularidad = request.args.get('granularidad', 'dia')
+    agrupar = request.args.get('agrupar') or 'total'
+    if granularidad not in GRANULARIDADES or (agrupar != 'total' and agrupar not in DIMENSIONES_SERIE):
+        abort(400)
+    
+    consulta = db.session.query(GananciasSerie).filter(
+        GananciasSerie.granularidad == granularidad,
+        GananciasSerie.dimension == agrupar
+    )
+    desde, hasta = leer_rango_fechas(request.args)
+    if desde:
+        consulta = consulta.filter(GananciasSerie.periodo >= periodo_de(granularidad, desde))
+    if hasta:
+        # Las horas del último día van de 'T00' a 'T23'
+        fin = periodo_de(granularidad, hasta)
+        consulta = consulta.filter(GananciasSerie.periodo <= (fin[:10] + 'T23' if granularidad == 'hora' else fin))
+    
+    def punto(fila):
+        return {
+            'periodo': fila.periodo,
+            'ganancia_total': float(fila.ganancia_total),
+            'cantidad_vendida': int(fila.cantidad_vendida),
+            'ingresos': float(fila.ingresos),
+            'registros': int(fila.registros)
+        }
+    
+    if agrupar == 'total':
+        filas = consulta.order_by(GananciasSerie.periodo).all()
+        return jsonify({'granularidad': granularidad, 'agrupar': agrupar, 'serie': [punto(fila) for fila in filas]})
+    
+    modelo, nombre = DIMENSIONES_SERIE[agrupar]
+    filas = consulta.add_columns(nombre).outerjoin(modelo, modelo.id == GananciasSerie.clave).order_by(
+        GananciasSerie.clave, GananciasSerie.periodo
+    ).all()
+    series = {}
+    for fila, nombre_grupo in filas:
+        grupo = series.setdefault(fila.clave, {'id': fila.clave, 'nombre': nombre_grupo, 'serie': []})
+        grupo['serie'].append(punto(fila))
+    return jsonify({'granularidad': granularidad, 'agrupar': agrupar, 'series': list(series.values())})
+
+# Días que abarca la gráfica de historial de un producto
+DIAS_HISTORIAL_PRODUCTO = 90
+
 @app.route('/ganancias/producto/<int:producto_id>')
 @login_required
 def ganancias_producto(producto_id):
     producto = Producto.query.get_or_404(producto_id)
-    ganancias = Ganancias.query.filter_by(producto_id=producto_id).filter(
-        Ganancias.cantidad_vendida > 0
-    ).order_by(Ganancias.fecha.desc()).all()
+    por_pagina = min(max(request.args.get('por_pagina', 50, type=int), 1), 200)
     
-    # Estadísticas del producto
-    total_ganancia = sum(g.ganancia_total for g in ganancias)
-    total_vendido = sum(g.cantidad_vendida for g in ganancias)
+    # Estadísticas del producto desde la tabla de resumen
+    resumen = db.session.get(GananciasPorProducto, producto_id)
+    total_ganancia = float(resumen.ganancia_total) if resumen else 0
+    total_vendido = int(resumen.cantidad_vendida) if resumen else 0
     margen_promedio = producto.margen_ganancia()
     
+    # Paginación por cursor: los registros anteriores al último de la página previa
+    consulta = Ganancias.query.filter(
+        Ganancias.producto_id == producto_id,
+        Ganancias.cantidad_vendida > 0
+    )
+    despues_de = request.args.get('despues_de', type=int)
+    if despues_de:
+        fecha_cursor = db.session.query(Ganancias.fecha).filter_by(id=despues_de, producto_id=producto_id).scalar()
+        if fecha_cursor:
+            consulta = consulta.filter(db.tuple_(Ganancias.fecha, Ganancias.id) < (fecha_cursor, despues_de))
+    
+    ganancias = consulta.order_by(Ganancias.fecha.desc(), Ganancias.id.desc()).limit(por_pagina + 1).all()
+    hay_mas = len(ganancias) > por_pagina
+    ganancias = ganancias[:por_pagina]
+    siguiente = url_for('ganancias_producto', producto_id=producto_id, despues_de=ganancias[-1].id,
+                        por_pagina=por_pagina) if hay_mas else None
+    
+    # Historial de los últimos días desde la serie diaria del producto
+    hoy = hoy_local()
+    inicio = hoy - timedelta(days=DIAS_HISTORIAL_PRODUCTO - 1)
+    por_dia = dict(db.session.query(GananciasSerie.periodo, GananciasSerie.ganancia_total).filter(
+        GananciasSerie.granularidad == 'dia',
+        GananciasSerie.dimension == 'producto',
+        GananciasSerie.clave == producto_id,
+        GananciasSerie.periodo >= inicio.isoformat()
+    ).all())
+    dias = [(inicio + timedelta(days=i)).isoformat() for i in range(DIAS_HISTORIAL_PRODUCTO)]
+    historial = [{'fecha': dia, 'ganancia': float(por_dia.get(dia, 0))} for dia in dias]
+    
     return render_template('ganancias_producto.html',
                          producto=producto,
                          ganancias=ganancias,
+                         siguiente=siguiente,
+                         historial=historial,
                          total_ganancia=total_ganancia,
                          total_vendido=total_vendido,
                          margen_promedio=margen_promedio)
@@ -1052,77 +2840,148 @@ def logout():
     flash('Has cerrado sesión correctamente', 'info')
     return redirect(url_for('login'))
 
+# Pausa de escrituras: la restauración espera a que terminen las escrituras en curso
+# y retiene las nuevas mientras cambia el archivo de la base de datos. Los trabajos
+# largos (importaciones, exportaciones, respaldos) la toman por lote o por transacción,
+# así una restauración solo espera a que termine el lote en curso.
+def preparar_base_restaurada(ruta):
+    """Lleva una base restaurada al esquema y resúmenes actuales antes de ponerla en uso.
+    
+    El respaldo puede ser de una versión anterior: las migraciones y la reconstrucción de
+    resúmenes recorren Ganancias, así que se hacen sobre el archivo temporal con su propio
+    engine y no con las escrituras en pausa. Al final se cierra su WAL para que el archivo
+    quede completo.
+    """
+    engine = create_engine(f'sqlite:///{os.path.abspath(ruta)}', poolclass=NullPool)
+    try:
+        db.metadata.create_all(engine)
+        aplicar_migraciones(engine)
+        poblar_resumenes_si_faltan(engine)
+    finally:
+        engine.dispose()
+    cerrar_wal(ruta)
+
+def restaurar_instantanea(nombre):
+    """Restaura una instantánea sin reiniciar el servidor.
+    
+    La base se reconstruye y verifica en un archivo temporal; solo el cambio de
+    archivo (rename atómico y nuevo pool de conexiones) ocurre con las escrituras en pausa.
+    """
+    respaldo = obtener_respaldo(nombre)
+    db_path = ruta_base_datos()
+    restaurado = db_path + '.restaurando'
+    
+    # Reconstruir, verificar y poner al día fuera de la pausa
+    if reconstruir_instantanea(leer_instantanea(nombre), restaurado) != respaldo['checksum']:
+        os.remove(restaurado)
+        raise RuntimeError('El respaldo está dañado (el checksum no coincide); no se restauró')
+    conexion = sqlite3.connect(restaurado)
+    try:
+        integridad = conexion.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conexion.close()
+    if integridad != 'ok':
+        os.remove(restaurado)
+        raise RuntimeError(f'El respaldo no pasó integrity_check: {integridad}')
+    try:
+        preparar_base_restaurada(restaurado)
+    except Exception:
+        os.remove(restaurado)
+        raise
+    
+    # Respaldo de la base actual antes de reemplazarla
+    crear_respaldo_automatico()
+    versiones_previas = dict(db.session.query(VersionDatos.nombre, VersionDatos.version).all())
+    db.session.remove()
+    
+    inicio = time.monotonic()
+    with puerta_escrituras.pausa(timeout=10):
+        # Con la puerta cerrada ninguna petición ni trabajo debería tener una conexión;
+        # si alguna sigue abierta, su WAL podría aplicarse sobre la base restaurada
+        try:
+            # Las lecturas que ya tenían conexión terminan; las nuevas esperan a la puerta
+            limite = time.monotonic() + 10
+            while db.engine.pool.checkedout():
+                if time.monotonic() > limite:
+                    raise RuntimeError('Hay conexiones a la base en uso; no se restauró')
+                time.sleep(0.05)
+            db.engine.dispose()
+            cerrar_wal(db_path)
+        except Exception:
+            os.remove(restaurado)
+            raise
+        os.replace(restaurado, db_path)
+        
+        # Versiones por encima de las anteriores para que ningún cliente use datos en caché
+        for nombre_version in set(versiones_previas) | {'ganancias', 'ganancias_reinicio'}:
+            version = versiones_previas.get(nombre_version, 0)
+            stmt = sqlite_insert(VersionDatos.__table__).values(nombre=nombre_version, version=version + 1)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['nombre'],
+                set_={'version': db.func.max(VersionDatos.__table__.c.version, version) + 1}
+            ))
+        db.session.commit()
+    pausa_ms = (time.monotonic() - inicio) * 1000
+    
+    canal_ganancias.reiniciar()
+    cache_usuarios.limpiar()
+    cache_referencias.limpiar()
+    cubo_ganancias.reiniciar()
+    rankings_ventas.reiniciar()
+    print(f"Base de datos restaurada desde {nombre} (escrituras en pausa {pausa_ms:.0f} ms)")
+
 # Rutas para gestión de respaldos
 @app.route('/respaldos')
 @login_required
 def respaldos():
     """Mostrar lista de respaldos disponibles"""
     try:
-        import os
-        from datetime import datetime
-        
-        backup_dir = 'backups'
-        respaldos = []
-        
-        if os.path.exists(backup_dir):
-            for filename in os.listdir(backup_dir):
-                if filename.endswith('.db'):
-                    file_path = os.path.join(backup_dir, filename)
-                    file_stats = os.stat(file_path)
-                    file_size = file_stats.st_size
-                    file_date = datetime.fromtimestamp(file_stats.st_mtime)
-                    
-                    respaldos.append({
-                        'nombre': filename,
-                        'ruta': file_path,
-                        'tamaño': file_size,
-                        'fecha': file_date,
-                        'fecha_formateada': file_date.strftime('%d/%m/%Y %H:%M:%S')
-                    })
-            
-            # Ordenar por fecha (más recientes primero)
-            respaldos.sort(key=lambda x: x['fecha'], reverse=True)
+        respaldos = listar_instantaneas()
+        for respaldo in respaldos:
+            respaldo['fecha'] = datetime.fromisoformat(respaldo['fecha'])
+            respaldo['fecha_formateada'] = respaldo['fecha'].strftime('%d/%m/%Y %H:%M:%S')
         
-        return render_template('respaldos.html', respaldos=respaldos)
+        return render_template('respaldos.html', respaldos=respaldos, espacio_total=espacio_almacen(),
+                               programacion=programador_respaldos.estado())
     except Exception as e:
         flash(f'Error al cargar respaldos: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/respaldos/programacion')
+@login_required
+def programacion_respaldos():
+    """Estado del programador de respaldos en JSON"""
+    return jsonify(programador_respaldos.estado())
+
 @app.route('/respaldos/crear')
 @login_required
 def crear_respaldo_manual():
-    """Crear respaldo manual"""
+    """Crear respaldo manual (en segundo plano)"""
     try:
-        backup_path = crear_respaldo_automatico()
-        if backup_path:
-            flash('Respaldo creado exitosamente', 'success')
-        else:
-            flash('Error al crear el respaldo', 'error')
+        trabajo_id = encolar_trabajo('crear_respaldo', trabajo_crear_respaldo)
+        return redirect(url_for('ver_trabajo', trabajo_id=trabajo_id))
     except Exception as e:
         flash(f'Error al crear respaldo: {str(e)}', 'error')
     
     return redirect(url_for('respaldos'))
 
+def trabajo_crear_respaldo(progreso):
+    """Crear un respaldo como trabajo en segundo plano"""
+    nombre = crear_respaldo_automatico(progreso)
+    if not nombre:
+        raise RuntimeError('Error al crear el respaldo')
+    return {'mensaje': f'Respaldo {nombre} creado exitosamente'}
+
 @app.route('/respaldos/restaurar/<filename>')
 @login_required
 def restaurar_respaldo(filename):
     """Restaurar desde un respaldo"""
     try:
-        import shutil
-        from flask import request
-        
-        backup_path = os.path.join('backups', filename)
-        if not os.path.exists(backup_path):
+        if not obtener_respaldo(filename) or not leer_instantanea(filename):
             flash('El respaldo no existe', 'error')
             return redirect(url_for('respaldos'))
         
-        # Crear respaldo de la base de datos actual antes de restaurar
-        crear_respaldo_automatico()
-        
-        # Restaurar el respaldo
-        db_path = 'instance/sistema_ventas.db'
-        shutil.copy2(backup_path, db_path)
-        
+        restaurar_instantanea(filename)
         flash(f'Base de datos restaurada desde {filename}', 'success')
         return redirect(url_for('dashboard'))
         
@@ -1135,14 +2994,16 @@ def restaurar_respaldo(filename):
 def descargar_respaldo(filename):
     """Descargar un respaldo"""
     try:
-        from flask import send_file
-        
-        backup_path = os.path.join('backups', filename)
-        if not os.path.exists(backup_path):
+        manifiesto = leer_instantanea(filename)
+        if not manifiesto:
             flash('El respaldo no existe', 'error')
             return redirect(url_for('respaldos'))
         
-        return send_file(backup_path, as_attachment=True, download_name=filename)
+        # La base se arma bloque a bloque mientras se envía
+        response = app.response_class(contenido_instantanea(manifiesto), mimetype='application/vnd.sqlite3')
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}.db'
+        response.headers['Content-Length'] = str(manifiesto['tamaño'])
+        return response
         
     except Exception as e:
         flash(f'Error al descargar respaldo: {str(e)}', 'error')
@@ -1153,9 +3014,7 @@ def descargar_respaldo(filename):
 def eliminar_respaldo(filename):
     """Eliminar un respaldo"""
     try:
-        backup_path = os.path.join('backups', filename)
-        if os.path.exists(backup_path):
-            os.remove(backup_path)
+        if eliminar_instantanea(filename):
             flash(f'Respaldo {filename} eliminado exitosamente', 'success')
         else:
             flash('El respaldo no existe', 'error')
@@ -1164,6 +3023,412 @@ def eliminar_respaldo(filename):
     
     return redirect(url_for('respaldos'))
 
+# Trabajos en segundo plano
+DIRECTORIO_TRABAJOS = 'trabajos'
+ejecutor_trabajos = ThreadPoolExecutor(max_workers=2, thread_name_prefix='trabajo')
+
+INTERVALO_PROGRESO = 1.0  # Segundos mínimos entre dos escrituras del avance de un trabajo
+
+def encolar_trabajo(tipo, funcion, *args):
+    """Registra un trabajo y lo ejecuta en segundo plano.
+    
+    La función recibe *args y progreso(porcentaje, mensaje) y devuelve un diccionario
+    con 'mensaje', 'errores' y/o 'archivo'.
+    """
+    trabajo = Trabajo(tipo=tipo, estado='pendiente', progreso=0, usuario_id=current_user.id)
+    db.session.add(trabajo)
+    db.session.commit()
+    ejecutor_trabajos.submit(ejecutar_trabajo, trabajo.id, funcion, args)
+    return trabajo.id
+
+def ejecutar_trabajo(trabajo_id, funcion, args):
+    """Ejecuta un trabajo y guarda su resultado.
+    
+    La puerta de escrituras se toma solo para actualizar el trabajo; la función la toma
+    por lote o por transacción (puerta_escrituras.lote), no durante todo el trabajo.
+    """
+    with app.app_context():
+        with puerta_escrituras.lote():
+            Trabajo.query.filter_by(id=trabajo_id).update({'estado': 'en_proceso'})
+            db.session.commit()
+        ultima_escritura = [0.0]
+        
+        def progreso(porcentaje, mensaje=None):
+            # El avance va a la tabla (lo ven otros procesos y sobrevive a un reinicio), como
+            # mucho una vez por INTERVALO_PROGRESO y con su propia conexión: la sesión del
+            # trabajo puede tener una transacción abierta
+            if time.monotonic() - ultima_escritura[0] < INTERVALO_PROGRESO:
+                return
+            ultima_escritura[0] = time.monotonic()
+            try:
+                with puerta_escrituras.escritura(), db.engine.begin() as conexion:
+                    conexion.execute(Trabajo.__table__.update().where(Trabajo.id == trabajo_id).values(
+                        progreso=int(porcentaje), mensaje=mensaje))
+            except Exception:
+                app.logger.warning('No se pudo guardar el avance del trabajo %s', trabajo_id, exc_info=True)
+        
+        try:
+            resultado = funcion(*args, progreso=progreso) or {}
+            actualizacion = {
+                'estado': 'completado',
+                'progreso': 100,
+                'mensaje': resultado.get('mensaje'),
+                'errores': json.dumps(resultado.get('errores') or []),
+                'archivo': resultado.get('archivo'),
+                'fecha_fin': datetime.utcnow()
+            }
+        except Exception as e:
+            app.logger.exception('Error en trabajo %s', trabajo_id)
+            actualizacion = {
+                'estado': 'error',
+                'mensaje': str(e),
+                'fecha_fin': datetime.utcnow()
+            }
+        
+        with puerta_escrituras.lote():
+            db.session.rollback()  # Descartar cualquier transacción que haya quedado abierta
+            Trabajo.query.filter_by(id=trabajo_id).update(actualizacion)
+            db.session.commit()
+
+def trabajo_a_dict(trabajo):
+    """Estado de un trabajo tal como está en la tabla"""
+    return {
+        'id': trabajo.id,
+        'tipo': trabajo.tipo,
+        'estado': trabajo.estado,
+        'progreso': trabajo.progreso or 0,
+        'mensaje': trabajo.mensaje,
+        'errores': json.loads(trabajo.errores) if trabajo.errores else [],
+        'descarga': url_for('descargar_trabajo', trabajo_id=trabajo.id) if trabajo.archivo else None,
+        'fecha_creacion': trabajo.fecha_creacion.isoformat() if trabajo.fecha_creacion else None,
+        'fecha_fin': trabajo.fecha_fin.isoformat() if trabajo.fecha_fin else None
+    }
+
+def obtener_trabajo_propio(trabajo_id):
+    """Trabajo del usuario actual; 404 si no existe o lo encoló otro usuario"""
+    return Trabajo.query.filter_by(id=trabajo_id, usuario_id=current_user.id).first_or_404()
+
+@app.route('/jobs/<int:trabajo_id>')
+@login_required
+def estado_trabajo(trabajo_id):
+    """Estado del trabajo en JSON"""
+    trabajo = obtener_trabajo_propio(trabajo_id)
+    return jsonify(trabajo_a_dict(trabajo))
+
+@app.route('/jobs/<int:trabajo_id>/ver')
+@login_required
+def ver_trabajo(trabajo_id):
+    """Página con el avance del trabajo"""
+    trabajo = obtener_trabajo_propio(trabajo_id)
+    return render_template('trabajo.html', trabajo=trabajo_a_dict(trabajo))
+
+@app.route('/jobs/<int:trabajo_id>/descargar')
+@login_required
+def descargar_trabajo(trabajo_id):
+    """Descargar el archivo generado por un trabajo"""
+    from flask import send_file
+    
+    trabajo = obtener_trabajo_propio(trabajo_id)
+    if not trabajo.archivo or not os.path.exists(trabajo.archivo):
+        flash('El archivo del trabajo ya no está disponible', 'error')
+        return redirect(url_for('ver_trabajo', trabajo_id=trabajo_id))
+    return send_file(os.path.abspath(trabajo.archivo), as_attachment=True,
+                     download_name=os.path.basename(trabajo.archivo))
+
+def limpiar_trabajos():
+    """Marca como fallidos los trabajos interrumpidos y borra archivos de más de 7 días"""
+    try:
+        Trabajo.query.filter(Trabajo.estado.in_(['pendiente', 'en_proceso'])).update({
+            'estado': 'error',
+            'mensaje': 'Interrumpido por reinicio del servidor',
+            'fecha_fin': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        
+        if os.path.exists(DIRECTORIO_TRABAJOS):
+            limite = datetime.now() - timedelta(days=7)
+            for filename in os.listdir(DIRECTORIO_TRABAJOS):
+                file_path = os.path.join(DIRECTORIO_TRABAJOS, filename)
+                if datetime.fromtimestamp(os.path.getmtime(file_path)) < limite:
+                    os.remove(file_path)
+    except Exception as e:
+        print(f"Error al limpiar trabajos: {e}")
+        db.session.rollback()
+
+# Migraciones del esquema. La versión aplicada se guarda en PRAGMA user_version.
+# Cada migración es una lista fija de sentencias SQL, sin modelos ni funciones de la
+# aplicación, así una migración no cambia cuando cambia el código. Los datos derivados
+# (día local, resúmenes y series) no son parte de las migraciones: los calcula
+# poblar_resumenes_si_faltan al iniciar.
+MIGRACIONES = [
+    (1, 'Índices para reportes, ventas e importaciones', [
+        'CREATE INDEX IF NOT EXISTS ix_ganancias_fecha ON ganancias (fecha)',
+        'CREATE INDEX IF NOT EXISTS ix_ganancias_venta_id ON ganancias (venta_id)',
+        # id en el índice: el historial de un producto (ORDER BY fecha DESC, id DESC) sale ordenado
+        'CREATE INDEX IF NOT EXISTS ix_ganancias_producto_fecha '
+        'ON ganancias (producto_id, fecha, id, cantidad_vendida, ganancia_total)',
+        'CREATE INDEX IF NOT EXISTS ix_venta_fecha_id ON venta (fecha, id)',
+        'CREATE INDEX IF NOT EXISTS ix_venta_vendedor_fecha ON venta (vendedor_id, fecha)',
+        'CREATE INDEX IF NOT EXISTS ix_venta_cliente_fecha ON venta (cliente_id, fecha)',
+        'CREATE INDEX IF NOT EXISTS ix_venta_producto_producto_id ON venta_producto (producto_id)',
+        'CREATE INDEX IF NOT EXISTS ix_producto_nombre ON producto (nombre)',
+        'CREATE INDEX IF NOT EXISTS ix_cliente_nombre ON cliente (nombre)',
+        'CREATE INDEX IF NOT EXISTS ix_stock_producto_id ON stock (producto_id)'
+    ]),
+    (2, 'Contadores de filas para el dashboard', [
+        'CREATE TABLE IF NOT EXISTS contador (nombre VARCHAR(50) NOT NULL, valor INTEGER NOT NULL, PRIMARY KEY (nombre))',
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_producto_insert AFTER INSERT ON producto '
+        "BEGIN UPDATE contador SET valor = valor + 1 WHERE nombre = 'producto'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_producto_delete AFTER DELETE ON producto '
+        "BEGIN UPDATE contador SET valor = valor - 1 WHERE nombre = 'producto'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_cliente_insert AFTER INSERT ON cliente '
+        "BEGIN UPDATE contador SET valor = valor + 1 WHERE nombre = 'cliente'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_cliente_delete AFTER DELETE ON cliente '
+        "BEGIN UPDATE contador SET valor = valor - 1 WHERE nombre = 'cliente'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_venta_insert AFTER INSERT ON venta '
+        "BEGIN UPDATE contador SET valor = valor + 1 WHERE nombre = 'venta'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_venta_delete AFTER DELETE ON venta '
+        "BEGIN UPDATE contador SET valor = valor - 1 WHERE nombre = 'venta'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_lugar_entrega_insert AFTER INSERT ON lugar_entrega '
+        "BEGIN UPDATE contador SET valor = valor + 1 WHERE nombre = 'lugar_entrega'; END",
+        'CREATE TRIGGER IF NOT EXISTS tr_contador_lugar_entrega_delete AFTER DELETE ON lugar_entrega '
+        "BEGIN UPDATE contador SET valor = valor - 1 WHERE nombre = 'lugar_entrega'; END",
+        "INSERT INTO contador (nombre, valor) SELECT 'producto', count(*) FROM producto WHERE true "
+        'ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor',
+        "INSERT INTO contador (nombre, valor) SELECT 'cliente', count(*) FROM cliente WHERE true "
+        'ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor',
+        "INSERT INTO contador (nombre, valor) SELECT 'venta', count(*) FROM venta WHERE true "
+        'ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor',
+        "INSERT INTO contador (nombre, valor) SELECT 'lugar_entrega', count(*) FROM lugar_entrega WHERE true "
+        'ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor'
+    ]),
+    (3, 'Versiones de los datos de referencia', [
+        'CREATE TRIGGER IF NOT EXISTS tr_version_cliente_insert AFTER INSERT ON cliente '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_cliente', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_cliente_update AFTER UPDATE ON cliente '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_cliente', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_cliente_delete AFTER DELETE ON cliente '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_cliente', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_lugar_entrega_insert AFTER INSERT ON lugar_entrega '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_lugar_entrega', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_lugar_entrega_update AFTER UPDATE ON lugar_entrega '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_lugar_entrega', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_lugar_entrega_delete AFTER DELETE ON lugar_entrega '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_lugar_entrega', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_usuario_insert AFTER INSERT ON usuario '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_usuario', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_usuario_update AFTER UPDATE ON usuario '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_usuario', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_usuario_delete AFTER DELETE ON usuario '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_usuario', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_producto_insert AFTER INSERT ON producto '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_producto', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_producto_update AFTER UPDATE ON producto '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_producto', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_producto_delete AFTER DELETE ON producto '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_producto', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_descuento_insert AFTER INSERT ON descuento '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_descuento', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_descuento_update AFTER UPDATE ON descuento '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_descuento', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_descuento_delete AFTER DELETE ON descuento '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_descuento', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END'
+    ]),
+    (4, 'Búsqueda de clientes y productos (FTS5)', [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS cliente_fts USING fts5(nombre, telefono, content='cliente', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        'CREATE TRIGGER IF NOT EXISTS tr_cliente_fts_insert AFTER INSERT ON cliente '
+        'BEGIN INSERT INTO cliente_fts (rowid, nombre, telefono) VALUES (new.id, new.nombre, new.telefono); END',
+        'CREATE TRIGGER IF NOT EXISTS tr_cliente_fts_delete AFTER DELETE ON cliente '
+        "BEGIN INSERT INTO cliente_fts (cliente_fts, rowid, nombre, telefono) VALUES ('delete', old.id, old.nombre, old.telefono); END",
+        'CREATE TRIGGER IF NOT EXISTS tr_cliente_fts_update AFTER UPDATE ON cliente '
+        "BEGIN INSERT INTO cliente_fts (cliente_fts, rowid, nombre, telefono) VALUES ('delete', old.id, old.nombre, old.telefono); "
+        'INSERT INTO cliente_fts (rowid, nombre, telefono) VALUES (new.id, new.nombre, new.telefono); END',
+        "INSERT INTO cliente_fts (cliente_fts) VALUES ('rebuild')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS producto_fts USING fts5(nombre, descripcion, content='producto', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        'CREATE TRIGGER IF NOT EXISTS tr_producto_fts_insert AFTER INSERT ON producto '
+        'BEGIN INSERT INTO producto_fts (rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion); END',
+        'CREATE TRIGGER IF NOT EXISTS tr_producto_fts_delete AFTER DELETE ON producto '
+        "BEGIN INSERT INTO producto_fts (producto_fts, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion); END",
+        'CREATE TRIGGER IF NOT EXISTS tr_producto_fts_update AFTER UPDATE ON producto '
+        "BEGIN INSERT INTO producto_fts (producto_fts, rowid, nombre, descripcion) VALUES ('delete', old.id, old.nombre, old.descripcion); "
+        'INSERT INTO producto_fts (rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion); END',
+        "INSERT INTO producto_fts (producto_fts) VALUES ('rebuild')"
+    ]),
+    (5, 'Día local de ventas y ganancias', [
+        'ALTER TABLE venta ADD COLUMN fecha_local DATE',
+        'ALTER TABLE ganancias ADD COLUMN fecha_local DATE',
+        'CREATE INDEX IF NOT EXISTS ix_venta_fecha_local ON venta (fecha_local)',
+        'CREATE INDEX IF NOT EXISTS ix_ganancias_fecha_local ON ganancias (fecha_local, cantidad_vendida, ganancia_total)'
+    ]),
+    (6, 'Series de ganancias por periodo', [
+        'CREATE TABLE IF NOT EXISTS ganancias_serie (granularidad VARCHAR(10) NOT NULL, dimension VARCHAR(20) NOT NULL, '
+        'clave INTEGER NOT NULL, periodo VARCHAR(13) NOT NULL, ganancia_total FLOAT NOT NULL, '
+        'cantidad_vendida INTEGER NOT NULL, ingresos FLOAT NOT NULL, registros INTEGER NOT NULL, '
+        'PRIMARY KEY (granularidad, dimension, clave, periodo))',
+        'CREATE INDEX IF NOT EXISTS ix_ganancias_serie_periodo ON ganancias_serie (granularidad, dimension, periodo)'
+    ]),
+    (7, 'Versión de las categorías', [
+        'CREATE TRIGGER IF NOT EXISTS tr_version_categoria_insert AFTER INSERT ON categoria '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_categoria', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_categoria_update AFTER UPDATE ON categoria '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_categoria', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS tr_version_categoria_delete AFTER DELETE ON categoria '
+        "BEGIN INSERT INTO version_datos (nombre, version) VALUES ('ref_categoria', 1) "
+        'ON CONFLICT(nombre) DO UPDATE SET version = version + 1; END'
+    ])
+]
+
+def recalcular_fecha_local(conexion, solo_vacias=False, tamaño_lote=5000):
+    """Calcula fecha_local de ventas y ganancias a partir de fecha, por lotes de IDs"""
+    for tabla in ['venta', 'ganancias']:
+        condicion = 'AND fecha_local IS NULL' if solo_vacias else ''
+        ultimo_id = 0
+        while True:
+            filas = conexion.exec_driver_sql(
+                f'SELECT id, fecha FROM {tabla} WHERE id > ? {condicion} ORDER BY id LIMIT ?',
+                (ultimo_id, tamaño_lote)).fetchall()
+            if not filas:
+                break
+            conexion.exec_driver_sql(f'UPDATE {tabla} SET fecha_local = ? WHERE id = ?', [
+                (fecha_local(datetime.fromisoformat(fecha)).isoformat() if fecha else None, id)
+                for id, fecha in filas
+            ])
+            ultimo_id = filas[-1][0]
+
+def reconciliar_contadores(conexion):
+    """Recalcula los contadores con COUNT(*); devuelve {tabla: (antes, ahora)} de los que no cuadraban"""
+    antes = dict(conexion.exec_driver_sql('SELECT nombre, valor FROM contador').fetchall())
+    diferencias = {}
+    for tabla in TABLAS_CONTADAS:
+        conexion.exec_driver_sql(
+            f"INSERT INTO contador (nombre, valor) SELECT '{tabla}', count(*) FROM {tabla} WHERE true "
+            'ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor')
+        ahora = conexion.exec_driver_sql('SELECT valor FROM contador WHERE nombre = ?', (tabla,)).scalar()
+        if antes.get(tabla) != ahora:
+            diferencias[tabla] = (antes.get(tabla), ahora)
+    return diferencias
+
+def version_esquema(engine=None):
+    """Versión del esquema de la base de datos actual (o de la del engine indicado)"""
+    with (engine or db.engine).connect() as conexion:
+        return conexion.exec_driver_sql('PRAGMA user_version').scalar()
+
+def aplicar_migraciones(engine=None):
+    """Aplica en orden las migraciones pendientes, cada una en una transacción"""
+    engine = engine or db.engine
+    aplicadas = 0
+    for version, descripcion, sentencias in MIGRACIONES:
+        if version <= version_esquema(engine):
+            continue
+        print(f"Aplicando migración {version}: {descripcion}")
+        with engine.begin() as conexion:
+            # BEGIN explícito: sin él pysqlite confirma cada sentencia DDL por separado y una
+            # migración que falla a medias no se podría repetir
+            conexion.exec_driver_sql('BEGIN')
+            for sql in sentencias:
+                columna = re.match(r'ALTER TABLE (\w+) ADD COLUMN (\w+)', sql)
+                if columna and columna.group(2) in [
+                        fila[1] for fila in conexion.exec_driver_sql(f'PRAGMA table_info({columna.group(1)})')]:
+                    continue  # En bases nuevas create_all ya creó la columna
+                conexion.exec_driver_sql(sql)
+            conexion.exec_driver_sql(f'PRAGMA user_version = {version}')
+        aplicadas += 1
+    return aplicadas
+
+# Consultas principales que deben resolverse con índices
+CONSULTAS_PRINCIPALES = {
+    'ventas por página': 'SELECT * FROM venta WHERE (fecha, id) < (?, ?) ORDER BY fecha DESC, id DESC LIMIT 51',
+    'ventas por vendedor': 'SELECT * FROM venta WHERE vendedor_id = ? AND fecha >= ? ORDER BY fecha DESC',
+    'ventas por cliente': 'SELECT * FROM venta WHERE cliente_id = ? AND fecha >= ? ORDER BY fecha DESC',
+    'productos de ventas': 'SELECT venta_id, count(*) FROM venta_producto WHERE venta_id IN (?, ?) GROUP BY venta_id',
+    'ganancias de un producto': 'SELECT * FROM ganancias WHERE producto_id = ? ORDER BY fecha DESC',
+    'ganancias de un producto por página': 'SELECT * FROM ganancias WHERE producto_id = ? AND cantidad_vendida > 0 AND (fecha, id) < (?, ?) ORDER BY fecha DESC, id DESC LIMIT 51',
+    'totales de un producto': 'SELECT sum(ganancia_total), sum(cantidad_vendida) FROM ganancias WHERE producto_id = ? AND cantidad_vendida > 0',
+    'ganancias de una venta': 'SELECT * FROM ganancias WHERE venta_id = ?',
+    'ganancias por rango de fechas': 'SELECT * FROM ganancias WHERE fecha >= ? AND fecha < ?',
+    'producto por nombre': 'SELECT id FROM producto WHERE nombre IN (?, ?)',
+    'cliente por nombre': 'SELECT id FROM cliente WHERE nombre IN (?, ?)',
+    'stock de productos': 'SELECT * FROM stock WHERE producto_id IN (?, ?)',
+    'ganancias del día': 'SELECT sum(ganancia_total), count(*) FROM ganancias WHERE fecha_local = ? AND cantidad_vendida > 0',
+    'ventas por rango de días': 'SELECT id FROM venta WHERE fecha_local >= ? AND fecha_local <= ?',
+    'serie de ganancias': "SELECT * FROM ganancias_serie WHERE granularidad = 'mes' AND dimension = 'vendedor' AND periodo >= ? AND periodo <= ?",
+    'serie de un producto': "SELECT * FROM ganancias_serie WHERE granularidad = 'dia' AND dimension = 'producto' AND clave = ? AND periodo >= ?",
+    'reconstrucción del resumen por producto': 'SELECT producto_id, sum(ganancia_total), sum(cantidad_vendida), sum(ganancia_unitaria), count(id) FROM ganancias WHERE cantidad_vendida > 0 GROUP BY producto_id',
+    'reconstrucción del resumen diario': 'SELECT fecha_local, sum(ganancia_total), sum(cantidad_vendida), count(id) FROM ganancias WHERE cantidad_vendida > 0 GROUP BY fecha_local'
+}
+
+# Consultas que leen a propósito toda la tabla: se aceptan aunque su plan la recorra
+RECORRIDOS_PERMITIDOS = {'reconstrucción del resumen por producto', 'reconstrucción del resumen diario'}
+
+def verificar_indices():
+    """Plan (EXPLAIN QUERY PLAN) de cada consulta principal y su problema, o None si no tiene.
+    
+    Cualquier SCAN cuenta como recorrido completo, también SCAN ... USING INDEX (recorre el
+    índice entero); solo SEARCH busca por índice. Se exceptúan las de RECORRIDOS_PERMITIDOS.
+    USE TEMP B-TREE indica que el índice no da el orden (ORDER BY, GROUP BY o DISTINCT).
+    """
+    resultados = []
+    with db.engine.connect() as conexion:
+        for nombre, sql in CONSULTAS_PRINCIPALES.items():
+            parametros = tuple(None for _ in range(sql.count('?')))
+            plan = [fila[3] for fila in conexion.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, parametros)]
+            problema = None
+            if nombre not in RECORRIDOS_PERMITIDOS and any(
+                    paso.startswith('SCAN') and paso != 'SCAN CONSTANT ROW' for paso in plan):
+                problema = 'RECORRIDO COMPLETO'
+            elif any(paso.startswith('USE TEMP B-TREE') for paso in plan):
+                problema = 'ORDEN SIN ÍNDICE'
+            resultados.append((nombre, plan, problema))
+    return resultados
+
+def reporte_almacenamiento():
+    """Valores efectivos de los PRAGMA y del pool de conexiones"""
+    reporte = {}
+    with db.engine.connect() as conexion:
+        for pragma in app.config['SQLITE_PRAGMAS']:
+            reporte[pragma] = conexion.exec_driver_sql(f'PRAGMA {pragma}').scalar()
+    reporte['pool'] = db.engine.pool.status()
+    return reporte
+
+def ruta_base_datos():
+    """Ruta del archivo SQLite en uso, tomada del engine (respeta DATABASE_URL)"""
+    return db.engine.url.database
+
+def cerrar_wal(db_path):
+    """Pasa el WAL al archivo principal y cambia al journal DELETE, lo que borra -wal y -shm.
+    
+    SQLite solo sale del modo WAL si ninguna otra conexión tiene la base abierta, así que
+    si termina bien no queda nada que se pueda aplicar sobre un archivo nuevo.
+    """
+    conexion = sqlite3.connect(db_path, timeout=1)
+    try:
+        modo = conexion.execute('PRAGMA journal_mode=DELETE').fetchone()[0]
+    except sqlite3.OperationalError as e:
+        modo = str(e)
+    finally:
+        conexion.close()
+    if modo != 'delete' or os.path.exists(db_path + '-wal'):
+        raise RuntimeError(f'No se pudo cerrar el WAL de la base ({modo}); hay otra conexión abierta')
+
 def crear_usuarios_estaticos():
     """Crear usuarios estáticos si no existen"""
     try:
@@ -1183,47 +3448,579 @@ def crear_usuarios_estaticos():
         print(f"Usuarios ya existen o error: {e}")
         db.session.rollback()
 
-def crear_respaldo_automatico():
-    """Crear respaldo automático de la base de datos"""
+# Almacén de respaldos direccionado por contenido: la base se divide en bloques de
+# páginas que se guardan una sola vez (su nombre es el hash SHA-256 del contenido)
+# y cada instantánea es un manifiesto JSON con la lista ordenada de sus bloques.
+DIRECTORIO_RESPALDOS = 'backups'
+DIRECTORIO_BLOQUES = os.path.join(DIRECTORIO_RESPALDOS, 'bloques')
+DIRECTORIO_INSTANTANEAS = os.path.join(DIRECTORIO_RESPALDOS, 'instantaneas')
+EXTENSIONES_BLOQUE = {'ninguna': '', 'gzip': '.gz', 'zstd': '.zst'}
+EXTENSIONES_RESPALDO_ANTIGUO = ('.db', '.db.gz', '.db.zst')
+CATALOGO_RESPALDOS = os.path.join(DIRECTORIO_RESPALDOS, 'catalogo.db')
+
+# Evita que la limpieza de bloques borre los de una instantánea que se está guardando
+bloqueo_almacen = threading.Lock()
+
+def abrir_respaldo(ruta):
+    """Abre un respaldo completo (formato anterior) descomprimiéndolo según su extensión"""
+    if ruta.endswith('.gz'):
+        return gzip.open(ruta, 'rb')
+    if ruta.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError('Se necesita el paquete zstandard para leer respaldos .zst')
+        return zstandard.ZstdDecompressor().stream_reader(open(ruta, 'rb'), closefd=True)
+    return open(ruta, 'rb')
+
+class LimitadorES:
+    """Limita los bytes por segundo que lee o escribe un respaldo, durmiendo lo necesario"""
+    
+    def __init__(self, bytes_por_segundo):
+        self.bytes_por_segundo = bytes_por_segundo
+        self.inicio = time.monotonic()
+        self.bytes = 0
+    
+    def demora(self, cantidad):
+        """Cuenta los bytes y devuelve los segundos que hay que esperar para no pasar el límite"""
+        if not self.bytes_por_segundo:
+            return 0
+        self.bytes += cantidad
+        return max(self.bytes / self.bytes_por_segundo - (time.monotonic() - self.inicio), 0)
+    
+    def consumir(self, cantidad):
+        adelanto = self.demora(cantidad)
+        if adelanto:
+            time.sleep(adelanto)
+
+def copiar_base_en_linea(db_path, destino, progreso=None, limitador=None):
+    """Copia la base de datos en uso con la API de respaldo de SQLite.
+    
+    Copia por lotes de páginas con una pausa entre lotes, así las ventas en curso no
+    esperan a la copia; si otra conexión escribe entre lotes, SQLite reinicia la copia y el
+    resultado sigue siendo una instantánea consistente. Con limitador, cada lote cuenta sus
+    bytes, así la copia tampoco compite con el disco de las ventas.
+    
+    La copia no retiene la puerta de escrituras: la comprueba en cada lote y, si una
+    restauración la cierra, se interrumpe y cierra su conexión, que impediría cambiar el archivo.
+    """
+    paginas = app.config['RESPALDO_PAGINAS_POR_PASO']
+    pausa = app.config['RESPALDO_PAUSA']
+    
+    pendientes = [None]
+    tamaño_pagina = 0
+    
+    def avance(estado, restantes, total):
+        if progreso and total:
+            progreso(60 * (total - restantes) / total, f'Copiando páginas: {total - restantes} de {total}')
+        espera = pausa
+        if limitador:
+            copiadas = (pendientes[0] if pendientes[0] is not None else total) - restantes
+            espera += limitador.demora(max(copiadas, 0) * tamaño_pagina)
+            pendientes[0] = restantes
+        # La espera del limitador también se corta si una restauración cierra la puerta
+        if puerta_escrituras.esperar_cierre(espera):
+            raise RuntimeError('Respaldo interrumpido por una restauración en curso')
+    
+    copia = sqlite3.connect(destino)
     try:
-        from shutil import copy2
-        import os
-        from datetime import datetime
-        
-        # Crear directorio de respaldos si no existe
-        backup_dir = 'backups'
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-        
-        # Nombre del archivo de respaldo con timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'backup_sistema_ventas_{timestamp}.db'
-        backup_path = os.path.join(backup_dir, backup_filename)
-        
-        # Copiar la base de datos actual
-        db_path = 'instance/sistema_ventas.db'
-        if os.path.exists(db_path):
-            copy2(db_path, backup_path)
-            print(f"Respaldo creado: {backup_path}")
-            return backup_path
+        with puerta_escrituras.copia():
+            origen = sqlite3.connect(db_path, timeout=app.config['SQLITE_PRAGMAS']['busy_timeout'] / 1000)
+            try:
+                tamaño_pagina = origen.execute('PRAGMA page_size').fetchone()[0]
+                origen.backup(copia, pages=paginas, progress=avance)
+            finally:
+                origen.close()
+        resultado = copia.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        copia.close()
+    if resultado != 'ok':
+        raise RuntimeError(f'El respaldo no pasó quick_check: {resultado}')
+
+def ruta_bloque(hash_bloque):
+    """Ruta del bloque guardado (con cualquier compresión) o None si no existe"""
+    base = os.path.join(DIRECTORIO_BLOQUES, hash_bloque[:2], hash_bloque)
+    for extension in EXTENSIONES_BLOQUE.values():
+        if os.path.exists(base + extension):
+            return base + extension
+    return None
+
+def guardar_bloque(hash_bloque, datos):
+    """Guarda un bloque nuevo comprimido; devuelve los bytes escritos en disco"""
+    compresion = app.config['RESPALDO_COMPRESION']
+    if compresion == 'zstd' and zstandard is None:
+        compresion = 'gzip'
+    if compresion == 'gzip':
+        datos = gzip.compress(datos, compresslevel=6)
+    elif compresion == 'zstd':
+        datos = zstandard.ZstdCompressor(level=10).compress(datos)
+    
+    ruta = os.path.join(DIRECTORIO_BLOQUES, hash_bloque[:2], hash_bloque) + EXTENSIONES_BLOQUE.get(compresion, '')
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + '.parcial', 'wb') as archivo:
+        archivo.write(datos)
+    os.replace(ruta + '.parcial', ruta)
+    return len(datos)
+
+def leer_bloque(hash_bloque):
+    """Contenido de un bloque, comprobando que coincide con su hash"""
+    ruta = ruta_bloque(hash_bloque)
+    if not ruta:
+        raise RuntimeError(f'Falta el bloque {hash_bloque} en el almacén de respaldos')
+    with open(ruta, 'rb') as archivo:
+        datos = archivo.read()
+    if ruta.endswith('.gz'):
+        datos = gzip.decompress(datos)
+    elif ruta.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError('Se necesita el paquete zstandard para leer bloques .zst')
+        datos = zstandard.ZstdDecompressor().decompress(datos)
+    if hashlib.sha256(datos).hexdigest() != hash_bloque:
+        raise RuntimeError(f'El bloque {hash_bloque} está dañado')
+    return datos
+
+def describir_base(ruta_db):
+    """Tamaño de página, versión del esquema y filas por tabla de un archivo de base de datos"""
+    conexion = sqlite3.connect(ruta_db)
+    try:
+        tamaño_pagina = conexion.execute('PRAGMA page_size').fetchone()[0]
+        version = conexion.execute('PRAGMA user_version').fetchone()[0]
+        tablas = [fila[0] for fila in conexion.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        conteos = {tabla: conexion.execute(f'SELECT count(*) FROM "{tabla}"').fetchone()[0] for tabla in tablas}
+    finally:
+        conexion.close()
+    return tamaño_pagina, version, conteos
+
+def crear_instantanea(ruta_db, nombre, fecha, progreso=None, limitador=None):
+    """Guarda en el almacén los bloques nuevos de ruta_db, escribe su manifiesto y lo cataloga"""
+    tamaño_pagina, version, conteos = describir_base(ruta_db)
+    tamaño_bloque = tamaño_pagina * app.config['RESPALDO_PAGINAS_POR_BLOQUE']
+    tamaño = os.path.getsize(ruta_db)
+    
+    bloques = []
+    bloques_nuevos = 0
+    bytes_nuevos = 0
+    suma = hashlib.sha256()
+    with bloqueo_almacen:
+        with open(ruta_db, 'rb') as archivo:
+            while True:
+                datos = archivo.read(tamaño_bloque)
+                if not datos:
+                    break
+                if limitador:
+                    limitador.consumir(len(datos))
+                suma.update(datos)
+                hash_bloque = hashlib.sha256(datos).hexdigest()
+                if not ruta_bloque(hash_bloque):
+                    bytes_nuevos += guardar_bloque(hash_bloque, datos)
+                    bloques_nuevos += 1
+                bloques.append(hash_bloque)
+                if progreso and tamaño:
+                    progreso(60 + 40 * min(archivo.tell(), tamaño) / tamaño, 'Guardando bloques modificados...')
+        
+        manifiesto = {
+            'nombre': nombre,
+            'fecha': fecha.isoformat(),
+            'tamaño': tamaño,
+            'checksum': suma.hexdigest(),
+            'version_esquema': version,
+            'conteos': conteos,
+            'tamaño_pagina': tamaño_pagina,
+            'tamaño_bloque': tamaño_bloque,
+            'bloques': bloques,
+            'bloques_nuevos': bloques_nuevos,
+            'bytes_nuevos': bytes_nuevos
+        }
+        os.makedirs(DIRECTORIO_INSTANTANEAS, exist_ok=True)
+        ruta_manifiesto = os.path.join(DIRECTORIO_INSTANTANEAS, nombre + '.json')
+        with open(ruta_manifiesto + '.parcial', 'w', encoding='utf-8') as archivo:
+            json.dump(manifiesto, archivo)
+        os.replace(ruta_manifiesto + '.parcial', ruta_manifiesto)
+        registrar_en_catalogo(manifiesto)
+    return manifiesto
+
+def leer_instantanea(nombre):
+    """Manifiesto de una instantánea o None si no existe"""
+    if os.path.basename(nombre) != nombre:
+        return None
+    ruta = os.path.join(DIRECTORIO_INSTANTANEAS, nombre + '.json')
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+def conectar_catalogo():
+    """Conexión al catálogo de respaldos (una fila por instantánea, sin recorrer el directorio)"""
+    os.makedirs(DIRECTORIO_RESPALDOS, exist_ok=True)
+    conexion = sqlite3.connect(CATALOGO_RESPALDOS, timeout=app.config['SQLITE_PRAGMAS']['busy_timeout'] / 1000)
+    conexion.row_factory = sqlite3.Row
+    conexion.execute("""
+        CREATE TABLE IF NOT EXISTS respaldo (
+            nombre TEXT PRIMARY KEY,
+            fecha TEXT NOT NULL,
+            tamaño INTEGER NOT NULL,
+            bytes_nuevos INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            version_esquema INTEGER NOT NULL,
+            conteos TEXT NOT NULL
+        )""")
+    conexion.execute('CREATE INDEX IF NOT EXISTS ix_respaldo_fecha ON respaldo (fecha)')
+    return conexion
+
+def registrar_en_catalogo(manifiesto):
+    """Agrega (o actualiza) una instantánea en el catálogo"""
+    conexion = conectar_catalogo()
+    try:
+        with conexion:
+            conexion.execute(
+                'INSERT OR REPLACE INTO respaldo VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (manifiesto['nombre'], manifiesto['fecha'], manifiesto['tamaño'], manifiesto['bytes_nuevos'],
+                 manifiesto['checksum'], manifiesto['version_esquema'], json.dumps(manifiesto['conteos'])))
+    finally:
+        conexion.close()
+
+def fila_a_respaldo(fila):
+    """Entrada del catálogo como diccionario"""
+    respaldo = dict(fila)
+    respaldo['conteos'] = json.loads(respaldo['conteos'])
+    return respaldo
+
+def obtener_respaldo(nombre):
+    """Entrada del catálogo de una instantánea o None si no está catalogada"""
+    conexion = conectar_catalogo()
+    try:
+        fila = conexion.execute('SELECT * FROM respaldo WHERE nombre = ?', (nombre,)).fetchone()
+    finally:
+        conexion.close()
+    return fila_a_respaldo(fila) if fila else None
+
+def listar_instantaneas(desde=None):
+    """Entradas del catálogo (opcionalmente desde una fecha), de la más reciente a la más antigua"""
+    conexion = conectar_catalogo()
+    try:
+        if desde:
+            filas = conexion.execute('SELECT * FROM respaldo WHERE fecha > ? ORDER BY fecha DESC', (desde.isoformat(),))
         else:
+            filas = conexion.execute('SELECT * FROM respaldo ORDER BY fecha DESC')
+        return [fila_a_respaldo(fila) for fila in filas]
+    finally:
+        conexion.close()
+
+def reconstruir_catalogo():
+    """Vuelve a llenar el catálogo a partir de los manifiestos del almacén"""
+    if not os.path.exists(DIRECTORIO_INSTANTANEAS):
+        return 0
+    registrados = 0
+    for filename in os.listdir(DIRECTORIO_INSTANTANEAS):
+        if not filename.endswith('.json'):
+            continue
+        manifiesto = leer_instantanea(filename[:-len('.json')])
+        if 'checksum' not in manifiesto:
+            # Manifiesto anterior al catálogo: se calculan los datos desde sus bloques
+            temporal = os.path.join(DIRECTORIO_RESPALDOS, manifiesto['nombre'] + '.catalogando')
+            try:
+                manifiesto['checksum'] = reconstruir_instantanea(manifiesto, temporal)
+                _, manifiesto['version_esquema'], manifiesto['conteos'] = describir_base(temporal)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+        registrar_en_catalogo(manifiesto)
+        registrados += 1
+    return registrados
+
+def contenido_instantanea(manifiesto):
+    """Genera el contenido de la base de datos de una instantánea, bloque a bloque"""
+    for hash_bloque in manifiesto['bloques']:
+        yield leer_bloque(hash_bloque)
+
+def reconstruir_instantanea(manifiesto, destino):
+    """Reconstruye el archivo de base de datos de una instantánea en destino y devuelve su SHA-256"""
+    suma = hashlib.sha256()
+    try:
+        with open(destino, 'wb') as archivo:
+            for datos in contenido_instantanea(manifiesto):
+                suma.update(datos)
+                archivo.write(datos)
+    except Exception:
+        os.remove(destino)
+        raise
+    return suma.hexdigest()
+
+def eliminar_instantanea(nombre):
+    """Borra el manifiesto y los bloques que ninguna otra instantánea usa"""
+    if not leer_instantanea(nombre):
+        return False
+    eliminar_instantaneas([nombre])
+    return True
+
+def eliminar_instantaneas(nombres):
+    """Borra varias instantáneas y limpia los bloques una sola vez al final"""
+    with bloqueo_almacen:
+        conexion = conectar_catalogo()
+        try:
+            with conexion:
+                conexion.executemany('DELETE FROM respaldo WHERE nombre = ?', [(nombre,) for nombre in nombres])
+        finally:
+            conexion.close()
+        for nombre in nombres:
+            ruta = os.path.join(DIRECTORIO_INSTANTANEAS, nombre + '.json')
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        recolectar_bloques()
+
+def recolectar_bloques():
+    """Borra los bloques sin referencias (llamar con bloqueo_almacen tomado)"""
+    en_uso = set()
+    for respaldo in listar_instantaneas():
+        en_uso.update(leer_instantanea(respaldo['nombre'])['bloques'])
+    if not os.path.exists(DIRECTORIO_BLOQUES):
+        return
+    for carpeta in os.listdir(DIRECTORIO_BLOQUES):
+        ruta_carpeta = os.path.join(DIRECTORIO_BLOQUES, carpeta)
+        for filename in os.listdir(ruta_carpeta):
+            if filename.split('.')[0] not in en_uso:
+                os.remove(os.path.join(ruta_carpeta, filename))
+
+def espacio_almacen():
+    """Bytes ocupados por los bloques del almacén"""
+    total = 0
+    if os.path.exists(DIRECTORIO_BLOQUES):
+        for carpeta in os.listdir(DIRECTORIO_BLOQUES):
+            ruta_carpeta = os.path.join(DIRECTORIO_BLOQUES, carpeta)
+            total += sum(os.path.getsize(os.path.join(ruta_carpeta, f)) for f in os.listdir(ruta_carpeta))
+    return total
+
+def fecha_respaldo_antiguo(filename, ruta):
+    """Fecha de un respaldo antiguo según su nombre (backup_sistema_ventas_AAAAMMDD_HHMMSS);
+    si el nombre no la trae, la de modificación del archivo"""
+    coincidencia = re.search(r'(\d{8}_\d{6})', filename)
+    if coincidencia:
+        try:
+            return datetime.strptime(coincidencia.group(1), '%Y%m%d_%H%M%S')
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(ruta))
+
+def importar_respaldos_antiguos():
+    """Pasa al almacén los respaldos completos de versiones anteriores (sin borrarlos)"""
+    for directorio in ['.', DIRECTORIO_RESPALDOS]:
+        if not os.path.exists(directorio):
+            continue
+        for filename in sorted(os.listdir(directorio)):
+            if not (filename.startswith('backup_sistema_ventas_') and filename.endswith(EXTENSIONES_RESPALDO_ANTIGUO)):
+                continue
+            nombre = filename.split('.')[0]
+            if leer_instantanea(nombre):
+                continue
+            ruta = os.path.join(directorio, filename)
+            temporal = os.path.join(DIRECTORIO_RESPALDOS, nombre + '.importando')
+            try:
+                with abrir_respaldo(ruta) as origen, open(temporal, 'wb') as destino:
+                    shutil.copyfileobj(origen, destino, 1024 * 1024)
+                crear_instantanea(temporal, nombre, fecha_respaldo_antiguo(filename, ruta))
+                print(f"Respaldo importado al almacén: {ruta}")
+            except Exception as e:
+                print(f"No se pudo importar el respaldo {ruta}: {e}")
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+
+def crear_respaldo_automatico(progreso=None, limitador=None):
+    """Crear respaldo automático de la base de datos (instantánea en el almacén)"""
+    try:
+        db_path = ruta_base_datos()
+        if not os.path.exists(db_path):
             print("No se encontró la base de datos para respaldar")
             return None
-    except Exception as e:
-        print(f"Error al crear respaldo: {e}")
+        
+        os.makedirs(DIRECTORIO_RESPALDOS, exist_ok=True)
+        fecha = datetime.now()
+        nombre = f"sistema_ventas_{fecha.strftime('%Y%m%d_%H%M%S')}"
+        base_nombre, sufijo = nombre, 1
+        while leer_instantanea(nombre):
+            sufijo += 1
+            nombre = f"{base_nombre}_{sufijo}"
+        
+        # Copia consistente en un archivo temporal; del almacén solo se escriben los bloques que cambiaron
+        temporal = os.path.join(DIRECTORIO_RESPALDOS, nombre + '.parcial')
+        try:
+            copiar_base_en_linea(db_path, temporal, progreso, limitador)
+            manifiesto = crear_instantanea(temporal, nombre, fecha, progreso, limitador)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        
+        print(f"Respaldo creado: {nombre} ({manifiesto['bloques_nuevos']} de {len(manifiesto['bloques'])} bloques nuevos)")
+        return nombre
+    except Exception:
+        app.logger.exception('Error al crear respaldo')
         return None
 
+def respaldos_a_conservar(respaldos):
+    """Política abuelo-padre-hijo: el más reciente de cada una de las últimas N horas, días y semanas"""
+    conservar = set()
+    periodos = [
+        (app.config['RESPALDO_RETENER_HORARIOS'], lambda fecha: fecha.strftime('%Y%m%d%H')),
+        (app.config['RESPALDO_RETENER_DIARIOS'], lambda fecha: fecha.date()),
+        (app.config['RESPALDO_RETENER_SEMANALES'], lambda fecha: fecha.isocalendar()[:2])
+    ]
+    for cantidad, periodo in periodos:
+        vistos = set()
+        for respaldo in respaldos:  # Del más reciente al más antiguo
+            clave = periodo(datetime.fromisoformat(respaldo['fecha']))
+            if clave in vistos:
+                continue
+            if len(vistos) >= cantidad:
+                break
+            vistos.add(clave)
+            conservar.add(respaldo['nombre'])
+    if respaldos:
+        conservar.add(respaldos[0]['nombre'])
+    return conservar
+
+def aplicar_retencion():
+    """Elimina los respaldos que la política de retención ya no conserva"""
+    respaldos = listar_instantaneas()
+    conservar = respaldos_a_conservar(respaldos)
+    sobrantes = [respaldo['nombre'] for respaldo in respaldos if respaldo['nombre'] not in conservar]
+    if sobrantes:
+        eliminar_instantaneas(sobrantes)
+        print(f"Retención de respaldos: {len(sobrantes)} eliminados, {len(conservar)} conservados")
+    return sobrantes
+
+class ProgramadorRespaldos:
+    """Hilo que toma respaldos cada cierto intervalo y aplica la política de retención"""
+    
+    def __init__(self):
+        self.hilo = None
+        self.bloqueo = threading.Lock()
+        self.detener_evento = threading.Event()
+        self.ultima_ejecucion = None
+        self.proxima_ejecucion = None
+        self.ultimo_resultado = None
+    
+    def iniciar(self):
+        """Arranca el hilo una sola vez por proceso (se puede llamar en cada petición)"""
+        if self.hilo or not app.config['RESPALDO_PROGRAMADO']:
+            return
+        with self.bloqueo:
+            if self.hilo:
+                return
+            # Continuar la cadencia desde el último respaldo que haya en el catálogo
+            recientes = listar_instantaneas()
+            if recientes:
+                self.ultima_ejecucion = datetime.fromisoformat(recientes[0]['fecha'])
+            self.programar_siguiente()
+            self.hilo = threading.Thread(target=self.ciclo, name='respaldos', daemon=True)
+            self.hilo.start()
+    
+    def detener(self):
+        self.detener_evento.set()
+    
+    def programar_siguiente(self):
+        intervalo = timedelta(minutes=app.config['RESPALDO_INTERVALO_MINUTOS'])
+        base = self.ultima_ejecucion or datetime.now()
+        self.proxima_ejecucion = max(base + intervalo, datetime.now())
+    
+    def ciclo(self):
+        while not self.detener_evento.wait(max((self.proxima_ejecucion - datetime.now()).total_seconds(), 0)):
+            with app.app_context():
+                self.ejecutar()  # La copia se interrumpe si una restauración cierra la puerta (ver copiar_base_en_linea)
+    
+    def ejecutar(self):
+        self.ultima_ejecucion = datetime.now()
+        try:
+            limitador = LimitadorES(app.config['RESPALDO_LIMITE_BYTES_SEGUNDO'])
+            nombre = crear_respaldo_automatico(limitador=limitador)
+            eliminados = aplicar_retencion() if nombre else []
+            self.ultimo_resultado = f'Respaldo {nombre}, {len(eliminados)} eliminados' if nombre else 'Error al crear el respaldo'
+        except Exception as e:
+            app.logger.exception('Error en respaldo programado')
+            self.ultimo_resultado = f'Error: {e}'
+        finally:
+            self.programar_siguiente()
+    
+    def estado(self):
+        return {
+            'activo': bool(self.hilo and self.hilo.is_alive()),
+            'intervalo_minutos': app.config['RESPALDO_INTERVALO_MINUTOS'],
+            'ultima_ejecucion': self.ultima_ejecucion.isoformat() if self.ultima_ejecucion else None,
+            'proxima_ejecucion': self.proxima_ejecucion.isoformat() if self.proxima_ejecucion else None,
+            'ultimo_resultado': self.ultimo_resultado
+        }
+
+programador_respaldos = ProgramadorRespaldos()
+
+@app.before_request
+def iniciar_programador_respaldos():
+    """El programador arranca con la primera petición del proceso que las atiende, sea con
+    app.run, flask run o un servidor WSGI; el proceso que solo recarga el código no lo inicia"""
+    programador_respaldos.iniciar()
+
+@app.cli.command('reconstruir-resumenes')
+def reconstruir_resumenes_comando():
+    """Recalcular las tablas de resumen de ganancias"""
+    reconstruir_resumenes_ganancias()
+    print("Resúmenes de ganancias reconstruidos")
+
+@app.cli.command('migrar')
+def migrar_comando():
+    """Actualizar el esquema de la base de datos"""
+    db.create_all()
+    aplicadas = aplicar_migraciones()
+    print(f"Migraciones aplicadas: {aplicadas}. Versión del esquema: {version_esquema()}")
+
+@app.cli.command('reconciliar-contadores')
+def reconciliar_contadores_comando():
+    """Corregir los contadores de filas del dashboard"""
+    with db.engine.begin() as conexion:
+        diferencias = reconciliar_contadores(conexion)
+    for tabla, (antes, ahora) in diferencias.items():
+        print(f"{tabla}: {antes} -> {ahora}")
+    print(f"Contadores reconciliados ({len(diferencias)} corregidos)")
+
+@app.cli.command('recalcular-fecha-local')
+def recalcular_fecha_local_comando():
+    """Recalcular el día local de ventas y ganancias (tras cambiar ZONA_HORARIA)"""
+    with db.engine.begin() as conexion:
+        recalcular_fecha_local(conexion)
+    reconstruir_resumenes_ganancias()
+    print(f"Día local recalculado con la zona horaria {app.config['ZONA_HORARIA']}")
+
+@app.cli.command('verificar-indices')
+def verificar_indices_comando():
+    """Comprobar con EXPLAIN que las consultas principales usan índices"""
+    resultados = verificar_indices()
+    for nombre, plan, problema in resultados:
+        estado = problema or ('RECORRIDO PERMITIDO' if nombre in RECORRIDOS_PERMITIDOS else 'OK')
+        print(f"[{estado}] {nombre}")
+        for paso in plan:
+            print(f"    {paso}")
+    if any(problema for _, _, problema in resultados):
+        raise SystemExit(1)
+
 def es_venta_del_dia_actual(fecha_venta):
     """Verifica si una venta es del día actual"""
-    from datetime import date
-    hoy = date.today()
-    return fecha_venta.date() == hoy
+    return fecha_local(fecha_venta) == hoy_local()
+
+def poblar_resumenes_si_faltan(engine=None):
+    """Calcula los datos derivados que faltan en bases o respaldos anteriores a ellos: el
+    día local de ventas y ganancias, y los resúmenes y series si hay ganancias sin resumir"""
+    with (engine or db.engine).begin() as conexion:
+        if any(conexion.exec_driver_sql(f'SELECT 1 FROM {tabla} WHERE fecha_local IS NULL LIMIT 1').first()
+               for tabla in ['venta', 'ganancias']):
+            print("Calculando el día local de ventas y ganancias...")
+            recalcular_fecha_local(conexion, solo_vacias=True)
+        if conexion.execute(db.select(Ganancias.id).limit(1)).first() and (
+                not conexion.execute(db.select(GananciasPorProducto.producto_id).limit(1)).first()
+                or not conexion.execute(db.select(GananciasSerie.periodo).limit(1)).first()):
+            print("Reconstruyendo resúmenes de ganancias...")
+            reconstruir_resumenes_ganancias(conexion)
 
 def cargar_datos_existentes():
     """Cargar datos existentes o crear estructura inicial"""
     try:
         # Verificar si la base de datos existe
-        db_path = 'instance/sistema_ventas.db'
+        db_path = ruta_base_datos()
         if os.path.exists(db_path):
             print("Cargando base de datos existente...")
             # Solo crear las tablas si no existen
@@ -1231,14 +4028,32 @@ def cargar_datos_existentes():
             print("Base de datos cargada exitosamente")
         else:
             print("Creando nueva base de datos...")
-            # Crear directorio instance si no existe
-            os.makedirs('instance', exist_ok=True)
+            # Crear el directorio de la base si no existe
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
             db.create_all()
             print("Base de datos creada exitosamente")
         
+        # Llevar el esquema a la última versión (índices, columnas nuevas...)
+        aplicar_migraciones()
+        
+        reporte = reporte_almacenamiento()
+        print("Almacenamiento SQLite: " + ', '.join(f"{clave}={valor}" for clave, valor in reporte.items()))
+        
         # Crear usuarios estáticos solo si no existen
         crear_usuarios_estaticos()
         
+        # Trabajos que quedaron a medias en la ejecución anterior
+        limpiar_trabajos()
+        
+        # Poblar los resúmenes de ganancias en bases de datos anteriores a ellos
+        poblar_resumenes_si_faltan()
+        
+        # Catálogo de respaldos (se rehace desde los manifiestos si no existe) y, la
+        # primera vez, importación de los respaldos completos de versiones anteriores
+        if not os.path.exists(CATALOGO_RESPALDOS):
+            reconstruir_catalogo()
+            importar_respaldos_antiguos()
+        
         # Crear respaldo inicial solo si no hay respaldos recientes
         crear_respaldo_si_es_necesario()
         
@@ -1248,24 +4063,8 @@ def cargar_datos_existentes():
 def crear_respaldo_si_es_necesario():
     """Crear respaldo solo si es necesario (no hay respaldos recientes)"""
     try:
-        import os
-        from datetime import datetime, timedelta
-        
-        backup_dir = 'backups'
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-            # Si no existe el directorio, crear el primer respaldo
-            crear_respaldo_automatico()
-            return
-        
         # Verificar si hay respaldos recientes (últimas 24 horas)
-        respaldos_recientes = []
-        for filename in os.listdir(backup_dir):
-            if filename.endswith('.db'):
-                file_path = os.path.join(backup_dir, filename)
-                file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                if file_time > datetime.now() - timedelta(hours=24):
-                    respaldos_recientes.append(file_time)
+        respaldos_recientes = listar_instantaneas(desde=datetime.now() - timedelta(hours=24))
         
         # Si no hay respaldos recientes, crear uno
         if not respaldos_recientes:
@@ -1282,5 +4081,5 @@ def crear_respaldo_si_es_necesario():
 if __name__ == '__main__':
     with app.app_context():
         cargar_datos_existentes()
-        
+    
     app.run(debug=True)
@@ -0,0 +1,114 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from openpyxl import Workbook
+
+# Base de datos de pruebas en un directorio temporal y sin respaldos programados;
+# se configura antes de importar la aplicación porque el engine se crea al importarla
+DIRECTORIO_PRUEBAS = tempfile.mkdtemp(prefix='turron_pruebas_')
+RUTA_DB = os.path.join(DIRECTORIO_PRUEBAS, 'sistema_ventas.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + RUTA_DB
+os.environ['RESPALDO_PROGRAMADO'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacion  # noqa: E402
+
+
+@pytest.fixture
+def base():
+    """Base de datos nueva con el esquema y las migraciones actuales, dentro de un app context"""
+    with aplicacion.app.app_context():
+        aplicacion.db.engine.dispose()
+        for sufijo in ['', '-wal', '-shm']:
+            if os.path.exists(RUTA_DB + sufijo):
+                os.remove(RUTA_DB + sufijo)
+        aplicacion.db.create_all()
+        aplicacion.aplicar_migraciones()
+        for cache in [aplicacion.cache_usuarios, aplicacion.cache_referencias]:
+            cache.limpiar()
+        for cache in [aplicacion.cubo_ganancias, aplicacion.rankings_ventas, aplicacion.canal_ganancias]:
+            cache.reiniciar()
+        yield aplicacion
+        aplicacion.db.session.remove()
+
+
+@pytest.fixture
+def almacen(base, tmp_path, monkeypatch):
+    """Almacén de respaldos vacío en un directorio temporal"""
+    directorio = str(tmp_path / 'backups')
+    monkeypatch.setattr(base, 'DIRECTORIO_RESPALDOS', directorio)
+    monkeypatch.setattr(base, 'DIRECTORIO_BLOQUES', os.path.join(directorio, 'bloques'))
+    monkeypatch.setattr(base, 'DIRECTORIO_INSTANTANEAS', os.path.join(directorio, 'instantaneas'))
+    monkeypatch.setattr(base, 'CATALOGO_RESPALDOS', os.path.join(directorio, 'catalogo.db'))
+    return directorio
+
+
+@pytest.fixture
+def datos(base):
+    """Un vendedor, un cliente, un lugar de entrega y dos productos con stock"""
+    db = base.db
+    vendedor = base.Usuario(username='vendedor', email='vendedor@example.com')
+    vendedor.set_password('123456')
+    categoria = base.Categoria(nombre='Turrones')
+    cliente = base.Cliente(nombre='Ana', telefono='')
+    lugar = base.LugarEntrega(nombre='Tienda', direccion='', telefono='', tipo='tienda')
+    db.session.add_all([vendedor, categoria, cliente, lugar])
+    db.session.flush()
+    productos = []
+    for nombre, precio, precio_compra, stock in [('Turrón de Doña Pepa', 30.0, 18.0, 10), ('Alfajor', 5.0, 2.0, 3)]:
+        producto = base.Producto(nombre=nombre, descripcion='', precio=precio, precio_compra=precio_compra,
+                                 categoria_id=categoria.id)
+        db.session.add(producto)
+        db.session.flush()
+        db.session.add(base.Stock(producto_id=producto.id, cantidad_disponible=stock))
+        productos.append(producto.id)
+    db.session.commit()
+    return {
+        'vendedor_id': vendedor.id,
+        'cliente_id': cliente.id,
+        'lugar_entrega_id': lugar.id,
+        'categoria_id': categoria.id,
+        'productos': productos
+    }
+
+
+@pytest.fixture
+def cliente_http(base, datos):
+    """Cliente de pruebas con la sesión del vendedor iniciada"""
+    cliente = base.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['_user_id'] = str(datos['vendedor_id'])
+        sesion['_fresh'] = True
+    return cliente
+
+
+@pytest.fixture
+def vender(cliente_http, datos):
+    """Registra una venta por el formulario; recibe {producto_id: cantidad}"""
+    def vender(carrito):
+        formulario = {
+            'cliente_id': datos['cliente_id'],
+            'lugar_entrega_id': datos['lugar_entrega_id'],
+            'vendedor_id': datos['vendedor_id'],
+            'estado': 'abonado'
+        }
+        formulario.update({f'producto_{producto_id}': cantidad for producto_id, cantidad in carrito.items()})
+        return cliente_http.post('/ventas/nueva', data=formulario)
+    return vender
+
+
+@pytest.fixture
+def importar(base, tmp_path):
+    """Importa ventas desde un Excel con las filas dadas; devuelve (importadas, errores)"""
+    def importar(filas):
+        libro = Workbook()
+        hoja = libro.active
+        hoja.append(['Fecha', 'Cliente', 'Producto', 'Cantidad', 'Precio', 'Vendedor'])
+        for fila in filas:
+            hoja.append(fila)
+        ruta = tmp_path / 'ventas.xlsx'
+        libro.save(ruta)
+        return base.importar_ventas_desde_excel(str(ruta))
+    return importar
@@ -0,0 +1,79 @@
+import hashlib
+import sqlite3
+from datetime import datetime
+
+
+def crear_base(ruta, filas=400):
+    """Base de unos cientos de KiB: cada fila ocupa casi una página"""
+    conexion = sqlite3.connect(ruta)
+    conexion.execute('CREATE TABLE dato (id INTEGER PRIMARY KEY, contenido BLOB)')
+    conexion.executemany('INSERT INTO dato VALUES (?, randomblob(3000))', [(i,) for i in range(filas)])
+    conexion.commit()
+    conexion.close()
+
+
+def bloques_del_archivo(ruta, tamaño_bloque):
+    with open(ruta, 'rb') as archivo:
+        contenido = archivo.read()
+    return [hashlib.sha256(contenido[i:i + tamaño_bloque]).hexdigest() for i in range(0, len(contenido), tamaño_bloque)]
+
+
+def test_segundo_respaldo_solo_guarda_los_bloques_modificados(base, almacen, tmp_path):
+    ruta = str(tmp_path / 'datos.db')
+    crear_base(ruta)
+    primero = base.crear_instantanea(ruta, 'primero', datetime(2025, 1, 1))
+    assert primero['bloques_nuevos'] == len(set(primero['bloques']))
+
+    # Cambia una fila del final: solo su página y la cabecera (contador de cambios)
+    conexion = sqlite3.connect(ruta)
+    conexion.execute('UPDATE dato SET contenido = randomblob(3000) WHERE id = 390')
+    conexion.commit()
+    conexion.close()
+    segundo = base.crear_instantanea(ruta, 'segundo', datetime(2025, 1, 2))
+
+    cambiados = [i for i, (a, b) in enumerate(zip(primero['bloques'], segundo['bloques'])) if a != b]
+    assert segundo['bloques'] == bloques_del_archivo(ruta, segundo['tamaño_bloque'])
+    assert 0 < len(cambiados) <= 2 < len(segundo['bloques'])
+    assert segundo['bloques_nuevos'] == len(cambiados)
+
+
+def test_instantanea_se_reconstruye_desde_su_manifiesto(base, almacen, tmp_path):
+    ruta = str(tmp_path / 'datos.db')
+    crear_base(ruta)
+    manifiesto = base.crear_instantanea(ruta, 'copia', datetime(2025, 1, 1))
+    destino = str(tmp_path / 'reconstruida.db')
+
+    checksum = base.reconstruir_instantanea(base.leer_instantanea('copia'), destino)
+
+    assert checksum == manifiesto['checksum'] == base.obtener_respaldo('copia')['checksum']
+    with open(ruta, 'rb') as original, open(destino, 'rb') as reconstruida:
+        assert original.read() == reconstruida.read()
+    conexion = sqlite3.connect(destino)
+    assert conexion.execute('SELECT count(*) FROM dato').fetchone()[0] == 400
+    conexion.close()
+
+
+def test_eliminar_instantanea_conserva_los_bloques_compartidos(base, almacen, tmp_path):
+    ruta = str(tmp_path / 'datos.db')
+    crear_base(ruta)
+    primero = base.crear_instantanea(ruta, 'primero', datetime(2025, 1, 1))
+    conexion = sqlite3.connect(ruta)
+    conexion.execute('UPDATE dato SET contenido = randomblob(3000) WHERE id = 5')
+    conexion.commit()
+    conexion.close()
+    segundo = base.crear_instantanea(ruta, 'segundo', datetime(2025, 1, 2))
+    solo_del_primero = set(primero['bloques']) - set(segundo['bloques'])
+    assert solo_del_primero
+
+    assert base.eliminar_instantanea('primero')
+
+    assert all(base.ruta_bloque(hash_bloque) for hash_bloque in segundo['bloques'])
+    assert not any(base.ruta_bloque(hash_bloque) for hash_bloque in solo_del_primero)
+    assert [respaldo['nombre'] for respaldo in base.listar_instantaneas()] == ['segundo']
+    checksum = base.reconstruir_instantanea(segundo, str(tmp_path / 'reconstruida.db'))
+    assert checksum == segundo['checksum']
+
+    # La limpieza no toca nada mientras todos los bloques tengan dueño
+    with base.bloqueo_almacen:
+        base.recolectar_bloques()
+    assert all(base.ruta_bloque(hash_bloque) for hash_bloque in segundo['bloques'])
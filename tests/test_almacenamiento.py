@@ -0,0 +1,33 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+
+def test_pragmas_en_las_conexiones_de_la_aplicacion(base):
+    with base.db.engine.connect() as conexion:
+        assert conexion.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conexion.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+
+
+def test_pragmas_no_se_aplican_a_otros_engines(base, tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "otra.db"}', poolclass=NullPool)
+    try:
+        with engine.connect() as conexion:
+            assert conexion.exec_driver_sql('PRAGMA journal_mode').scalar() == 'delete'
+    finally:
+        engine.dispose()
+
+
+@pytest.mark.parametrize('pragma, valor', [
+    ('journal_mode', 'WAL; DROP TABLE venta'),
+    ('cache_size', '1; DROP TABLE venta'),
+    ('user_version', 1)
+])
+def test_pragmas_con_valores_no_permitidos(base, pragma, valor):
+    with pytest.raises(ValueError):
+        base.sentencia_pragma(pragma, valor)
+
+
+def test_pragmas_normalizan_los_valores(base):
+    assert base.sentencia_pragma('synchronous', 'normal') == 'PRAGMA synchronous=NORMAL'
+    assert base.sentencia_pragma('mmap_size', '4096') == 'PRAGMA mmap_size=4096'
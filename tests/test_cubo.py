@@ -0,0 +1,119 @@
+import pytest
+
+# Columna de cada dimensión y expresión de cada medida, para calcular el pivote en SQL
+COLUMNAS_SQL = {
+    'producto': 'g.producto_id',
+    'categoria': 'p.categoria_id',
+    'vendedor': 'v.vendedor_id',
+    'cliente': 'v.cliente_id',
+    'lugar_entrega': 'v.lugar_entrega_id',
+    'estado': "coalesce(v.estado, '')",
+    'dia': 'g.fecha_local',
+    'mes': 'substr(g.fecha_local, 1, 7)'
+}
+MEDIDAS_SQL = {
+    'ganancia': 'sum(g.ganancia_total)',
+    'cantidad': 'sum(g.cantidad_vendida)',
+    'ingresos': 'sum(g.precio_venta * g.cantidad_vendida)',
+    'registros': 'count(*)'
+}
+
+
+def pivote_sql(base, por, medidas, condicion='', parametros=()):
+    """El mismo pivote con un GROUP BY directo sobre ganancias: {claves: medidas}"""
+    columnas = [COLUMNAS_SQL[dimension] for dimension in por]
+    sql = (f"SELECT {', '.join(columnas + [MEDIDAS_SQL[medida] for medida in medidas])} "
+           'FROM ganancias g JOIN venta v ON v.id = g.venta_id JOIN producto p ON p.id = g.producto_id '
+           f'WHERE g.cantidad_vendida > 0 {condicion}')
+    if columnas:
+        sql += f" GROUP BY {', '.join(columnas)}"
+    filas = base.db.session.connection().exec_driver_sql(sql, parametros).fetchall()
+    return {tuple(fila[:len(por)]): tuple(pytest.approx(valor) for valor in fila[len(por):])
+            for fila in filas if fila[len(por)] is not None}
+
+
+def pivote_cubo(base, por, medidas, filtros=None, desde=None, hasta=None):
+    grupos = base.cubo_ganancias.pivotar(por, medidas, filtros or {}, desde, hasta)
+    return {tuple(grupo[dimension]['id'] if isinstance(grupo[dimension], dict) else grupo[dimension]
+                  for dimension in por): tuple(grupo[medida] for medida in medidas)
+            for grupo in grupos}
+
+
+@pytest.fixture
+def ventas(datos, vender, importar):
+    turron, alfajor = datos['productos']
+    vender({turron: 2, alfajor: 1})
+    vender({turron: 1})
+    importadas, errores = importar([
+        ['2025-01-05', 'Beto', 'Turrón de Doña Pepa', 2, 30, 'vendedor'],
+        ['2025-01-20', 'Carla', 'Alfajor', 1, 5, 'vendedor'],
+        ['2025-02-03', 'Beto', 'Alfajor', 1, 6, 'vendedor'],
+        ['2025-02-03', 'Ana', 'Turrón de Doña Pepa', 1, 28, 'vendedor']
+    ])
+    assert (importadas, errores) == (4, [])
+    return datos
+
+
+@pytest.mark.parametrize('por', [
+    [],
+    ['producto'],
+    ['producto', 'cliente'],
+    ['estado', 'mes'],
+    ['categoria', 'dia', 'vendedor'],
+    ['lugar_entrega', 'cliente', 'producto', 'mes']
+])
+def test_pivote_coincide_con_group_by(base, ventas, por):
+    medidas = list(base.MEDIDAS_CUBO)
+    assert pivote_cubo(base, por, medidas) == pivote_sql(base, por, medidas)
+
+
+def test_pivote_con_filtros_y_rango_de_dias(base, ventas):
+    turron, _ = ventas['productos']
+    medidas = ['ganancia', 'registros']
+
+    cubo = pivote_cubo(base, ['cliente'], medidas, {'producto': [turron]}, '2025-01-01', '2025-01-31')
+
+    assert cubo == pivote_sql(base, ['cliente'], medidas,
+                              "AND g.producto_id = ? AND g.fecha_local BETWEEN '2025-01-01' AND '2025-01-31'",
+                              (turron,))
+    assert len(cubo) == 1
+
+
+def test_pivote_limite_devuelve_los_mayores(base, ventas):
+    grupos = base.cubo_ganancias.pivotar(['cliente'], ['ganancia'], {}, limite=2)
+    esperado = sorted(pivote_sql(base, ['cliente'], ['ganancia']).items(), key=lambda item: -item[1][0].expected)
+
+    assert [grupo['cliente']['id'] for grupo in grupos] == [clave[0] for clave, _ in esperado[:2]]
+
+
+def test_pivote_incluye_las_ventas_nuevas(base, ventas, vender):
+    turron, _ = ventas['productos']
+    pivote_cubo(base, ['producto'], ['cantidad'])
+
+    vender({turron: 2})
+
+    assert pivote_cubo(base, ['producto', 'dia'], ['cantidad', 'ingresos']) == \
+        pivote_sql(base, ['producto', 'dia'], ['cantidad', 'ingresos'])
+
+
+def test_pivote_se_reconstruye_al_eliminar_un_producto(base, ventas, cliente_http):
+    _, alfajor = ventas['productos']
+    pivote_cubo(base, ['producto'], ['ganancia'])
+
+    cliente_http.get(f'/productos/eliminar/{alfajor}')
+
+    cubo = pivote_cubo(base, ['producto', 'mes'], ['ganancia', 'registros'])
+    assert cubo == pivote_sql(base, ['producto', 'mes'], ['ganancia', 'registros'])
+    assert all(clave[0] != alfajor for clave in cubo)
+
+
+def test_pivote_muestra_los_nombres_actualizados(base, ventas):
+    turron, _ = ventas['productos']
+    base.cubo_ganancias.pivotar(['producto'], ['ganancia'], {})
+
+    base.db.session.get(base.Producto, turron).nombre = 'Turrón especial'
+    base.db.session.commit()
+
+    nombres = {grupo['producto']['id']: grupo['producto']['nombre']
+               for grupo in base.cubo_ganancias.pivotar(['producto'], ['ganancia'], {})}
+    assert nombres[turron] == 'Turrón especial'
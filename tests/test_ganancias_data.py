@@ -0,0 +1,73 @@
+def pedir(cliente_http, cursor=None, etag=None):
+    return cliente_http.get('/ganancias/data', query_string={'since': cursor} if cursor else None,
+                            headers={'If-None-Match': etag} if etag else None)
+
+
+def test_etag_sin_cambios_responde_304(datos, vender, cliente_http):
+    vender({datos['productos'][0]: 1})
+    primera = pedir(cliente_http)
+    assert primera.status_code == 200
+
+    segunda = pedir(cliente_http, primera.json['cursor'], primera.headers['ETag'])
+
+    assert segunda.status_code == 304
+
+
+def test_since_devuelve_solo_lo_nuevo(datos, vender, cliente_http):
+    turron, alfajor = datos['productos']
+    vender({turron: 1})
+    primera = pedir(cliente_http)
+    assert primera.json['completo'] is True
+
+    vender({alfajor: 2})
+    delta = pedir(cliente_http, primera.json['cursor'], primera.headers['ETag'])
+
+    assert delta.status_code == 200
+    assert delta.json['completo'] is False
+    assert [fila['id'] for fila in delta.json['ganancias_por_producto']] == [alfajor]
+    assert len(delta.json['ganancias_tiempo_real']) == 1
+    assert delta.json['ganancias_tiempo_real'][0]['ganancia_venta'] == 6.0
+    assert delta.json['total_hoy'] == 12.0 + 6.0
+
+
+def test_editar_nombre_no_invalida_el_cursor(base, datos, vender, cliente_http):
+    turron, _ = datos['productos']
+    vender({turron: 1})
+    primera = pedir(cliente_http)
+
+    cliente_http.post(f'/productos/editar/{turron}', data={
+        'nombre': 'Turrón especial', 'descripcion': '', 'precio': 30, 'precio_compra': 18,
+        'categoria_id': datos['categoria_id']
+    })
+    delta = pedir(cliente_http, primera.json['cursor'], primera.headers['ETag'])
+
+    assert delta.status_code == 200
+    assert delta.json['completo'] is False
+    assert [fila['nombre'] for fila in delta.json['ganancias_por_producto']] == ['Turrón especial']
+
+
+def test_cambiar_categoria_obliga_a_recargar(base, datos, vender, cliente_http):
+    turron, _ = datos['productos']
+    vender({turron: 1})
+    primera = pedir(cliente_http)
+    otra = base.Categoria(nombre='Dulces')
+    base.db.session.add(otra)
+    base.db.session.commit()
+
+    cliente_http.post(f'/productos/editar/{turron}', data={
+        'nombre': 'Turrón de Doña Pepa', 'descripcion': '', 'precio': 30, 'precio_compra': 18,
+        'categoria_id': otra.id
+    })
+    delta = pedir(cliente_http, primera.json['cursor'], primera.headers['ETag'])
+
+    assert delta.json['completo'] is True
+
+
+def test_eliminar_producto_obliga_a_recargar_el_stream(base, datos, vender, cliente_http):
+    turron, alfajor = datos['productos']
+    vender({turron: 1, alfajor: 1})
+    ultimo_evento = base.canal_ganancias.ultimo_id
+
+    cliente_http.get(f'/productos/eliminar/{alfajor}')
+
+    assert base.canal_ganancias.esperar(ultimo_evento, timeout=0) is None
@@ -0,0 +1,18 @@
+from datetime import datetime
+
+from test_resumenes import assert_resumenes_cuadran
+
+
+def test_importacion_registra_las_ganancias_en_el_dia_de_la_venta(base, datos, importar):
+    importadas, errores = importar([
+        ['2025-01-05', 'Beto', 'Turrón de Doña Pepa', 2, 30, 'vendedor'],
+        [datetime(2025, 1, 6, 23, 30), 'Carla', 'Alfajor', 1, 5, 'vendedor']
+    ])
+
+    assert (importadas, errores) == (2, [])
+    for ganancia in base.Ganancias.query:
+        assert ganancia.fecha == ganancia.venta.fecha
+        assert ganancia.fecha_local == ganancia.venta.fecha_local
+    dias = {fila.fecha.isoformat() for fila in base.GananciasDiarias.query}
+    assert dias == {'2025-01-05', '2025-01-06'}
+    assert_resumenes_cuadran(base)
@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+
+def crear_base_antigua(base, ruta):
+    """Base como las anteriores a las migraciones: user_version 0, sin fecha_local, sin
+    índices nuevos ni resúmenes, con una venta ya registrada"""
+    engine = create_engine(f'sqlite:///{ruta}', poolclass=NullPool)
+    base.db.metadata.create_all(engine)
+    engine.dispose()
+
+    conexion = sqlite3.connect(ruta)
+    conexion.execute('PRAGMA journal_mode=DELETE')
+    for tabla in ['ganancias_por_producto', 'ganancias_diarias', 'ganancias_serie', 'version_datos', 'contador']:
+        conexion.execute(f'DROP TABLE {tabla}')
+    for (indice,) in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'").fetchall():
+        conexion.execute(f'DROP INDEX {indice}')
+    conexion.execute('ALTER TABLE venta DROP COLUMN fecha_local')
+    conexion.execute('ALTER TABLE ganancias DROP COLUMN fecha_local')
+    conexion.executescript("""
+        INSERT INTO usuario (id, username, email, password_hash) VALUES (1, 'vendedor', 'v@example.com', 'x');
+        INSERT INTO categoria (id, nombre) VALUES (1, 'Turrones');
+        INSERT INTO producto (id, nombre, precio, precio_compra, categoria_id) VALUES (1, 'Turrón', 30, 18, 1);
+        INSERT INTO cliente (id, nombre, telefono) VALUES (1, 'Ana', '');
+        INSERT INTO lugar_entrega (id, nombre, direccion, telefono, tipo) VALUES (1, 'Tienda', '', '', 'tienda');
+        INSERT INTO venta (id, fecha, total, cliente_id, lugar_entrega_id, vendedor_id, estado)
+            VALUES (1, '2025-01-06 04:30:00.000000', 60, 1, 1, 1, 'abonado');
+        INSERT INTO ganancias (id, producto_id, venta_id, cantidad_vendida, precio_venta, precio_compra,
+                               ganancia_unitaria, ganancia_total, fecha)
+            VALUES (1, 1, 1, 2, 30, 18, 12, 24, '2025-01-06 04:30:00.000000');
+    """)
+    conexion.commit()
+    conexion.close()
+
+
+def test_migraciones_desde_la_version_cero(base, tmp_path):
+    ruta = str(tmp_path / 'antigua.db')
+    crear_base_antigua(base, ruta)
+    engine = create_engine(f'sqlite:///{ruta}', poolclass=NullPool)
+    try:
+        # Al arrancar, create_all crea las tablas nuevas y las migraciones el resto
+        base.db.metadata.create_all(engine)
+        assert base.version_esquema(engine) == 0
+
+        aplicadas = base.aplicar_migraciones(engine)
+        base.poblar_resumenes_si_faltan(engine)
+
+        assert aplicadas == len(base.MIGRACIONES)
+        assert base.version_esquema(engine) == base.MIGRACIONES[-1][0]
+        with engine.connect() as conexion:
+            # 04:30 UTC es el 5 de enero en Lima
+            assert conexion.exec_driver_sql('SELECT fecha_local FROM ganancias').scalar() == '2025-01-05'
+            assert conexion.exec_driver_sql(
+                "SELECT valor FROM contador WHERE nombre = 'venta'").scalar() == 1
+            assert conexion.exec_driver_sql(
+                "SELECT ganancia_total FROM ganancias_serie WHERE granularidad = 'mes' AND dimension = 'total'"
+            ).scalar() == 24
+            indices = {fila[0] for fila in conexion.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            assert {'ix_ganancias_producto_fecha', 'ix_ganancias_fecha_local', 'ix_venta_fecha_id'} <= indices
+
+        # Volver a aplicarlas no hace nada
+        assert base.aplicar_migraciones(engine) == 0
+    finally:
+        engine.dispose()
+
+
+def tablas_de_prueba(base):
+    with base.db.engine.connect() as conexion:
+        return sorted(fila[0] for fila in conexion.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'prueba%'"))
+
+
+def test_migraciones_se_aplican_en_orden_desde_la_version_guardada(base, monkeypatch):
+    monkeypatch.setattr(base, 'MIGRACIONES', [
+        (version, f'prueba {version}', [f'CREATE TABLE prueba_{version} (id INTEGER)'])
+        for version in range(1, 5)
+    ])
+    with base.db.engine.begin() as conexion:
+        conexion.exec_driver_sql('PRAGMA user_version = 2')
+
+    assert base.aplicar_migraciones() == 2
+    assert tablas_de_prueba(base) == ['prueba_3', 'prueba_4']
+    assert base.version_esquema() == 4
+
+
+def test_migracion_fallida_no_deja_nada_a_medias(base, monkeypatch):
+    monkeypatch.setattr(base, 'MIGRACIONES', [
+        (1, 'prueba', ['CREATE TABLE prueba (id INTEGER)', 'INSERT INTO tabla_que_no_existe VALUES (1)'])
+    ])
+    with base.db.engine.begin() as conexion:
+        conexion.exec_driver_sql('PRAGMA user_version = 0')
+
+    with pytest.raises(Exception, match='tabla_que_no_existe'):
+        base.aplicar_migraciones()
+    # El DDL también se deshace: la migración corregida se aplica desde cero
+    assert base.version_esquema() == 0
+    assert tablas_de_prueba(base) == []
+
+    monkeypatch.setattr(base, 'MIGRACIONES', [(1, 'prueba', ['CREATE TABLE prueba (id INTEGER)'])])
+    assert base.aplicar_migraciones() == 1
+    assert base.version_esquema() == 1
+
+
+def test_migracion_de_columna_en_una_base_nueva(base):
+    # create_all ya crea fecha_local: la migración 5 no debe fallar al volver a aplicarla
+    with base.db.engine.begin() as conexion:
+        conexion.exec_driver_sql('PRAGMA user_version = 4')
+
+    assert base.aplicar_migraciones() == len(base.MIGRACIONES) - 4
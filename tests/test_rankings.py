@@ -0,0 +1,119 @@
+from datetime import date
+
+import pytest
+
+
+def ranking(base, dimension, ventana, metrica='ganancia'):
+    base.rankings_ventas.sincronizar()
+    return {fila['id']: (pytest.approx(fila['ganancia']), fila['cantidad'])
+            for fila in base.rankings_ventas.primeros(dimension, ventana, metrica, limite=100)}
+
+
+def ranking_sql(base, columna, desde=None, hasta=None):
+    """Totales por miembro calculados con SQL en los días locales [desde, hasta)"""
+    condicion, parametros = '', ()
+    if desde:
+        condicion, parametros = 'AND g.fecha_local >= ? AND g.fecha_local < ?', (desde, hasta)
+    filas = base.db.session.connection().exec_driver_sql(
+        f'SELECT {columna}, sum(g.ganancia_total), sum(g.cantidad_vendida) '
+        'FROM ganancias g JOIN venta v ON v.id = g.venta_id '
+        f'WHERE g.cantidad_vendida > 0 {condicion} GROUP BY {columna}', parametros).fetchall()
+    return {clave: (pytest.approx(ganancia), cantidad) for clave, ganancia, cantidad in filas}
+
+
+@pytest.fixture
+def hoy(base, monkeypatch):
+    """Fija el día local que ven los rankings"""
+    def fijar(dia):
+        monkeypatch.setattr(base, 'hoy_local', lambda: dia)
+    return fijar
+
+
+@pytest.fixture
+def ventas(datos, importar):
+    importadas, errores = importar([
+        ['2025-01-30', 'Beto', 'Turrón de Doña Pepa', 2, 30, 'vendedor'],
+        ['2025-01-31', 'Carla', 'Alfajor', 1, 5, 'vendedor'],
+        ['2025-01-31', 'Beto', 'Turrón de Doña Pepa', 1, 30, 'vendedor'],
+        ['2025-02-01', 'Carla', 'Turrón de Doña Pepa', 3, 28, 'vendedor']
+    ])
+    assert (importadas, errores) == (4, [])
+    return datos
+
+
+def test_ventanas_historico_mes_y_hoy(base, ventas, hoy):
+    hoy(date(2025, 1, 31))
+
+    assert ranking(base, 'cliente', 'historico') == ranking_sql(base, 'v.cliente_id')
+    # El mes va del 1 al último día: la venta de febrero no entra aunque sea posterior
+    assert ranking(base, 'cliente', 'mes') == ranking_sql(base, 'v.cliente_id', '2025-01-01', '2025-02-01')
+    assert ranking(base, 'producto', 'hoy') == ranking_sql(base, 'g.producto_id', '2025-01-31', '2025-02-01')
+    assert len(ranking(base, 'producto', 'hoy')) == 2
+
+
+def test_ventanas_coinciden_entre_carga_e_incremental(base, datos, importar, hoy):
+    hoy(date(2025, 1, 31))
+    ranking(base, 'producto', 'mes')
+
+    importar([
+        ['2025-01-31', 'Beto', 'Alfajor', 1, 5, 'vendedor'],
+        ['2025-02-01', 'Carla', 'Turrón de Doña Pepa', 1, 30, 'vendedor']
+    ])
+    incremental = {ventana: ranking(base, 'producto', ventana) for ventana in base.VENTANAS_RANKING}
+    base.rankings_ventas.reiniciar()
+
+    assert {ventana: ranking(base, 'producto', ventana) for ventana in base.VENTANAS_RANKING} == incremental
+    assert incremental['mes'] == ranking_sql(base, 'g.producto_id', '2025-01-01', '2025-02-01')
+
+
+def test_medianoche_vacia_solo_la_ventana_del_dia(base, ventas, importar, hoy):
+    hoy(date(2025, 1, 30))
+    ranking(base, 'producto', 'hoy')
+
+    hoy(date(2025, 1, 31))
+    importar([['2025-01-31', 'Ana', 'Alfajor', 1, 5, 'vendedor']])
+
+    _, alfajor = ventas['productos']
+    assert set(ranking(base, 'producto', 'hoy')) == {alfajor}
+    assert ranking(base, 'producto', 'mes') == ranking_sql(base, 'g.producto_id', '2025-01-01', '2025-02-01')
+
+
+def test_cambio_de_mes_vacia_el_mes_y_el_dia(base, ventas, importar, hoy):
+    hoy(date(2025, 1, 31))
+    assert ranking(base, 'vendedor', 'mes')
+
+    hoy(date(2025, 2, 2))
+    assert ranking(base, 'vendedor', 'mes') == {}
+    assert ranking(base, 'vendedor', 'hoy') == {}
+    assert ranking(base, 'vendedor', 'historico') == ranking_sql(base, 'v.vendedor_id')
+
+    importar([['2025-02-02', 'Ana', 'Alfajor', 1, 5, 'vendedor']])
+    assert ranking(base, 'vendedor', 'hoy') == ranking_sql(base, 'v.vendedor_id', '2025-02-02', '2025-02-03')
+    assert base.rankings_ventas.estadisticas()['periodos']['mes'] == ('2025-02-01', '2025-03-01')
+
+
+def test_eliminar_ganancias_recarga_los_rankings(base, ventas, cliente_http, hoy):
+    hoy(date(2025, 1, 31))
+    turron, alfajor = ventas['productos']
+    assert set(ranking(base, 'producto', 'historico')) == {turron, alfajor}
+
+    cliente_http.get(f'/productos/eliminar/{alfajor}')
+
+    assert set(ranking(base, 'producto', 'historico')) == {turron}
+    assert ranking(base, 'cliente', 'historico') == ranking_sql(base, 'v.cliente_id')
+
+
+def test_tabla_posiciones_desempata_por_clave(base):
+    tabla = base.TablaPosiciones()
+    tabla.sumar(3, [10.0, 1, 10.0])
+    tabla.sumar(1, [10.0, 2, 5.0])
+    tabla.sumar(2, [4.0, 2, 4.0])
+
+    assert [clave for clave, _ in tabla.primeros('ganancia', 10)] == [1, 3, 2]
+    assert [clave for clave, _ in tabla.primeros('cantidad', 10)] == [1, 2, 3]
+
+    # Al sumar se mueve de posición sin dejar entradas repetidas
+    tabla.sumar(2, [6.0, 0, 6.0])
+    assert [clave for clave, _ in tabla.primeros('ganancia', 10)] == [1, 2, 3]
+    assert tabla.primeros('ganancia', 1) == [(1, [10.0, 2, 5.0])]
+    assert all(len(lista) == 3 for lista in tabla.ordenadas.values())
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+import pytest
+
+from test_migraciones import crear_base_antigua
+from test_resumenes import assert_resumenes_cuadran
+
+
+def test_restaurar_respaldo_anterior_a_las_migraciones(base, tmp_path):
+    ruta = str(tmp_path / 'respaldo.db')
+    crear_base_antigua(base, ruta)
+
+    base.preparar_base_restaurada(ruta)
+
+    conexion = sqlite3.connect(ruta)
+    try:
+        assert conexion.execute('PRAGMA user_version').fetchone()[0] == base.MIGRACIONES[-1][0]
+        assert conexion.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+        assert conexion.execute(
+            'SELECT ganancia_total, cantidad_vendida, registros FROM ganancias_por_producto').fetchall() == [(24, 2, 1)]
+        assert conexion.execute('SELECT fecha, ganancia_diaria FROM ganancias_diarias').fetchall() == [('2025-01-05', 24)]
+    finally:
+        conexion.close()
+
+
+def test_restaurar_instantanea_reemplaza_la_base(base, datos, vender, almacen):
+    turron, alfajor = datos['productos']
+    vender({turron: 2})
+    nombre = base.crear_respaldo_automatico()
+    reinicio = base.obtener_version('ganancias_reinicio')
+    # Lo que se vende después del respaldo no debe sobrevivir a la restauración
+    vender({alfajor: 1})
+    base.cubo_ganancias.pivotar(['producto'], ['ganancia'], {}, None, None, None)
+
+    base.restaurar_instantanea(nombre)
+
+    assert base.Venta.query.count() == 1
+    assert base.obtener_contadores()['venta'] == 1
+    assert base.db.session.get(base.Stock, alfajor).cantidad_disponible == 3
+    assert base.db.session.get(base.GananciasPorProducto, alfajor) is None
+    assert_resumenes_cuadran(base)
+    assert base.obtener_version('ganancias_reinicio') > reinicio
+    assert base.cubo_ganancias.filas == 0
+    # El pool nuevo vuelve a abrir la base en WAL y la base quedó íntegra
+    with base.db.engine.connect() as conexion:
+        assert conexion.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conexion.exec_driver_sql('PRAGMA integrity_check').scalar() == 'ok'
+    # Y antes de reemplazarla se respaldó la base actual
+    assert len(base.listar_instantaneas()) == 2
+
+
+def test_restaurar_con_una_conexion_abierta_no_toca_la_base(base, datos, vender, almacen):
+    turron, alfajor = datos['productos']
+    vender({turron: 2})
+    nombre = base.crear_respaldo_automatico()
+    vender({alfajor: 1})
+
+    # Otra conexión (p. ej. otro proceso) impide cerrar el WAL
+    otra = sqlite3.connect(base.ruta_base_datos())
+    otra.execute('SELECT count(*) FROM venta').fetchone()
+    try:
+        with pytest.raises(RuntimeError, match='WAL'):
+            base.restaurar_instantanea(nombre)
+    finally:
+        otra.close()
+
+    assert base.Venta.query.count() == 2
+    assert not os.path.exists(base.ruta_base_datos() + '.restaurando')
@@ -0,0 +1,82 @@
+import pytest
+
+
+def totales_por_producto(base):
+    """Resumen por producto calculado directamente desde Ganancias"""
+    Ganancias = base.Ganancias
+    filas = base.db.session.query(
+        Ganancias.producto_id,
+        base.db.func.sum(Ganancias.ganancia_total),
+        base.db.func.sum(Ganancias.cantidad_vendida),
+        base.db.func.count(Ganancias.id)
+    ).filter(Ganancias.cantidad_vendida > 0).group_by(Ganancias.producto_id).all()
+    return {producto_id: (pytest.approx(ganancia), cantidad, registros)
+            for producto_id, ganancia, cantidad, registros in filas}
+
+
+def totales_por_dia(base):
+    """Resumen diario calculado directamente desde Ganancias"""
+    Ganancias = base.Ganancias
+    filas = base.db.session.query(
+        Ganancias.fecha_local,
+        base.db.func.sum(Ganancias.ganancia_total),
+        base.db.func.sum(Ganancias.cantidad_vendida),
+        base.db.func.count(Ganancias.id)
+    ).filter(Ganancias.cantidad_vendida > 0).group_by(Ganancias.fecha_local).all()
+    return {dia: (pytest.approx(ganancia), cantidad, registros) for dia, ganancia, cantidad, registros in filas}
+
+
+def assert_resumenes_cuadran(base):
+    por_producto = {fila.producto_id: (fila.ganancia_total, fila.cantidad_vendida, fila.registros)
+                    for fila in base.GananciasPorProducto.query.filter(base.GananciasPorProducto.registros > 0)}
+    assert por_producto == totales_por_producto(base)
+
+    por_dia = {fila.fecha: (fila.ganancia_diaria, fila.cantidad_vendida, fila.registros)
+               for fila in base.GananciasDiarias.query.filter(base.GananciasDiarias.registros > 0)}
+    assert por_dia == totales_por_dia(base)
+
+    # Cada granularidad de la serie total suma lo mismo que todas las ganancias
+    total = base.db.session.query(base.db.func.sum(base.Ganancias.ganancia_total)).filter(
+        base.Ganancias.cantidad_vendida > 0).scalar() or 0
+    for granularidad in base.GRANULARIDADES:
+        suma = base.db.session.query(base.db.func.sum(base.GananciasSerie.ganancia_total)).filter_by(
+            granularidad=granularidad, dimension='total').scalar() or 0
+        assert suma == pytest.approx(total)
+
+
+def test_resumenes_cuadran_tras_ventas(base, datos, vender):
+    turron, alfajor = datos['productos']
+
+    vender({turron: 2, alfajor: 1})
+    vender({turron: 3})
+
+    assert_resumenes_cuadran(base)
+    assert base.db.session.get(base.GananciasPorProducto, turron).ganancia_total == pytest.approx(5 * 12.0)
+
+
+def test_reconstruir_resumenes_coincide_con_los_incrementales(base, datos, vender, importar):
+    turron, alfajor = datos['productos']
+    vender({turron: 1, alfajor: 2})
+    importar([['2025-03-01', 'Beto', 'Turrón de Doña Pepa', 2, 28, 'vendedor']])
+
+    def foto():
+        series = base.db.session.query(base.GananciasSerie.granularidad, base.GananciasSerie.dimension,
+                                       base.GananciasSerie.clave, base.GananciasSerie.periodo,
+                                       base.GananciasSerie.ganancia_total, base.GananciasSerie.registros)
+        return sorted(series.all())
+
+    incrementales = foto()
+    base.reconstruir_resumenes_ganancias()
+
+    assert foto() == incrementales
+    assert_resumenes_cuadran(base)
+
+
+def test_eliminar_producto_lo_descuenta_de_los_resumenes(base, datos, vender, cliente_http):
+    turron, alfajor = datos['productos']
+    vender({turron: 2, alfajor: 1})
+
+    cliente_http.get(f'/productos/eliminar/{alfajor}')
+
+    assert base.db.session.get(base.GananciasPorProducto, alfajor) is None
+    assert_resumenes_cuadran(base)
@@ -0,0 +1,42 @@
+def stock_de(base, producto_id):
+    return base.db.session.query(base.Stock.cantidad_disponible).filter_by(producto_id=producto_id).scalar()
+
+
+def test_venta_descuenta_stock_y_registra_ganancias(base, datos, vender):
+    turron, alfajor = datos['productos']
+
+    respuesta = vender({turron: 4, alfajor: 3})
+
+    assert respuesta.status_code == 302
+    assert stock_de(base, turron) == 6
+    assert stock_de(base, alfajor) == 0
+    venta = base.Venta.query.one()
+    assert venta.total == 4 * 30.0 + 3 * 5.0
+    ganancias = {g.producto_id: g for g in base.Ganancias.query.filter_by(venta_id=venta.id)}
+    assert ganancias[turron].ganancia_total == 4 * 12.0
+    assert ganancias[alfajor].ganancia_total == 3 * 3.0
+
+
+def test_sobreventa_se_rechaza_sin_vender_nada(base, datos, vender):
+    turron, alfajor = datos['productos']
+
+    # Al alfajor le falta stock: tampoco se descuenta el turrón
+    respuesta = vender({turron: 2, alfajor: 4})
+
+    assert respuesta.status_code == 302
+    assert respuesta.headers['Location'].endswith('/ventas/nueva')
+    assert stock_de(base, turron) == 10
+    assert stock_de(base, alfajor) == 3
+    assert base.Venta.query.count() == 0
+    assert base.Ganancias.query.count() == 0
+    assert base.GananciasPorProducto.query.count() == 0
+
+
+def test_ventas_sucesivas_no_dejan_el_stock_negativo(base, datos, vender):
+    _, alfajor = datos['productos']
+
+    vender({alfajor: 2})
+    vender({alfajor: 2})
+
+    assert stock_de(base, alfajor) == 1
+    assert base.Venta.query.count() == 1
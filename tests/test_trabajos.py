@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.fixture
+def trabajo_ajeno(base, datos):
+    otro = base.Usuario(username='otro', email='otro@example.com')
+    otro.set_password('123456')
+    base.db.session.add(otro)
+    base.db.session.flush()
+    trabajo = base.Trabajo(tipo='exportar_ventas', estado='completado', progreso=100, usuario_id=otro.id)
+    base.db.session.add(trabajo)
+    base.db.session.commit()
+    return trabajo.id
+
+
+def test_trabajo_propio_se_puede_consultar(base, datos, cliente_http):
+    trabajo = base.Trabajo(tipo='exportar_ventas', estado='en_proceso', progreso=40, mensaje='Escribiendo filas',
+                           usuario_id=datos['vendedor_id'])
+    base.db.session.add(trabajo)
+    base.db.session.commit()
+
+    respuesta = cliente_http.get(f'/jobs/{trabajo.id}')
+
+    assert respuesta.status_code == 200
+    assert (respuesta.json['progreso'], respuesta.json['mensaje']) == (40, 'Escribiendo filas')
+
+
+@pytest.mark.parametrize('ruta', ['/jobs/{}', '/jobs/{}/ver', '/jobs/{}/descargar'])
+def test_trabajo_de_otro_usuario_no_existe(cliente_http, trabajo_ajeno, ruta):
+    assert cliente_http.get(ruta.format(trabajo_ajeno)).status_code == 404